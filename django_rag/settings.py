@@ -1,4 +1,5 @@
 from pathlib import Path
+import json
 import os
 from dotenv import load_dotenv
 
@@ -24,6 +25,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rag_app.metrics.MetricsMiddleware',  # first, so request latency covers the other middleware
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -40,8 +42,14 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # compiled templates are kept in memory for the life of the process (runserver resets them on edit)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -77,9 +85,42 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, os.getenv("MEDIA_ROOT", "media"))
 os.makedirs(MEDIA_ROOT, exist_ok=True)
+# Page previews (/api/docs/<id>/pages/<n>/image/): cached variants, allowed widths, WebP/JPEG quality, browser cache lifetime
+THUMBNAIL_DIR = os.path.join(MEDIA_ROOT, 'thumbs')
+THUMBNAIL_WIDTHS = tuple(int(w) for w in os.getenv("THUMBNAIL_WIDTHS", "160,320,640,1280").split(','))
+THUMBNAIL_DEFAULT_WIDTH = int(os.getenv("THUMBNAIL_DEFAULT_WIDTH", "320"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_MAX_AGE = int(os.getenv("THUMBNAIL_MAX_AGE", str(365 * 24 * 3600)))
+# gc_media: cached previews older than this are dropped (0 keeps them); files younger than the grace period are never touched
+THUMBNAIL_RETENTION_DAYS = int(os.getenv("THUMBNAIL_RETENTION_DAYS", "30"))
+MEDIA_GC_GRACE_HOURS = float(os.getenv("MEDIA_GC_GRACE_HOURS", "24"))
+# Hand file bodies to the web server: X-Accel-Redirect (nginx, internal location MEDIA_SENDFILE_PREFIX aliased to
+# MEDIA_ROOT) or X-Sendfile (Apache / lighttpd, absolute path). Empty: Django streams them with FileResponse.
+MEDIA_SENDFILE_HEADER = os.getenv("MEDIA_SENDFILE_HEADER", "")
+MEDIA_SENDFILE_PREFIX = os.getenv("MEDIA_SENDFILE_PREFIX", "/protected-media/")
+
+# Admin changelists of tables bigger than this show an estimated total instead of running COUNT(*) when unfiltered
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.getenv("ADMIN_ESTIMATED_COUNT_THRESHOLD", "100000"))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache (local memory by default; point CACHE_BACKEND/CACHE_LOCATION at Redis or Memcached to share it across processes)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Validated sessions are cached this long; last_activity is written at most once per interval
+SESSION_CACHE_TTL = int(os.getenv('SESSION_CACHE_TTL', '60'))
+SESSION_ACTIVITY_INTERVAL = int(os.getenv('SESSION_ACTIVITY_INTERVAL', '300'))
+
+# Session reaper (`manage.py cleanup_sessions --daemon`): inactive rows older than the retention are deleted
+SESSION_CLEANUP_BATCH_SIZE = int(os.getenv('SESSION_CLEANUP_BATCH_SIZE', '1000'))
+SESSION_RETENTION_DAYS = int(os.getenv('SESSION_RETENTION_DAYS', '30'))
+SESSION_REAPER_INTERVAL = int(os.getenv('SESSION_REAPER_INTERVAL', '300'))
+
 # Custom User Model
 AUTH_USER_MODEL = 'rag_app.CustomUser'
 
@@ -95,19 +136,123 @@ REST_FRAMEWORK = {
 # Chroma/OpenAI
 CHROMA_DIR = os.path.join(BASE_DIR, os.getenv("CHROMA_DIR", ".chroma"))
 CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "pdf_openai")
+# single | per_user | sharded (see rag_app/store.py); re-shard existing data with `manage.py reshard_chroma`
+CHROMA_LAYOUT = os.getenv("CHROMA_LAYOUT", "single")
+CHROMA_SHARDS = int(os.getenv("CHROMA_SHARDS", "16"))
+# Uploads: rejected above this many bytes (checked from Content-Length, then while streaming) or pages (0: no limit)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_MAX_PAGES = int(os.getenv("UPLOAD_MAX_PAGES", "500"))
+# Reuse Vision output and vectors of identical pages already extracted for another document (of any user)
+SHARED_EXTRACTION_ENABLED = os.getenv("SHARED_EXTRACTION_ENABLED", "True").lower() == "true"
+# `manage.py reindex_chroma`: parallel embedding requests while building a new collection generation
+REINDEX_WORKERS = int(os.getenv("REINDEX_WORKERS", "4"))
+
+# Vector backend: chroma | numpy (in-process, memory-mapped per-user matrices, see rag_app/numpy_store.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+NUMPY_STORE_DIR = os.path.join(BASE_DIR, os.getenv("NUMPY_STORE_DIR", ".vectors"))
+NUMPY_STORE_DTYPE = os.getenv("NUMPY_STORE_DTYPE", "float32")  # float32 | float16
+NUMPY_STORE_INDEX = os.getenv("NUMPY_STORE_INDEX", "flat")  # flat | ivf
+NUMPY_STORE_IVF_MIN_VECTORS = int(os.getenv("NUMPY_STORE_IVF_MIN_VECTORS", "4096"))
+NUMPY_STORE_IVF_NPROBE = int(os.getenv("NUMPY_STORE_IVF_NPROBE", "8"))
+# none | int8 | binary: search quantized codes in RAM, then rescore RESCORE_FACTOR * top_k candidates at full precision
+NUMPY_STORE_QUANTIZATION = os.getenv("NUMPY_STORE_QUANTIZATION", "none")
+NUMPY_STORE_RESCORE_FACTOR = int(os.getenv("NUMPY_STORE_RESCORE_FACTOR", "4"))
 
 OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-large")
+# Optional Matryoshka truncation (embeddings API `dimensions`), e.g. 1024 or 256; changing it requires a re-index
+OPENAI_EMBEDDING_DIMENSIONS = int(os.getenv("OPENAI_EMBEDDING_DIMENSIONS")) if os.getenv("OPENAI_EMBEDDING_DIMENSIONS") else None
 OPENAI_VISION_MODEL = os.getenv("OPENAI_VISION_MODEL", "gpt-4o")
 OPENAI_LLM_MODEL = os.getenv("OPENAI_LLM_MODEL", "gpt-4o")
 
+# Chat / vision providers (rag_app/openai_helpers.py). Users pick one with preferred_llm; Gemini is called
+# through its OpenAI-compatible endpoint. On errors or slowness requests fail over to the next configured provider.
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/openai/")
+GEMINI_LLM_MODEL = os.getenv("GEMINI_LLM_MODEL", "gemini-2.5-flash")
+GEMINI_VISION_MODEL = os.getenv("GEMINI_VISION_MODEL", "gemini-2.5-flash")
+LLM_PROVIDERS = [p.strip() for p in os.getenv("LLM_PROVIDERS", "openai,gemini").split(",") if p.strip()]  # failover order
+LLM_DEFAULT_PROVIDER = os.getenv("LLM_DEFAULT_PROVIDER", "openai")
+LLM_VISION_PROVIDER = os.getenv("LLM_VISION_PROVIDER", "openai")
+LLM_FALLBACK_ENABLED = os.getenv("LLM_FALLBACK_ENABLED", "True").lower() == "true"
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))  # seconds per attempt
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))  # client retries before failing over
+LLM_FAILURE_THRESHOLD = int(os.getenv("LLM_FAILURE_THRESHOLD", "3"))  # consecutive errors before a provider is skipped
+LLM_SLOW_THRESHOLD_MS = float(os.getenv("LLM_SLOW_THRESHOLD_MS", "15000"))  # average latency above which it is skipped; 0 disables
+LLM_COOLDOWN_SECONDS = float(os.getenv("LLM_COOLDOWN_SECONDS", "30"))
+
+# Model routing (rag_app/routing.py choose_route): canned replies for pure chit-chat, the small model for other
+# chit-chat, low-context turns and short confident lookups, the full-size model for retrieval-heavy questions
+OPENAI_SMALL_LLM_MODEL = os.getenv("OPENAI_SMALL_LLM_MODEL", "gpt-4o-mini")
+GEMINI_SMALL_LLM_MODEL = os.getenv("GEMINI_SMALL_LLM_MODEL", "gemini-2.0-flash")
+LLM_ROUTING_ENABLED = os.getenv("LLM_ROUTING_ENABLED", "True").lower() == "true"
+LLM_CANNED_REPLIES = os.getenv("LLM_CANNED_REPLIES", "True").lower() == "true"
+LLM_ROUTE_LARGE_PROMPT_TOKENS = int(os.getenv("LLM_ROUTE_LARGE_PROMPT_TOKENS", "2500"))  # prompts this big always use the full model
+LLM_ROUTE_MIN_SCORE = float(os.getenv("LLM_ROUTE_MIN_SCORE", "0.2"))  # best hit below this: nothing relevant retrieved
+LLM_ROUTE_CONFIDENT_SCORE = float(os.getenv("LLM_ROUTE_CONFIDENT_SCORE", "0.55"))
+LLM_ROUTE_SHORT_QUESTION_WORDS = int(os.getenv("LLM_ROUTE_SHORT_QUESTION_WORDS", "12"))
+LLM_ROUTING_LOG = os.getenv("LLM_ROUTING_LOG", "True").lower() == "true"
+LLM_QUERY_REWRITE = os.getenv("LLM_QUERY_REWRITE", "False").lower() == "true"  # rewrite follow-ups with the small model before retrieval
+
+# Prompt layout for provider prompt caching (rag_app/prompts.py)
+PROMPT_PINNED_CONTEXT_TOKENS = int(os.getenv("PROMPT_PINNED_CONTEXT_TOKENS", "8000"))  # send whole pinned docs up to this size; 0 disables
+PROMPT_HISTORY_STEP = int(os.getenv("PROMPT_HISTORY_STEP", "4"))  # history window start moves in steps of this many messages
+
+# Context packing (rag_app/packing.py): merge adjacent chunks, drop near-duplicates, trim hits to the question's sentences
+CONTEXT_PACKING_ENABLED = os.getenv("CONTEXT_PACKING_ENABLED", "True").lower() == "true"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))  # retrieved passages per answer; 0 = no trimming
+CONTEXT_SIMHASH_DISTANCE = int(os.getenv("CONTEXT_SIMHASH_DISTANCE", "3"))  # max differing bits of near-duplicates
+CONTEXT_MIN_HIT_TOKENS = int(os.getenv("CONTEXT_MIN_HIT_TOKENS", "40"))  # hits are dropped rather than cut below this
+
+# Chit-chat vs. document routing (rag_app/routing.py): rules | nb (naive Bayes decides when rules are unsure)
+INTENT_CLASSIFIER = os.getenv("INTENT_CLASSIFIER", "rules")
+INTENT_RULE_CONFIDENCE = float(os.getenv("INTENT_RULE_CONFIDENCE", "0.8"))
+
+# Batch retrieval (POST /api/retrieve/batch/)
+BATCH_RETRIEVAL_MAX_QUERIES = int(os.getenv("BATCH_RETRIEVAL_MAX_QUERIES", "50"))
+BATCH_SYNTHESIS_CONCURRENCY = int(os.getenv("BATCH_SYNTHESIS_CONCURRENCY", "4"))
+
+# Instrumentation (rag_app/metrics.py): stage timers, trace ids, GET /metrics in Prometheus format
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'False').lower() == 'true'
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'False').lower() == 'true'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # when set, /metrics requires "Authorization: Bearer <token>"
+
+# OpenAI usage accounting (rag_app/usage.py): buffered writes of one row per API call
+USAGE_TRACKING_ENABLED = os.getenv('USAGE_TRACKING_ENABLED', 'True').lower() == 'true'
+USAGE_BUFFER_SIZE = int(os.getenv('USAGE_BUFFER_SIZE', '100'))
+USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', '5'))  # seconds; 0 disables the background flusher
+USAGE_RETENTION_DAYS = int(os.getenv('USAGE_RETENTION_DAYS', '90'))
+# USD per million (input, output[, cached input]) tokens; override with OPENAI_PRICES_JSON='{"model": [in, out, cached]}'
+OPENAI_PRICES = {
+    'gpt-4o': (2.50, 10.00, 1.25),
+    'gpt-4o-mini': (0.15, 0.60, 0.075),
+    'gpt-4.1': (2.00, 8.00, 0.50),
+    'gpt-4.1-mini': (0.40, 1.60, 0.10),
+    'text-embedding-3-large': (0.13, 0.0),
+    'text-embedding-3-small': (0.02, 0.0),
+    'gemini-2.0-flash': (0.10, 0.40, 0.025),
+    'gemini-2.5-flash': (0.30, 2.50, 0.075),
+    'gemini-2.5-pro': (1.25, 10.00, 0.31),
+    **json.loads(os.getenv('OPENAI_PRICES_JSON', '{}')),
+}
+
 # Email Configuration
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')  # locmem/console for dev and tests
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', '587'))
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')  # App password for Gmail
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', EMAIL_HOST_USER)
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', '30'))
+
+# Email outbox (rag_app/outbox.py), drained by `python manage.py send_queued_email`
+EMAIL_QUEUE_BATCH_SIZE = int(os.getenv('EMAIL_QUEUE_BATCH_SIZE', '50'))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_RETRY_BASE_DELAY = int(os.getenv('EMAIL_RETRY_BASE_DELAY', '30'))  # seconds, doubled per attempt
+EMAIL_RETRY_MAX_DELAY = int(os.getenv('EMAIL_RETRY_MAX_DELAY', '3600'))
+EMAIL_CLAIM_TIMEOUT = int(os.getenv('EMAIL_CLAIM_TIMEOUT', '600'))  # reclaim rows a dead worker left in 'sending'
+EMAIL_WORKER_INTERVAL = float(os.getenv('EMAIL_WORKER_INTERVAL', '2'))
+EMAIL_CONNECTION_IDLE_TIMEOUT = int(os.getenv('EMAIL_CONNECTION_IDLE_TIMEOUT', '60'))
 
 # Frontend URL for email verification
 FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:3000')
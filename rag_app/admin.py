@@ -1,5 +1,66 @@
+import re
+from django.conf import settings
 from django.contrib import admin
-from .models import Document, Conversation, Message, CustomUser, UserSession, EmailVerificationToken, PasswordResetToken, MessageSource
+from django.contrib.auth.base_user import BaseUserManager
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Substr
+from django.utils import timezone
+from django.utils.functional import cached_property
+from . import search
+from .models import Document, Conversation, Message, CustomUser, UserSession, EmailVerificationToken, PasswordResetToken, MessageSource, OutboundEmail, OpenAIUsage, OpenAIUsageDaily, DocumentPage, Blob
+
+# ASCII digits that fit a 64-bit id column; anything else ("²", 30 digits) is searched as text
+ID_SEARCH_RE = re.compile(r'\d{1,18}', re.ASCII)
+
+def estimated_rows(model) -> int:
+	"""Cheap row estimate for a whole table: the planner statistics on PostgreSQL/MySQL, the highest id elsewhere."""
+	table = model._meta.db_table
+	with connection.cursor() as cursor:
+		if connection.vendor == 'postgresql':
+			cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+		elif connection.vendor == 'mysql':
+			cursor.execute('SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s', [table])
+		else:
+			cursor.execute(f'SELECT MAX({connection.ops.quote_name(model._meta.pk.column)}) FROM {connection.ops.quote_name(table)}')
+		row = cursor.fetchone()
+	return max(0, int(row[0] or 0)) if row else 0
+
+class EstimatedCountPaginator(Paginator):
+	"""Uses estimated_rows() instead of COUNT(*) for an unfiltered changelist of a table past ADMIN_ESTIMATED_COUNT_THRESHOLD rows."""
+
+	@cached_property
+	def count(self):
+		query = getattr(self.object_list, 'query', None)
+		if query is not None and not query.where:
+			estimate = estimated_rows(self.object_list.model)
+			if estimate > settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+				return estimate
+		return super().count
+
+class LargeTableAdmin(admin.ModelAdmin):
+	"""
+	Changelist for tables that grow without bound: no second COUNT(*) for the "N total" link,
+	an estimated count when nothing is filtered, and searches for an id or an email answered
+	from indexes instead of a LIKE scan over every search field.
+	"""
+	paginator = EstimatedCountPaginator
+	show_full_result_count = False
+	ordering = ('-pk',)  # newest first, straight off the primary key index
+	id_search_fields = ('pk',)
+	email_search_field = None
+
+	def get_search_results(self, request, queryset, search_term):
+		term = search_term.strip()
+		if ID_SEARCH_RE.fullmatch(term):
+			q = Q()
+			for field in self.id_search_fields:
+				q |= Q(**{field: int(term)})
+			return queryset.filter(q), False
+		if self.email_search_field and '@' in term and ' ' not in term:
+			return queryset.filter(**{self.email_search_field: BaseUserManager.normalize_email(term)}), False
+		return super().get_search_results(request, queryset, search_term)
 
 @admin.register(CustomUser)
 class CustomUserAdmin(admin.ModelAdmin):
@@ -9,51 +70,117 @@ class CustomUserAdmin(admin.ModelAdmin):
 	readonly_fields = ('date_joined', 'last_login')
 
 @admin.register(UserSession)
-class UserSessionAdmin(admin.ModelAdmin):
+class UserSessionAdmin(LargeTableAdmin):
 	list_display = ('user', 'ip_address', 'created_at', 'last_activity', 'expires_at', 'is_active')
 	list_filter = ('is_active', 'created_at', 'expires_at')
 	search_fields = ('user__email', 'ip_address')
+	search_help_text = 'An id or a user email is looked up directly; other text matches email and IP address.'
+	id_search_fields = ('pk', 'user_id')
+	email_search_field = 'user__email'
 	readonly_fields = ('created_at', 'last_activity')
+	list_select_related = ('user',)
+	autocomplete_fields = ('user',)
 	date_hierarchy = 'created_at'
 
 @admin.register(Document)
-class DocumentAdmin(admin.ModelAdmin):
+class DocumentAdmin(LargeTableAdmin):
 	list_display = ('original_name', 'owner', 'created_at')
 	list_filter = ('created_at',)
 	search_fields = ('original_name', 'owner__email')
+	id_search_fields = ('pk', 'owner_id')
+	email_search_field = 'owner__email'
 	readonly_fields = ('created_at',)
+	list_select_related = ('owner',)
+	autocomplete_fields = ('owner',)
+
+@admin.register(DocumentPage)
+class DocumentPageAdmin(LargeTableAdmin):
+	list_display = ('document', 'page', 'chunk_count', 'extraction_model', 'extraction_ms', 'extracted_at')
+	list_filter = ('extraction_model', 'extracted_at')
+	search_fields = ('document__original_name', 'extracted_text')
+	search_help_text = 'A number is looked up as a page or document id; other text matches document name and page text.'
+	id_search_fields = ('pk', 'document_id')
+	list_select_related = ('document',)
+	autocomplete_fields = ('document',)
+	readonly_fields = ('content_hash', 'image_hash', 'image_path', 'extraction_model', 'extraction_ms', 'extracted_at', 'updated_at')
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+	list_display = ('sha256', 'kind', 'ref_count', 'size', 'created_at')
+	list_filter = ('kind',)
+	search_fields = ('sha256',)
+	readonly_fields = ('kind', 'sha256', 'name', 'size', 'ref_count', 'created_at', 'updated_at')
 
 @admin.register(Conversation)
-class ConversationAdmin(admin.ModelAdmin):
+class ConversationAdmin(LargeTableAdmin):
 	list_display = ('title', 'owner', 'created_at')
 	list_filter = ('created_at',)
 	search_fields = ('title', 'owner__email')
+	id_search_fields = ('pk', 'owner_id')
+	email_search_field = 'owner__email'
 	readonly_fields = ('created_at',)
+	list_select_related = ('owner',)
+	autocomplete_fields = ('owner',)
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
+class MessageAdmin(LargeTableAdmin):
 	list_display = ('conversation', 'role', 'content_preview', 'created_at')
 	list_filter = ('role', 'created_at')
 	search_fields = ('content', 'conversation__title')
+	search_help_text = 'A number is looked up as a message or conversation id and an email as the owner; other text searches message content.'
+	id_search_fields = ('pk', 'conversation_id')
+	email_search_field = 'conversation__owner__email'
 	readonly_fields = ('created_at',)
-	
+	list_select_related = ('conversation',)
+	autocomplete_fields = ('conversation',)
+
+	def get_search_results(self, request, queryset, search_term):
+		term = search_term.strip()
+		if term and not ID_SEARCH_RE.fullmatch(term) and not ('@' in term and ' ' not in term):
+			q = search.message_filter(term)
+			if q is not None:
+				# the full-text index instead of a LIKE scan over every message
+				return queryset.filter(q), False
+		return super().get_search_results(request, queryset, search_term)
+
+	def get_queryset(self, request):
+		qs = super().get_queryset(request)
+		if request.resolver_match and request.resolver_match.url_name.endswith('_changelist'):
+			# the list only shows a preview: don't fetch whole answers
+			qs = qs.defer('content').annotate(preview=Substr('content', 1, 101))
+		return qs
+
 	def content_preview(self, obj):
-		return obj.content[:100] + '...' if len(obj.content) > 100 else obj.content
+		content = getattr(obj, 'preview', None)
+		if content is None:
+			content = obj.content
+		return content[:100] + '...' if len(content) > 100 else content
 	content_preview.short_description = 'Content Preview'
 
 @admin.register(MessageSource)
-class MessageSourceAdmin(admin.ModelAdmin):
+class MessageSourceAdmin(LargeTableAdmin):
 	list_display = ('message', 'document', 'page', 'source')
-	list_filter = ('page',)
 	search_fields = ('source', 'snippet')
+	search_help_text = 'A number is looked up as a source, message or document id; other text scans source and snippet.'
+	id_search_fields = ('pk', 'message_id', 'document_id')
+	list_select_related = ('message', 'document')
+	autocomplete_fields = ('message', 'document')
 	readonly_fields = ()
 
+	def get_queryset(self, request):
+		qs = super().get_queryset(request)
+		if request.resolver_match and request.resolver_match.url_name.endswith('_changelist'):
+			qs = qs.defer('snippet', 'message__content')
+		return qs
+
 @admin.register(EmailVerificationToken)
 class EmailVerificationTokenAdmin(admin.ModelAdmin):
 	list_display = ('user', 'created_at', 'expires_at', 'is_used')
 	list_filter = ('is_used', 'created_at', 'expires_at')
 	search_fields = ('user__email',)
 	readonly_fields = ('created_at',)
+	list_select_related = ('user',)
+	autocomplete_fields = ('user',)
 
 @admin.register(PasswordResetToken)
 class PasswordResetTokenAdmin(admin.ModelAdmin):
@@ -61,3 +188,38 @@ class PasswordResetTokenAdmin(admin.ModelAdmin):
 	list_filter = ('is_used', 'created_at', 'expires_at')
 	search_fields = ('user__email',)
 	readonly_fields = ('created_at',)
+	list_select_related = ('user',)
+	autocomplete_fields = ('user',)
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(LargeTableAdmin):
+	list_display = ('to_email', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at')
+	list_filter = ('status', 'created_at')
+	search_fields = ('to_email', 'subject')
+	readonly_fields = ('created_at', 'sent_at', 'locked_at', 'claim', 'last_error')
+	actions = ['retry_now']
+
+	def retry_now(self, request, queryset):
+		updated = queryset.exclude(status=OutboundEmail.STATUS_SENT).update(
+			status=OutboundEmail.STATUS_PENDING, next_attempt_at=timezone.now(), attempts=0, locked_at=None
+		)
+		self.message_user(request, f"{updated} emails queued for retry")
+	retry_now.short_description = 'Retry selected emails now'
+
+@admin.register(OpenAIUsage)
+class OpenAIUsageAdmin(LargeTableAdmin):
+	list_display = ('created_at', 'endpoint', 'model', 'user', 'document', 'conversation', 'prompt_tokens', 'completion_tokens', 'cached_tokens', 'latency_ms', 'cost_usd', 'success')
+	list_filter = ('endpoint', 'model', 'success')
+	search_fields = ('trace_id',)
+	date_hierarchy = 'created_at'
+	list_select_related = ('user', 'document', 'conversation')
+	raw_id_fields = ('user', 'document', 'conversation')
+	readonly_fields = ('created_at',)
+
+@admin.register(OpenAIUsageDaily)
+class OpenAIUsageDailyAdmin(LargeTableAdmin):
+	list_display = ('day', 'endpoint', 'model', 'user', 'document', 'calls', 'errors', 'prompt_tokens', 'completion_tokens', 'cached_tokens', 'cost_usd')
+	list_filter = ('endpoint', 'model')
+	date_hierarchy = 'day'
+	list_select_related = ('user', 'document')
+	raw_id_fields = ('user', 'document')
@@ -0,0 +1,23 @@
+"""
+Offline benchmarks, run through `python manage.py benchmark <suite>`.
+
+Each suite module exposes `add_arguments(parser)` and `run(options) -> list[dict]`;
+every result row is a flat, JSON-serialisable dict so runs can be diffed over time.
+"""
+import math
+
+def percentile(samples: list[float], p: float) -> float:
+    """Nearest-rank percentile of a list of samples (p in 0..100)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(p / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+def latency_summary(samples_ms: list[float]) -> dict:
+    return {
+        'p50_ms': round(percentile(samples_ms, 50), 3),
+        'p95_ms': round(percentile(samples_ms, 95), 3),
+        'p99_ms': round(percentile(samples_ms, 99), 3),
+        'mean_ms': round(sum(samples_ms) / len(samples_ms), 3) if samples_ms else 0.0,
+    }
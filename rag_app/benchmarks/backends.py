@@ -0,0 +1,73 @@
+"""Single-tenant search latency and recall of the vector backends (Chroma vs. in-process NumPy)."""
+import shutil
+import tempfile
+import time
+import numpy as np
+from rag_app.numpy_store import NumpyStore, topk_indices
+from rag_app.store import ChromaStore
+from . import latency_summary
+
+# name -> factory(tmp dir); the NumPy variants cover storage dtype and the IVF index
+BACKENDS = {
+    'chroma': lambda tmp: ChromaStore(path=tmp, collection='bench', layout='single'),
+    'numpy-f32': lambda tmp: NumpyStore(path=tmp, dtype='float32', index='flat'),
+    'numpy-f16': lambda tmp: NumpyStore(path=tmp, dtype='float16', index='flat'),
+    'numpy-ivf': lambda tmp: NumpyStore(path=tmp, dtype='float32', index='ivf', ivf_min_vectors=1),
+}
+
+def add_arguments(parser):
+    parser.add_argument('--sizes', default='1000,10000,50000', help='Comma-separated vectors per tenant')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='Comma-separated backends to compare')
+    parser.add_argument('--dim', type=int, default=256, help='Vector dimensionality')
+    parser.add_argument('--queries', type=int, default=200, help='Timed queries per backend and size')
+    parser.add_argument('--top-k', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+
+def clustered_corpus(rng, n, dim, clusters=64, spread=0.35):
+    """Unit vectors drawn around random centres, closer to real embeddings than uniform noise."""
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    x = centres[rng.integers(0, clusters, size=n)] + spread * rng.standard_normal((n, dim)).astype(np.float32) / np.sqrt(dim) * 4
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+def run(options) -> list[dict]:
+    sizes = [int(s) for s in str(options['sizes']).split(',') if s.strip()]
+    names = [b.strip() for b in str(options['backends']).split(',') if b.strip()]
+    k = options['top_k']
+    rows = []
+    for size in sizes:
+        rng = np.random.default_rng(options['seed'])
+        corpus = clustered_corpus(rng, size + options['queries'], options['dim'])
+        base, queries = corpus[:size], corpus[size:]
+        # exact answers for recall, by text since ids differ per backend
+        exact = [set(topk_indices(base @ q, k).tolist()) for q in queries]
+        chunks = [{'text': f"c{i}", 'page': i} for i in range(size)]
+
+        for name in names:
+            tmp = tempfile.mkdtemp(prefix='bench-backend-')
+            try:
+                store = BACKENDS[name](tmp)
+                t0 = time.perf_counter()
+                store.upsert_chunks(user_id=1, document_id=1, chunks=chunks, embeddings=base)
+                build_s = time.perf_counter() - t0
+                store.query_by_vector(1, queries[0], top_k=k)  # warm up / load snapshot
+
+                samples, recalls = [], []
+                for q, truth in zip(queries, exact):
+                    t = time.perf_counter()
+                    hits = store.query_by_vector(1, q, top_k=k)
+                    samples.append((time.perf_counter() - t) * 1000.0)
+                    got = {int(h['text'][1:]) for h in hits}
+                    recalls.append(len(got & truth) / float(len(truth) or 1))
+                rows.append({
+                    'suite': 'backends',
+                    'backend': name,
+                    'vectors': size,
+                    'dim': options['dim'],
+                    'build_s': round(build_s, 2),
+                    f'recall@{k}': round(float(np.mean(recalls)), 4),
+                    **latency_summary(samples),
+                })
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+    return rows
@@ -0,0 +1,204 @@
+"""
+Deterministic offline stand-ins for the OpenAI API and synthetic PDFs.
+
+FakeOpenAI mimics the parts of the client this app uses (chat.completions.create,
+including Vision and streaming requests, and embeddings.create) with configurable
+latency and failure rate, and simulates prefix prompt caching (cached_tokens in the
+usage, counted for message prefixes seen before). install() puts it behind an openai_helpers provider
+('openai' by default, or 'gemini'), so the real vision_extract / synthesize_answer /
+embed_texts code paths, including provider failover, run unchanged.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from functools import lru_cache
+from types import SimpleNamespace
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+from rag_app import openai_helpers
+
+WORDS = (
+    'revenue invoice contract clause payment schedule warranty liability section table figure report '
+    'quarter growth margin customer supplier delivery product service policy employee benefit risk '
+    'compliance audit budget forecast project milestone summary appendix total amount date '
+    'agreement party term notice renewal termination price discount region market analysis result'
+).split()
+ENDPOINTS = ('chat', 'vision', 'embeddings')
+
+class FakeAPIError(Exception):
+    """Raised by FakeOpenAI for injected failures."""
+
+def synthetic_text(seed: int, words: int) -> str:
+    rng = random.Random(seed)
+    out, line = [], []
+    for i in range(words):
+        line.append(rng.choice(WORDS))
+        if len(line) >= 12:
+            out.append(' '.join(line).capitalize() + '.')
+            line = []
+    if line:
+        out.append(' '.join(line).capitalize() + '.')
+    return '\n'.join(out)
+
+@lru_cache(maxsize=4096)
+def _token_vector(token: str, dim: int) -> np.ndarray:
+    return np.random.default_rng(zlib.crc32(token.encode())).standard_normal(dim).astype(np.float32)
+
+def fake_embedding(text: str, dim: int) -> list[float]:
+    """Hashed bag-of-words vector: stable across runs and similar for texts sharing words."""
+    v = np.zeros(dim, dtype=np.float32)
+    for token in (text or '').lower().split():
+        v += _token_vector(token.strip('.,'), dim)
+    n = np.linalg.norm(v)
+    if n == 0:
+        v = _token_vector('<empty>', dim)
+        n = np.linalg.norm(v)
+    return (v / n).tolist()
+
+class FakeOpenAI:
+    """Drop-in for the OpenAI client methods used by rag_app.openai_helpers."""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, failure_rate: float = 0.0,
+                 fail_endpoints=('chat', 'vision'), dim: int = 256, words_per_page: int = 250,
+                 answer_words: int = 60, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.fail_endpoints = set(fail_endpoints)
+        self.dim = dim
+        self.words_per_page = words_per_page
+        self.answer_words = answer_words
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = {name: 0 for name in ENDPOINTS}
+        self.failures = {name: 0 for name in ENDPOINTS}
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._prefixes = set()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    def _enter(self, endpoint: str):
+        with self._lock:
+            self.calls[endpoint] += 1
+            delay = self.latency_ms + self._rng.uniform(0, self.jitter_ms)
+            fail = endpoint in self.fail_endpoints and self._rng.random() < self.failure_rate
+            if fail:
+                self.failures[endpoint] += 1
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if fail:
+            raise FakeAPIError(f"injected {endpoint} failure")
+
+    @staticmethod
+    def _image_of(messages) -> str | None:
+        for msg in messages:
+            if isinstance(msg.get('content'), list):
+                for part in msg['content']:
+                    if part.get('type') == 'image_url':
+                        return part['image_url']['url']
+        return None
+
+    def _cached_tokens(self, messages) -> int:
+        """Tokens of the longest message prefix sent before, counted like OpenAI: from 1024 on, in 128-token steps."""
+        digest, size, keys = hashlib.sha1(), 0, []
+        for m in messages:
+            digest.update(json.dumps(m, sort_keys=True).encode())
+            size += len(json.dumps(m.get('content'))) // 4
+            keys.append((digest.hexdigest(), size))
+        with self._lock:
+            hit = max((n for key, n in keys if key in self._prefixes), default=0)
+            if len(self._prefixes) > 100_000:
+                self._prefixes.clear()
+            self._prefixes.update(key for key, _ in keys)
+        return hit // 128 * 128 if hit >= 1024 else 0
+
+    def _chat(self, model=None, messages=(), **kwargs):
+        image = self._image_of(messages)
+        endpoint = 'vision' if image else 'chat'
+        self._enter(endpoint)
+        prompt_chars = sum(len(json.dumps(m.get('content'))) for m in messages)
+        cached = self._cached_tokens(messages)
+        with self._lock:
+            self.prompt_tokens += prompt_chars // 4
+            self.cached_tokens += cached
+        if image:
+            seed = int(hashlib.md5(image.encode()).hexdigest()[:8], 16)
+            content = json.dumps({
+                'extracted_text': synthetic_text(seed, self.words_per_page),
+                'description': synthetic_text(seed + 1, 20),
+            })
+        else:
+            seed = zlib.crc32(json.dumps(messages[-1].get('content')).encode()) if messages else 0
+            content = synthetic_text(seed, self.answer_words)
+        usage = SimpleNamespace(prompt_tokens=prompt_chars // 4, completion_tokens=len(content) // 4,
+                                total_tokens=(prompt_chars + len(content)) // 4,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=min(cached, prompt_chars // 4)))
+        if kwargs.get('stream'):
+            return self._stream(model, content, usage)
+        return SimpleNamespace(model=model, usage=usage,
+                               choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason='stop')])
+
+    @staticmethod
+    def _stream(model, content: str, usage):
+        for piece in content.split(' '):
+            delta = SimpleNamespace(content=piece + ' ')
+            yield SimpleNamespace(model=model, usage=None, choices=[SimpleNamespace(delta=delta, finish_reason=None)])
+        yield SimpleNamespace(model=model, usage=usage, choices=[])
+
+    def _embed(self, model=None, input=(), dimensions=None, **kwargs):
+        self._enter('embeddings')
+        texts = [input] if isinstance(input, str) else list(input)
+        dim = dimensions or self.dim
+        data = [SimpleNamespace(index=i, embedding=fake_embedding(t, dim)) for i, t in enumerate(texts)]
+        tokens = sum(len(t) for t in texts) // 4
+        return SimpleNamespace(model=model, data=data, usage=SimpleNamespace(prompt_tokens=tokens, total_tokens=tokens))
+
+class FakeChromaEmbeddingFunction(EmbeddingFunction):
+    """Chroma embedding function that routes through a FakeOpenAI client."""
+
+    def __init__(self, client: FakeOpenAI):
+        self.client = client
+
+    def __call__(self, input):
+        resp = self.client.embeddings.create(input=list(input))
+        return [np.asarray(d.embedding, dtype=np.float32) for d in resp.data]
+
+    @staticmethod
+    def name() -> str:
+        return 'fake-openai'
+
+    def get_config(self) -> dict:
+        return {}
+
+    @staticmethod
+    def build_from_config(config):
+        return FakeChromaEmbeddingFunction(FakeOpenAI())
+
+@contextmanager
+def install(client: FakeOpenAI, provider: str = 'openai'):
+    """Serve `provider` (and for 'openai' also get_client()) from `client`, with fresh health state, for the block."""
+    p = openai_helpers.get_provider(provider)
+    previous = p._client, p.health
+    p._client, p.health = client, openai_helpers.ProviderHealth()
+    try:
+        yield client
+    finally:
+        p._client, p.health = previous
+
+def synthetic_pdf(path: str, pages: int, words_per_page: int = 250, seed: int = 0) -> str:
+    """Write a text PDF of `pages` pages with reproducible content; returns the path."""
+    import fitz  # PyMuPDF
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 60), f"Section {n + 1}", fontsize=16)
+        page.insert_textbox(fitz.Rect(72, 80, 540, 760), synthetic_text(seed * 100_003 + n, words_per_page), fontsize=10)
+        page.draw_rect(fitz.Rect(72, 700, 300, 760), color=(0.2, 0.3, 0.8), fill=(0.85, 0.9, 1.0))
+    doc.save(path)
+    doc.close()
+    return path
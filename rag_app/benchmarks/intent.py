@@ -0,0 +1,91 @@
+"""Accuracy and latency of chit-chat vs. document routing on the labeled set."""
+import random
+import time
+from rag_app.routing import NaiveBayesIntent, classify_intent, load_labeled_examples
+from . import latency_summary
+
+LEGACY_PATTERNS = [
+    'hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening', 'how are you', 'how do you do',
+    'nice to meet you', 'pleasure to meet you', 'greetings', 'good day', 'thank you', 'thanks',
+    'thank you so much', 'thanks a lot', 'appreciate it', 'grateful', 'bless you', "you're the best",
+    'awesome', 'great job', 'excellent', 'fantastic', 'wonderful', 'amazing', 'perfect', 'goodbye', 'bye',
+    'see you', 'see you later', 'take care', 'have a good day', 'good night', 'goodbye for now',
+    'talk to you later', 'farewell', 'until next time', 'see you soon', "how's it going", "what's up", 'sup',
+    'how are things', 'everything ok', 'are you ok', 'are you there', 'can you hear me', 'are you working',
+    'how are you doing', "what's new", "how's everything", "how's life", 'ok', 'okay', 'alright', 'sure',
+    'yes', 'yeah', 'yep', 'got it', 'understood', 'i see', 'i understand', 'noted', 'roger',
+]
+
+def legacy_is_generic(text: str) -> bool:
+    """The substring matcher routing used before rag_app.routing, kept as a baseline."""
+    t = text.lower().strip()
+    if any(p in t for p in LEGACY_PATTERNS):
+        return True
+    if len(t.split()) <= 3:
+        return True
+    if any(w in t for w in ['you', 'your', 'yourself']) and len(t.split()) <= 5:
+        return True
+    return t in ['ok', 'okay', 'yes', 'no', 'maybe', 'sure', 'alright', 'fine']
+
+def add_arguments(parser):
+    parser.add_argument('--folds', type=int, default=5, help='Cross-validation folds for the naive Bayes classifier')
+    parser.add_argument('--repeat', type=int, default=20, help='Timing repetitions over the labeled set')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--show-errors', action='store_true', help='Include misrouted examples in the results')
+
+def _score(name, examples, predict, repeat, show_errors):
+    tp = fp = fn = tn = 0
+    errors = []
+    for ex in examples:
+        chit = predict(ex)
+        truth = ex['label'] == 'chitchat'
+        if chit and truth: tp += 1
+        elif chit and not truth: fp += 1
+        elif truth: fn += 1
+        else: tn += 1
+        if chit != truth:
+            errors.append(ex['text'])
+    samples = []
+    for _ in range(repeat):
+        for ex in examples:
+            t = time.perf_counter()
+            predict(ex)
+            samples.append((time.perf_counter() - t) * 1000.0)
+    row = {
+        'suite': 'intent',
+        'router': name,
+        'examples': len(examples),
+        'accuracy': round((tp + tn) / len(examples), 4),
+        # document questions sent to chit-chat skip retrieval and get a wrong answer
+        'misrouted_document_questions': fp,
+        'chitchat_recall': round(tp / float(tp + fn or 1), 4),
+        'p50_us': round(1000 * latency_summary(samples)['p50_ms'], 2),
+        'p99_us': round(1000 * latency_summary(samples)['p99_ms'], 2),
+    }
+    if show_errors:
+        row['errors'] = errors
+    return row
+
+def run(options) -> list[dict]:
+    examples = load_labeled_examples()
+    rows = [
+        _score('legacy', examples, lambda ex: legacy_is_generic(ex['text']), options['repeat'], options['show_errors']),
+        _score('rules', examples, lambda ex: classify_intent(ex['text'], mode='rules').is_chitchat, options['repeat'], options['show_errors']),
+    ]
+    # naive Bayes is scored out-of-fold so it is never evaluated on its own training data
+    shuffled = list(enumerate(examples))
+    random.Random(options['seed']).shuffle(shuffled)
+    folds = max(2, options['folds'])
+    models = {}
+    for f in range(folds):
+        held = {i for n, (i, _) in enumerate(shuffled) if n % folds == f}
+        model = NaiveBayesIntent([ex for i, ex in enumerate(examples) if i not in held])
+        for i in held:
+            models[i] = model
+    index = {id(ex): i for i, ex in enumerate(examples)}
+    rows.append(_score(
+        'rules+nb', examples,
+        lambda ex: classify_intent(ex['text'], mode='nb', model=models[index[id(ex)]]).is_chitchat,
+        options['repeat'], options['show_errors'],
+    ))
+    return rows
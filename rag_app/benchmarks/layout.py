@@ -0,0 +1,83 @@
+"""Query latency of the Chroma collection layouts against total corpus size."""
+import shutil
+import tempfile
+import time
+import numpy as np
+from rag_app.store import ChromaStore, LAYOUTS
+from . import latency_summary
+
+def add_arguments(parser):
+    parser.add_argument('--sizes', default='5000,20000,50000', help='Comma-separated total corpus sizes (vectors)')
+    parser.add_argument('--users', type=int, default=200, help='Number of tenants the corpus is spread over')
+    parser.add_argument('--layouts', default=','.join(LAYOUTS), help='Comma-separated layouts to compare')
+    parser.add_argument('--shards', type=int, default=16, help='Shard count for the sharded layout')
+    parser.add_argument('--dim', type=int, default=256, help='Vector dimensionality')
+    parser.add_argument('--queries', type=int, default=200, help='Timed queries per layout and size')
+    parser.add_argument('--top-k', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+
+def _unit(rng, n, dim):
+    v = rng.standard_normal((n, dim)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+def _build(store, rng, size, users, dim, batch=5000):
+    written = 0
+    while written < size:
+        n = min(batch, size - written)
+        vecs = _unit(rng, n, dim)
+        uids = rng.integers(1, users + 1, size=n)
+        groups = {}
+        for i, uid in enumerate(uids):
+            groups.setdefault(store.collection_name(int(uid)), []).append(i)
+        for idxs in groups.values():
+            uid = int(uids[idxs[0]])
+            store.collection_for(uid).add(
+                ids=[f"v{written + i}" for i in idxs],
+                embeddings=vecs[idxs],
+                metadatas=[{'user_id': int(uids[i]), 'document_id': 1, 'page': 1} for i in idxs],
+            )
+        written += n
+
+def run(options) -> list[dict]:
+    sizes = [int(s) for s in str(options['sizes']).split(',') if s.strip()]
+    layouts = [l.strip() for l in str(options['layouts']).split(',') if l.strip()]
+    users, dim = options['users'], options['dim']
+    rows = []
+    for size in sizes:
+        for layout in layouts:
+            rng = np.random.default_rng(options['seed'])
+            tmp = tempfile.mkdtemp(prefix='bench-chroma-')
+            try:
+                store = ChromaStore(path=tmp, collection='bench', layout=layout, shards=options['shards'])
+                t0 = time.perf_counter()
+                _build(store, rng, size, users, dim)
+                build_s = time.perf_counter() - t0
+
+                qvecs = _unit(rng, options['queries'], dim)
+                quids = rng.integers(1, users + 1, size=options['queries'])
+                # warm up every collection a query can hit
+                for uid in set(int(u) for u in quids):
+                    store.collection_for(uid)
+                samples = []
+                for v, uid in zip(qvecs, quids):
+                    uid = int(uid)
+                    t = time.perf_counter()
+                    store.collection_for(uid).query(
+                        query_embeddings=[v],
+                        n_results=options['top_k'],
+                        where=store._scope(uid),
+                        include=['metadatas'],
+                    )
+                    samples.append((time.perf_counter() - t) * 1000.0)
+                rows.append({
+                    'suite': 'layout',
+                    'layout': layout,
+                    'corpus_size': size,
+                    'users': users,
+                    'collections': len(store.layout_collections()),
+                    'build_s': round(build_s, 2),
+                    **latency_summary(samples),
+                })
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+    return rows
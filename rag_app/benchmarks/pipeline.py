@@ -0,0 +1,199 @@
+"""Ingestion and chat hot paths end to end against offline OpenAI stand-ins (render, Vision, split, index, query, chat)."""
+import contextlib
+import io
+import logging
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from rag_app import views
+from rag_app.extract import extract_pdf_pages_as_images
+from rag_app.models import Conversation, CustomUser
+from rag_app.numpy_store import NumpyStore
+from rag_app.openai_helpers import vision_extract
+from rag_app.store import ChromaStore
+from rag_app.textutils import split_for_embedding
+from . import latency_summary
+from .fakes import WORDS, FakeChromaEmbeddingFunction, FakeOpenAI, install, synthetic_pdf
+
+CHITCHAT = ['hello', 'thanks a lot', 'ok got it', 'goodbye', 'how are you']
+
+def add_arguments(parser):
+    parser.add_argument('--docs', type=int, default=3, help='Synthetic PDFs to ingest')
+    parser.add_argument('--pages', type=int, default=10, help='Pages per PDF')
+    parser.add_argument('--words-per-page', type=int, default=250)
+    parser.add_argument('--dpi', type=int, default=200, help='Render DPI (ingestion uses 200)')
+    parser.add_argument('--backend', choices=['chroma', 'numpy'], default='chroma', help='Vector store to index into')
+    parser.add_argument('--dim', type=int, default=256, help='Fake embedding dimensionality')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Simulated latency of every fake OpenAI call')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Extra uniform random latency per call')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of fake calls that raise')
+    parser.add_argument('--fail-endpoints', default='vision,chat', help='Comma-separated endpoints failures apply to (chat,vision,embeddings)')
+    parser.add_argument('--queries', type=int, default=200, help='Timed vector-store queries')
+    parser.add_argument('--chat-requests', type=int, default=50, help='Timed POSTs to the chat endpoint')
+    parser.add_argument('--chitchat-ratio', type=float, default=0.2, help='Share of chat requests that are chit-chat')
+    parser.add_argument('--top-k', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+
+def _question(rng) -> str:
+    return 'what does the ' + ' '.join(rng.choice(WORDS) for _ in range(4)) + ' say?'
+
+def _make_store(backend, tmp, fake):
+    if backend == 'numpy':
+        return NumpyStore(path=tmp, dtype='float32', index='flat')
+    store = ChromaStore(path=tmp, collection='bench', layout='single')
+    store.ef = FakeChromaEmbeddingFunction(fake)
+    return store
+
+@contextlib.contextmanager
+def _quiet_request_log():
+    # injected failures would otherwise log a traceback per 500
+    log = logging.getLogger('django.request')
+    level = log.level
+    log.setLevel(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        log.setLevel(level)
+
+def _rate(count, seconds):
+    return round(count / seconds, 2) if seconds > 0 else 0.0
+
+def run(options) -> list[dict]:
+    rng = random.Random(options['seed'])
+    fake = FakeOpenAI(
+        latency_ms=options['latency_ms'],
+        jitter_ms=options['jitter_ms'],
+        failure_rate=options['failure_rate'],
+        fail_endpoints=[e.strip() for e in options['fail_endpoints'].split(',') if e.strip()],
+        dim=options['dim'],
+        words_per_page=options['words_per_page'],
+        seed=options['seed'],
+    )
+    base = {'suite': 'pipeline', 'backend': options['backend'], 'latency_ms': options['latency_ms'],
+            'failure_rate': options['failure_rate']}
+    rows = []
+    tmp = Path(tempfile.mkdtemp(prefix='bench-pipeline-'))
+    try:
+        # usage rows would be flushed by a background thread outside the rolled-back transaction
+        with install(fake), override_settings(USAGE_TRACKING_ENABLED=False), transaction.atomic():
+            user = CustomUser.objects.create_user(email=f"bench-{time.time_ns()}@example.com", password=None,
+                                                  first_name='Bench', last_name='User')
+            store = _make_store(options['backend'], str(tmp / 'store'), fake)
+
+            pdfs = [synthetic_pdf(str(tmp / f"doc{d}.pdf"), options['pages'], options['words_per_page'], seed=d)
+                    for d in range(options['docs'])]
+
+            # render
+            t0 = time.perf_counter()
+            records = {d: extract_pdf_pages_as_images(p, out_dir=str(tmp / 'media' / 'images'), dpi=options['dpi'])
+                       for d, p in enumerate(pdfs, 1)}
+            render_s = time.perf_counter() - t0
+            pages = sum(len(r) for r in records.values())
+            rows.append({**base, 'stage': 'render', 'pages': pages, 'seconds': round(render_s, 3),
+                         'pages_per_s': _rate(pages, render_s)})
+
+            # vision
+            texts = {}
+            t0 = time.perf_counter()
+            with contextlib.redirect_stderr(io.StringIO()):
+                for d, recs in records.items():
+                    for rec in recs:
+                        info = vision_extract(rec['image_path'])
+                        texts[(d, rec['page'])] = (info.get('extracted_text') or '').strip() or (info.get('description') or '').strip()
+            vision_s = time.perf_counter() - t0
+            rows.append({**base, 'stage': 'vision', 'pages': pages, 'seconds': round(vision_s, 3),
+                         'pages_per_s': _rate(pages, vision_s), 'failures': fake.failures['vision']})
+
+            # split
+            chunks = {d: [] for d in records}
+            t0 = time.perf_counter()
+            for d, recs in records.items():
+                for rec in recs:
+                    for idx, piece in enumerate(split_for_embedding(texts[(d, rec['page'])])):
+                        chunks[d].append({'text': piece, 'page': rec['page'], 'source': rec['source'],
+                                          'image_path': rec['image_path'], 'chunk': idx})
+            split_s = time.perf_counter() - t0
+            n_chunks = sum(len(c) for c in chunks.values())
+            rows.append({**base, 'stage': 'split', 'chunks': n_chunks, 'seconds': round(split_s, 4),
+                         'chunks_per_s': _rate(n_chunks, split_s)})
+
+            # index (embeddings + upsert)
+            calls_before = fake.calls['embeddings']
+            t0 = time.perf_counter()
+            for d, doc_chunks in chunks.items():
+                store.upsert_chunks(user_id=user.id, document_id=d, chunks=doc_chunks)
+            index_s = time.perf_counter() - t0
+            rows.append({**base, 'stage': 'index', 'chunks': n_chunks, 'seconds': round(index_s, 3),
+                         'chunks_per_s': _rate(n_chunks, index_s),
+                         'embedding_calls': fake.calls['embeddings'] - calls_before})
+
+            # query
+            store.query(user_id=user.id, text=_question(rng), top_k=options['top_k'])  # warm up
+            samples = []
+            for _ in range(options['queries']):
+                q = _question(rng)
+                t = time.perf_counter()
+                store.query(user_id=user.id, text=q, top_k=options['top_k'])
+                samples.append((time.perf_counter() - t) * 1000.0)
+            rows.append({**base, 'stage': 'query', 'queries': len(samples), **latency_summary(samples)})
+
+            # chat: the real view, real JWT auth, counting SQL queries per request
+            rows.extend(_chat(options, base, rng, user, store, fake))
+
+            transaction.set_rollback(True)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return rows
+
+def _chat(options, base, rng, user, store, fake) -> list[dict]:
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+    convo = Conversation.objects.create(owner=user, title='bench')
+    url = f"/api/conversations/{convo.id}/messages/"
+    by_kind = {'chitchat': ([], []), 'document': ([], [])}
+    errors = {'chitchat': 0, 'document': 0}
+    tokens = {'chitchat': [0, 0], 'document': [0, 0]}  # prompt, cached
+    with override_settings(ALLOWED_HOSTS=['*']), mock.patch.object(views, 'get_vector_store', lambda *a, **k: store), _quiet_request_log():
+        for _ in range(options['chat_requests']):
+            kind = 'chitchat' if rng.random() < options['chitchat_ratio'] else 'document'
+            text = rng.choice(CHITCHAT) if kind == 'chitchat' else _question(rng)
+            prompt_before, cached_before = fake.prompt_tokens, fake.cached_tokens
+            with CaptureQueriesContext(connection) as queries:
+                t = time.perf_counter()
+                try:
+                    resp = client.post(url, {'message': text, 'top_k': options['top_k']}, format='json')
+                    ok = resp.status_code == 201
+                except Exception:
+                    ok = False
+                elapsed = (time.perf_counter() - t) * 1000.0
+            if not ok:
+                errors[kind] += 1
+                continue
+            by_kind[kind][0].append(elapsed)
+            by_kind[kind][1].append(len(queries.captured_queries))
+            tokens[kind][0] += fake.prompt_tokens - prompt_before
+            tokens[kind][1] += fake.cached_tokens - cached_before
+
+    rows = []
+    for kind, (samples, counts) in by_kind.items():
+        if not samples:
+            continue
+        rows.append({
+            **base,
+            'stage': f'chat-{kind}',
+            'requests': len(samples),
+            'errors': errors[kind],
+            'queries_per_request': round(sum(counts) / len(counts), 2),
+            'max_queries_per_request': max(counts),
+            'prompt_tokens_per_request': round(tokens[kind][0] / len(samples), 1),
+            'cached_prompt_share': round(tokens[kind][1] / tokens[kind][0], 3) if tokens[kind][0] else 0.0,
+            **latency_summary(samples),
+        })
+    return rows
@@ -0,0 +1,89 @@
+"""Recall@k against index memory for embedding truncation and int8/binary quantization."""
+import shutil
+import tempfile
+import time
+import numpy as np
+from rag_app.numpy_store import NumpyStore, topk_indices
+from . import latency_summary
+
+# name -> (dimensions kept, quantization, full-precision dtype)
+CONFIGS = {
+    'f32': (None, 'none', 'float32'),
+    'f16': (None, 'none', 'float16'),
+    'int8': (None, 'int8', 'float32'),
+    'binary': (None, 'binary', 'float32'),
+    'dims/4': (4, 'none', 'float32'),
+    'dims/4+int8': (4, 'int8', 'float32'),
+    'dims/4+binary': (4, 'binary', 'float32'),
+}
+
+def add_arguments(parser):
+    parser.add_argument('--size', type=int, default=20000, help='Vectors in the synthetic corpus')
+    parser.add_argument('--dim', type=int, default=3072, help='Full embedding size (text-embedding-3-large: 3072)')
+    parser.add_argument('--configs', default=','.join(CONFIGS), help='Comma-separated configurations to compare')
+    parser.add_argument('--rescore-factor', type=int, default=4, help='Candidates rescored at full precision, per top_k')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+
+def matryoshka_corpus(rng, n, dim, clusters=64):
+    """
+    Clustered unit vectors whose variance decays along the dimensions, so that (as with
+    Matryoshka-trained embeddings) a prefix of the vector keeps most of the signal.
+    """
+    decay = (1.0 / np.sqrt(1.0 + np.arange(dim) / 64.0)).astype(np.float32)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    x = centres[rng.integers(0, clusters, size=n)] + 0.8 * rng.standard_normal((n, dim)).astype(np.float32)
+    x *= decay
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+def _truncate(x, dims):
+    x = x[:, :dims]
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+def run(options) -> list[dict]:
+    size, dim, k = options['size'], options['dim'], options['top_k']
+    rng = np.random.default_rng(options['seed'])
+    corpus = matryoshka_corpus(rng, size + options['queries'], dim)
+    base, queries = corpus[:size], corpus[size:]
+    # ground truth: exact search over the full-size float32 vectors
+    exact = [set(topk_indices(base @ q, k).tolist()) for q in queries]
+    chunks = [{'text': f"c{i}", 'page': i} for i in range(size)]
+
+    rows = []
+    for name in [c.strip() for c in str(options['configs']).split(',') if c.strip()]:
+        divisor, quantization, dtype = CONFIGS[name]
+        dims = dim // divisor if divisor else dim
+        vecs, qs = (_truncate(base, dims), _truncate(queries, dims)) if divisor else (base, queries)
+        tmp = tempfile.mkdtemp(prefix='bench-quant-')
+        try:
+            store = NumpyStore(path=tmp, dtype=dtype, index='flat', quantization=quantization,
+                               rescore_factor=options['rescore_factor'])
+            store.upsert_chunks(user_id=1, document_id=1, chunks=chunks, embeddings=vecs)
+            state = store._load(1)
+            full_bytes = state['vectors'].dtype.itemsize * dims
+            # what has to sit in RAM for the first pass: the codes if quantized, else the vectors
+            index_bytes = state['codes'].nbytes / size if 'codes' in state else full_bytes
+
+            samples, recalls = [], []
+            for q, truth in zip(qs, exact):
+                t = time.perf_counter()
+                hits = store.query_by_vector(1, q, top_k=k)
+                samples.append((time.perf_counter() - t) * 1000.0)
+                got = {int(h['text'][1:]) for h in hits}
+                recalls.append(len(got & truth) / float(len(truth) or 1))
+            rows.append({
+                'suite': 'quantization',
+                'config': name,
+                'dims': dims,
+                'quantization': quantization,
+                'vectors': size,
+                'index_bytes_per_vector': round(index_bytes, 1),
+                'full_bytes_per_vector': full_bytes,
+                'index_mb_per_million': round(index_bytes * 1e6 / 2**20, 1),
+                f'recall@{k}': round(float(np.mean(recalls)), 4),
+                **latency_summary(samples),
+            })
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return rows
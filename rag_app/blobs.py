@@ -0,0 +1,229 @@
+"""
+Content-addressed storage for uploaded PDFs and rendered page images.
+
+Files live once per content hash at MEDIA_ROOT/blobs/<kind>/<aa>/<sha256><ext>, however
+many documents (of however many owners) use them. Every Document holds a reference to
+its PDF blob and every DocumentPage to its page image blob: acquire() when a row starts
+using a file, release() when it stops. The file is deleted with the last reference,
+together with its cached thumbnails.
+
+Pages are rendered into a per-document staging directory, MEDIA_ROOT/images/<nnn>/<id>/,
+and moved into blob storage as they are extracted. collect_garbage() (`manage.py
+gc_media`) repairs reference counts and removes whatever a crash or an older version left
+behind.
+"""
+import os
+import shutil
+import time
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count, F
+from django.utils import timezone
+from . import thumbnails
+from .models import Blob, Document, DocumentPage, MessageSource
+
+EXTENSIONS = {Blob.PDF: '.pdf', Blob.PAGE: '.png'}
+
+def blob_name(kind: str, sha256: str) -> str:
+    return f"blobs/{kind}/{sha256[:2]}/{sha256}{EXTENSIONS[kind]}"
+
+def pdf_blob_hash(name: str) -> str:
+    """Hash of the PDF blob a Document.file name points at, or '' for files stored before blobs."""
+    sha256 = Path(name or '').stem
+    return sha256 if name and name == blob_name(Blob.PDF, sha256) else ''
+
+def blob_path(kind: str, sha256: str) -> str:
+    return default_storage.path(blob_name(kind, sha256))
+
+def acquire(kind: str, sha256: str, content=None, path: str | None = None) -> Blob:
+    """
+    Add a reference to the blob with this hash. If its file is not stored yet it is taken
+    from `content` (an uploaded File, moved rather than copied when it is a temporary file)
+    or by moving the file at `path`; a `path` that duplicates a stored blob is deleted.
+    """
+    name = blob_name(kind, sha256)
+    blob, _ = Blob.objects.get_or_create(kind=kind, sha256=sha256, defaults={'name': name})
+    # updated_at marks the blob as in use, so collect_garbage() leaves it alone while rows are being written
+    Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1, updated_at=timezone.now())
+    full = default_storage.path(name)
+    if not os.path.exists(full):
+        if content is not None:
+            default_storage.save(name, content)
+        elif path is not None:
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            os.replace(path, full)
+        if os.path.exists(full):
+            Blob.objects.filter(pk=blob.pk).update(size=os.path.getsize(full))
+    elif path is not None and os.path.abspath(path) != full:
+        os.remove(path)
+    return blob
+
+def share(kind: str, hashes) -> None:
+    """Add a reference to blobs that are already stored, e.g. for rows copied from other rows."""
+    for sha256 in hashes:
+        if sha256:
+            Blob.objects.filter(kind=kind, sha256=sha256).update(ref_count=F('ref_count') + 1, updated_at=timezone.now())
+
+def release(kind: str, sha256: str) -> bool:
+    """Drop one reference; deletes the blob and its file when none are left. Returns whether it was deleted."""
+    if not sha256:
+        return False
+    Blob.objects.filter(kind=kind, sha256=sha256).update(ref_count=F('ref_count') - 1)
+    blob = Blob.objects.filter(kind=kind, sha256=sha256, ref_count__lte=0).first()
+    if blob is None:
+        return False
+    # only delete if nobody took a new reference in the meantime
+    deleted, _ = Blob.objects.filter(pk=blob.pk, ref_count__lte=0).delete()
+    if deleted:
+        _delete_blob_file(blob)
+    return bool(deleted)
+
+def _delete_blob_file(blob) -> int:
+    """Remove a blob's file (and thumbnails of a page image); returns bytes freed."""
+    path = default_storage.path(blob.name)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    default_storage.delete(blob.name)
+    if blob.kind == Blob.PAGE:
+        thumbnails.drop_variants(blob.sha256)
+    return size
+
+def render_dir(document_id: int) -> Path:
+    """Staging directory for one document's page renders, sharded so no directory grows without bound."""
+    return Path(settings.MEDIA_ROOT) / 'images' / f"{int(document_id) % 1000:03d}" / str(int(document_id))
+
+def legacy_images(doc) -> list[Path]:
+    """Page images an older version rendered into the flat images/ directory for this document's file."""
+    stem = Path(doc.file.name or '').stem
+    if not stem:
+        return []
+    # the flat layout named images after the file stem, so they may be shared with a same-named upload
+    others = Document.objects.exclude(pk=doc.pk).filter(file__endswith=f"/{stem}.pdf").exists()
+    if others:
+        return []
+    return list((Path(settings.MEDIA_ROOT) / 'images').glob(f"{stem}-page-*.png"))
+
+def release_file(doc) -> None:
+    """Drop a document's reference to its PDF."""
+    # from the file name: Document.sha256 is only set once the document is indexed
+    sha256 = pdf_blob_hash(doc.file.name)
+    if sha256:
+        release(Blob.PDF, sha256)
+    elif doc.file:
+        # uploaded before blobs: the file belongs to this document alone
+        doc.file.delete(save=False)
+
+def release_document(doc) -> None:
+    """Drop the references a document and its pages hold, before the document is deleted."""
+    for image_hash in doc.pages.values_list('image_hash', flat=True):
+        release(Blob.PAGE, image_hash)
+    for path in legacy_images(doc):
+        path.unlink(missing_ok=True)
+    shutil.rmtree(render_dir(doc.id), ignore_errors=True)
+    release_file(doc)
+
+# --- garbage collection ---------------------------------------------------------------
+
+def _files(root: Path):
+    if root.exists():
+        for path in root.rglob('*'):
+            if path.is_file():
+                yield path
+
+def _prune_dirs(root: Path):
+    """Remove empty directories below root, deepest first."""
+    if not root.exists():
+        return
+    for path in sorted((p for p in root.rglob('*') if p.is_dir()), key=lambda p: len(p.parts), reverse=True):
+        try:
+            path.rmdir()
+        except OSError:
+            pass
+
+def collect_garbage(dry_run: bool = False, grace_hours: float | None = None, thumbnail_days: int | None = None) -> dict:
+    """
+    Bring media storage back in line with the database:
+
+    - reset Blob.ref_count to the rows that actually reference each blob, and delete blobs
+      (with their files) left without references;
+    - delete files under blobs/ without a Blob row, staging renders of deleted documents or
+      of ingests that never finished, and flat images/ files no page or message refers to;
+    - delete cached thumbnails older than THUMBNAIL_RETENTION_DAYS (made again on demand)
+      and those of page images that no longer exist.
+
+    Anything touched within the last MEDIA_GC_GRACE_HOURS is kept, as an ingest may be using it.
+    Returns counts of what was (or, with dry_run, would be) removed.
+    """
+    grace = settings.MEDIA_GC_GRACE_HOURS if grace_hours is None else grace_hours
+    thumbnail_days = settings.THUMBNAIL_RETENTION_DAYS if thumbnail_days is None else thumbnail_days
+    cutoff = time.time() - grace * 3600
+    media = Path(settings.MEDIA_ROOT)
+    stats = Counter()
+
+    def remove(path: Path, kind: str):
+        stats[kind] += 1
+        stats['bytes'] += path.stat().st_size
+        if not dry_run:
+            path.unlink(missing_ok=True)
+
+    # reference counts
+    refs = {
+        Blob.PDF: Counter(filter(None, (pdf_blob_hash(name) for name in Document.objects.values_list('file', flat=True)))),
+        Blob.PAGE: Counter({r['image_hash']: r['n'] for r in DocumentPage.objects.exclude(image_hash='')
+                            .values('image_hash').annotate(n=Count('id')).order_by()}),
+    }
+    recent = timezone.now() - timedelta(hours=grace)
+    for blob in Blob.objects.all().iterator():
+        if blob.updated_at >= recent:
+            # an ingest may hold references whose Document/DocumentPage rows aren't written yet
+            continue
+        expected = refs[blob.kind].get(blob.sha256, 0)
+        if expected == 0:
+            stats['blobs'] += 1
+            if not dry_run and Blob.objects.filter(pk=blob.pk, updated_at=blob.updated_at).delete()[0]:
+                stats['bytes'] += _delete_blob_file(blob)
+        elif expected != blob.ref_count:
+            stats['refcounts_fixed'] += 1
+            if not dry_run:
+                # guarded like the delete: skip it if an acquire() touched the blob since it was read
+                Blob.objects.filter(pk=blob.pk, updated_at=blob.updated_at).update(ref_count=expected)
+
+    # blob files without a row
+    known = set(Blob.objects.values_list('name', flat=True))
+    for path in _files(media / 'blobs'):
+        if path.relative_to(media).as_posix() not in known and path.stat().st_mtime < cutoff:
+            remove(path, 'orphan_blob_files')
+
+    # staging renders and flat legacy images
+    images = media / 'images'
+    live_docs = set(Document.objects.values_list('id', flat=True))
+    referenced = set(DocumentPage.objects.exclude(image_path='').values_list('image_path', flat=True))
+    referenced |= set(MessageSource.objects.exclude(image_path='').values_list('image_path', flat=True))
+    # documents indexed before DocumentPage have no rows naming their images: match them by file stem, as legacy_images() does
+    live_stems = {Path(name).stem for name in Document.objects.values_list('file', flat=True) if name}
+    for path in _files(images):
+        rel = path.relative_to(images).parts
+        if len(rel) == 1:
+            stale = str(path) not in referenced and path.name.rsplit('-page-', 1)[0] not in live_stems
+        else:
+            stale = not rel[1].isdigit() or int(rel[1]) not in live_docs
+        if (stale or len(rel) > 1) and path.stat().st_mtime < cutoff:
+            # a staging file older than the grace period belongs to an ingest that died
+            remove(path, 'stale_images')
+
+    # thumbnails
+    keys = set(DocumentPage.objects.exclude(image_hash='').values_list('image_hash', flat=True))
+    keys |= set(DocumentPage.objects.values_list('content_hash', flat=True))
+    expire = time.time() - thumbnail_days * 86400 if thumbnail_days else None
+    for path in _files(Path(settings.THUMBNAIL_DIR)):
+        mtime = path.stat().st_mtime
+        orphan = path.name.split('-', 1)[0] not in keys and mtime < cutoff
+        if orphan or (expire is not None and mtime < expire):
+            remove(path, 'thumbnails')
+
+    if not dry_run:
+        for root in (media / 'blobs', images, Path(settings.THUMBNAIL_DIR)):
+            _prune_dirs(root)
+    return dict(stats)
@@ -0,0 +1,77 @@
+"""
+Email rendering with templates compiled once per process.
+
+Each email kind has an HTML and a plain-text template under templates/email/. They
+are loaded through the cached template loader and the compiled Template objects are
+kept here, so a send only pays for rendering. render_many() goes one step further
+for bulk sends: it reuses a single Context and pushes each recipient's variables
+onto it, instead of building a new context for every message.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, Iterator
+from django.dispatch import receiver
+from django.template import Context, engines
+from django.utils.autoreload import file_changed
+
+@dataclass(frozen=True)
+class EmailKind:
+    subject: str
+    html_template: str
+    text_template: str
+
+EMAIL_KINDS = {
+    'verification': EmailKind(
+        subject='Verify Your Email Address',
+        html_template='email/verification_email.html',
+        text_template='email/verification_email.txt',
+    ),
+    'password_reset': EmailKind(
+        subject='Reset Your Password',
+        html_template='email/password_reset_email.html',
+        text_template='email/password_reset_email.txt',
+    ),
+}
+
+@dataclass(frozen=True)
+class RenderedEmail:
+    subject: str
+    text_body: str
+    html_body: str
+
+@lru_cache(maxsize=None)
+def compiled_templates(kind: str):
+    """(html, text) compiled django.template.base.Template objects for an email kind."""
+    spec = EMAIL_KINDS[kind]
+    engine = engines['django']
+    return (
+        engine.get_template(spec.html_template).template,
+        engine.get_template(spec.text_template).template,
+    )
+
+def precompile():
+    """Compile every email template up front, e.g. before draining a large queue."""
+    for kind in EMAIL_KINDS:
+        compiled_templates(kind)
+
+def render_email(kind: str, context: dict) -> RenderedEmail:
+    """Render one email of the given kind."""
+    return next(render_many(kind, [context]))
+
+def render_many(kind: str, contexts: Iterable[dict]) -> Iterator[RenderedEmail]:
+    """Render an email for each context, reusing the compiled templates and one Context."""
+    html, text = compiled_templates(kind)
+    subject = EMAIL_KINDS[kind].subject
+    ctx = Context()
+    for values in contexts:
+        with ctx.push(values):
+            yield RenderedEmail(subject=subject, text_body=text.render(ctx), html_body=html.render(ctx))
+
+def clear_cache():
+    compiled_templates.cache_clear()
+
+@receiver(file_changed, dispatch_uid='rag_app.email_render')
+def _template_changed(sender, file_path, **kwargs):
+    # runserver resets the cached loader on template edits; drop our compiled copies too
+    if file_path.suffix in ('.html', '.txt'):
+        clear_cache()
@@ -2,10 +2,10 @@ import os
 import secrets
 from datetime import timedelta
 from django.utils import timezone
-from django.core.mail import send_mail
 from django.conf import settings
-from django.template.loader import render_to_string
 from .models import EmailVerificationToken, PasswordResetToken
+from .email_render import render_email
+from .outbox import enqueue_email
 
 def generate_secure_token():
     """Generate a cryptographically secure token"""
@@ -29,51 +29,30 @@ def create_verification_token(user, expires_in_hours=24):
     return verification_token
 
 def send_verification_email(user, verification_token):
-    """Send verification email to user"""
+    """Queue the verification email for the outbox worker; returns False if it could not be queued"""
     try:
         # Create verification URL
         verification_url = f"{settings.FRONTEND_URL}/verify-email?token={verification_token.token}"
         
-        # Email content
-        subject = "Verify Your Email Address"
-        
-        # HTML email template
-        html_message = render_to_string('email/verification_email.html', {
+        # Render the precompiled HTML and text templates
+        rendered = render_email('verification', {
             'user': user,
             'verification_url': verification_url,
             'expires_at': verification_token.expires_at.strftime('%B %d, %Y at %I:%M %p'),
         })
         
-        # Plain text fallback
-        text_message = f"""
-        Hello {user.first_name},
-        
-        Please verify your email address by clicking the link below:
-        
-        {verification_url}
-        
-        This link will expire on {verification_token.expires_at.strftime('%B %d, %Y at %I:%M %p')}.
-        
-        If you didn't create an account, please ignore this email.
-        
-        Best regards,
-        Your App Team
-        """
-        
-        # Send email
-        send_mail(
-            subject=subject,
-            message=text_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
+        # Queue email (sent by the send_queued_email worker)
+        enqueue_email(
+            to_email=user.email,
+            subject=rendered.subject,
+            text_body=rendered.text_body,
+            html_body=rendered.html_body,
         )
         
         return True
         
     except Exception as e:
-        print(f"Error sending verification email: {e}")
+        print(f"Error queuing verification email: {e}")
         return False
 
 def verify_email_token(token):
@@ -122,51 +101,30 @@ def create_password_reset_token(user, expires_in_hours=1):
     return reset_token
 
 def send_password_reset_email(user, reset_token):
-    """Send password reset email to user"""
+    """Queue the password reset email for the outbox worker; returns False if it could not be queued"""
     try:
         # Create reset URL
         reset_url = f"{settings.FRONTEND_URL}/reset-password?token={reset_token.token}"
         
-        # Email content
-        subject = "Reset Your Password"
-        
-        # HTML email template
-        html_message = render_to_string('email/password_reset_email.html', {
+        # Render the precompiled HTML and text templates
+        rendered = render_email('password_reset', {
             'user': user,
             'reset_url': reset_url,
             'expires_at': reset_token.expires_at.strftime('%B %d, %Y at %I:%M %p'),
         })
         
-        # Plain text fallback
-        text_message = f"""
-        Hello {user.first_name},
-        
-        You requested to reset your password. Click the link below to set a new password:
-        
-        {reset_url}
-        
-        This link will expire on {reset_token.expires_at.strftime('%B %d, %Y at %I:%M %p')}.
-        
-        If you didn't request a password reset, please ignore this email and your password will remain unchanged.
-        
-        Best regards,
-        Your App Team
-        """
-        
-        # Send email
-        send_mail(
-            subject=subject,
-            message=text_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
+        # Queue email (sent by the send_queued_email worker)
+        enqueue_email(
+            to_email=user.email,
+            subject=rendered.subject,
+            text_body=rendered.text_body,
+            html_body=rendered.html_body,
         )
         
         return True
         
     except Exception as e:
-        print(f"Error sending password reset email: {e}")
+        print(f"Error queuing password reset email: {e}")
         return False
 
 def verify_password_reset_token(token):
@@ -1,9 +1,22 @@
+import hashlib
 from pathlib import Path
 import fitz  # PyMuPDF
 
-def extract_pdf_pages_as_images(pdf_path: str, out_dir: str, dpi: int = 200, max_pages: int | None = None) -> list[dict]:
-    out_dir = Path(out_dir)
-    img_dir = out_dir / 'images'
+def hash_pdf_pages(pdf_path: str, dpi: int = 72) -> list[str]:
+    """Return a content hash per page (index 0 = page 1), computed from a low-DPI render."""
+    doc = fitz.open(pdf_path)
+    hashes: list[str] = []
+    for page in doc:
+        pix = page.get_pixmap(dpi=dpi, alpha=False)
+        h = hashlib.sha256()
+        h.update(f"{pix.width}x{pix.height}:".encode())
+        h.update(pix.samples)
+        hashes.append(h.hexdigest())
+    return hashes
+
+def extract_pdf_pages_as_images(pdf_path: str, out_dir: str, dpi: int = 200, max_pages: int | None = None, pages: set[int] | None = None) -> list[dict]:
+    """Render pages to PNG files in out_dir; returns one record per page (page, image_path, image_hash, source)."""
+    img_dir = Path(out_dir)
     img_dir.mkdir(parents=True, exist_ok=True)
 
     doc = fitz.open(pdf_path)
@@ -12,6 +25,9 @@ def extract_pdf_pages_as_images(pdf_path: str, out_dir: str, dpi: int = 200, max
     for page_idx in range(len(doc)):
         if max_pages is not None and page_idx >= max_pages:
             break
+        # only render the requested (1-based) page numbers, if any were given
+        if pages is not None and (page_idx + 1) not in pages:
+            continue
         page = doc[page_idx]
         img_name = f"{Path(pdf_path).stem}-page-{page_idx+1}.png"
         img_path = img_dir / img_name
@@ -22,6 +38,7 @@ def extract_pdf_pages_as_images(pdf_path: str, out_dir: str, dpi: int = 200, max
             'type': 'page_image',
             'page': page_idx + 1,
             'image_path': str(img_path),
+            'image_hash': hashlib.sha256(pix.samples).hexdigest(),
             'source': str(pdf_path),
         })
 
@@ -0,0 +1,289 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from . import blobs
+from .extract import extract_pdf_pages_as_images, hash_pdf_pages
+from .metrics import timed
+from .usage import usage_context
+from .models import Blob, DocumentPage, EXTRACTION_FIELDS
+from .openai_helpers import vision_extract
+from .textutils import split_for_embedding
+
+@timed('ingest_extract')
+def extract_pages(records: list[dict]) -> dict[int, dict]:
+    """
+    Move rendered pages into blob storage and run Vision over them; returns page number ->
+    DocumentPage extraction fields. Each page takes one reference to its image blob.
+    """
+    extracted = {}
+    for rec in records:
+        image_path = rec['image_path']
+        if rec.get('image_hash'):
+            blobs.acquire(Blob.PAGE, rec['image_hash'], path=image_path)
+            image_path = blobs.blob_path(Blob.PAGE, rec['image_hash'])
+        with usage_context(page=rec['page']):
+            info = vision_extract(image_path)
+        extracted[rec['page']] = {
+            'extracted_text': info['extracted_text'],
+            'description': info['description'],
+            'image_hash': rec.get('image_hash', ''),
+            'image_path': image_path,
+            'extraction_model': info['model'],
+            'extraction_ms': round(info['seconds'] * 1000.0, 1),
+            # a failed call leaves extracted_at empty, so index_pages() retries the page
+            'extracted_at': timezone.now() if info['model'] else None,
+        }
+    return extracted
+
+def render_and_extract(doc, pages: set[int]) -> dict[int, dict]:
+    """Render the given pages into the document's staging directory and extract them (see extract_pages)."""
+    staging = blobs.render_dir(doc.id)
+    with timed('ingest_render'):
+        records = extract_pdf_pages_as_images(doc.file.path, out_dir=staging, dpi=200, pages=pages)
+    try:
+        return extract_pages(records)
+    finally:
+        # every render has moved into blob storage; anything left is swept by gc_media
+        try:
+            staging.rmdir()
+        except OSError:
+            pass
+
+def chunk_pages(pages: dict[int, dict], source: str) -> tuple[list[dict], dict[int, int]]:
+    """Split stored page text (page number -> extraction fields) into chunks; returns (chunks, chunk count per page)."""
+    chunks = []
+    per_page = {}
+    for page, fields in sorted(pages.items()):
+        content = (fields.get('extracted_text') or '').strip() or (fields.get('description') or '').strip()
+        pieces = split_for_embedding(content)
+        per_page[page] = len(pieces)
+        for idx, chunk in enumerate(pieces):
+            chunks.append({
+                'text': chunk,
+                'page': page,
+                'source': source,
+                'image_path': fields.get('image_path', ''),
+                'chunk': idx,
+            })
+    return chunks, per_page
+
+def shared_pages(doc, hashes: dict[int, str]) -> dict[int, DocumentPage]:
+    """Already extracted pages of other documents (of any owner) with the same content as pages of `doc`."""
+    if not settings.SHARED_EXTRACTION_ENABLED or not hashes:
+        return {}
+    found = {}
+    donors = (
+        DocumentPage.objects
+        .filter(content_hash__in=set(hashes.values()), extracted_at__isnull=False)
+        .exclude(document=doc)
+        .select_related('document')
+        .order_by('-extracted_at')
+    )
+    for p in donors:
+        found.setdefault(p.content_hash, p)
+    return {n: found[h] for n, h in hashes.items() if h in found}
+
+def index_new_pages(doc, store, hashes: dict[int, str]) -> tuple[int, dict[int, dict], dict[int, int], int]:
+    """
+    Extract and index pages (page number -> content hash) of a document.
+
+    A page whose content was already extracted for another document, of any owner, takes
+    that Vision output and a copy of its vectors, stored under this document's owner so
+    per-user query filters still apply, instead of being rendered, sent to Vision and
+    embedded again. Returns (chunks stored, extraction fields per page, chunks per page,
+    pages shared).
+    """
+    abs_path = doc.file.path
+    donors = shared_pages(doc, hashes)
+    fields, per_page, to_embed = {}, {}, {}
+    copied, copied_vectors = [], []
+
+    wanted = {}  # (owner, document) -> donor page -> pages of doc
+    for n, donor in donors.items():
+        wanted.setdefault((donor.document.owner_id, donor.document_id), {}).setdefault(donor.page, []).append(n)
+    with timed('ingest_share'):
+        for (owner_id, document_id), pages in wanted.items():
+            got = {}
+            for ch, vec in zip(*store.page_vectors(owner_id, document_id, list(pages))):
+                for n in pages.get(int(ch['page']), ()):
+                    got.setdefault(n, []).append(({**ch, 'page': n, 'source': abs_path}, vec))
+            for ns in pages.values():
+                for n in ns:
+                    fields[n] = donors[n].extraction_fields()
+                    pieces = got.get(n, [])
+                    if len(pieces) == donors[n].chunk_count:
+                        copied += [ch for ch, _ in pieces]
+                        copied_vectors += [vec for _, vec in pieces]
+                        per_page[n] = len(pieces)
+                    else:
+                        # the donor's vectors are gone (or in another backend): embed its stored text
+                        to_embed[n] = fields[n]
+    blobs.share(Blob.PAGE, [fields[n]['image_hash'] for n in donors])
+
+    missing = {n for n in hashes if n not in donors}
+    if missing:
+        extracted = render_and_extract(doc, missing)
+        fields.update(extracted)
+        to_embed.update(extracted)
+
+    chunks, counts = chunk_pages(to_embed, source=abs_path)
+    per_page.update(counts)
+    with timed('ingest_index'):
+        stored = store.upsert_chunks(user_id=doc.owner_id, document_id=doc.id, chunks=chunks)
+        stored += store.upsert_chunks(user_id=doc.owner_id, document_id=doc.id, chunks=copied, embeddings=copied_vectors)
+    return stored, fields, per_page, len(donors)
+
+def replace_pages(doc, rows: list) -> None:
+    """Swap a document's DocumentPage rows for `rows`, whose image references are already taken."""
+    old = list(doc.pages.values_list('image_hash', flat=True))
+    doc.pages.all().delete()
+    DocumentPage.objects.bulk_create(rows)
+    for image_hash in old:
+        blobs.release(Blob.PAGE, image_hash)
+
+def ingest_document(doc, store, hashes: list[str] | None = None) -> int:
+    """Render, extract, chunk and index every page of a document. Returns chunks stored."""
+    if hashes is None:
+        with timed('ingest_hash'):
+            hashes = hash_pdf_pages(doc.file.path)
+    stored, fields, per_page, _ = index_new_pages(doc, store, dict(enumerate(hashes, 1)))
+    with timed('ingest_db'), transaction.atomic():
+        replace_pages(doc, [
+            DocumentPage(document=doc, page=n, content_hash=h, chunk_count=per_page.get(n, 0), **fields.get(n, {}))
+            for n, h in enumerate(hashes, 1)
+        ])
+    return stored
+
+def extract_missing(doc, pages: list) -> int:
+    """Run Vision for the DocumentPage rows that have no stored extraction and set it on them (unsaved); returns pages sent."""
+    missing = {p.page for p in pages if p.extracted_at is None}
+    if not missing:
+        return 0
+    extracted = render_and_extract(doc, missing)
+    for p in pages:
+        if p.page in extracted:
+            old_image = p.image_hash
+            for field, value in extracted[p.page].items():
+                setattr(p, field, value)
+            blobs.release(Blob.PAGE, old_image)
+    return len(missing)
+
+def index_pages(doc, store) -> int:
+    """
+    Rebuild a document's vectors from its stored page text, e.g. after changing the chunker
+    or the embedding model. Vision only runs for pages that have no stored extraction
+    (indexed before it was kept, or the call failed). Returns chunks stored.
+    """
+    pages = list(doc.pages.all())
+    if not pages:
+        store.delete_document(user_id=doc.owner_id, document_id=doc.id)
+        return ingest_document(doc, store)
+
+    extract_missing(doc, pages)
+    chunks, per_page = chunk_pages({p.page: p.extraction_fields() for p in pages}, source=doc.file.path)
+    with timed('ingest_index'):
+        store.delete_document(user_id=doc.owner_id, document_id=doc.id)
+        stored = store.upsert_chunks(user_id=doc.owner_id, document_id=doc.id, chunks=chunks)
+    for p in pages:
+        p.chunk_count = per_page.get(p.page, 0)
+    with timed('ingest_db'):
+        DocumentPage.objects.bulk_update(pages, ['chunk_count', *EXTRACTION_FIELDS])
+    return stored
+
+def _reingest_all(doc, store, hashes: list[str]) -> dict:
+    store.delete_document(user_id=doc.owner_id, document_id=doc.id)
+    stored = ingest_document(doc, store, hashes=hashes)
+    return {
+        'pages_total': len(hashes),
+        'pages_reused': 0,
+        'pages_reextracted': len(hashes),
+        'pages_shared': 0,
+        'pages_removed': 0,
+        'chunks_indexed': stored,
+    }
+
+def reingest_document(doc, store) -> dict:
+    """
+    Re-index a document whose file was replaced, touching only pages that changed.
+
+    Pages are matched by content hash: a page whose hash is unchanged (at the same
+    or a different position) keeps its vectors and is only renumbered; pages that
+    are new or changed go through index_new_pages(); vectors of old pages that no
+    longer appear are deleted.
+    """
+    with timed('ingest_hash'):
+        new_hashes = hash_pdf_pages(doc.file.path)
+    old_pages = list(doc.pages.all())
+
+    if not old_pages:
+        # Indexed before page hashes were tracked: nothing to diff against.
+        return _reingest_all(doc, store, new_hashes)
+
+    by_page = {p.page: p for p in old_pages}
+    unclaimed = {}
+    for p in old_pages:
+        unclaimed.setdefault(p.content_hash, []).append(p)
+
+    # new page number -> old DocumentPage whose vectors it reuses
+    kept = {}
+    # first pass: same content at the same position
+    for n, h in enumerate(new_hashes, 1):
+        old = by_page.get(n)
+        if old is not None and old.content_hash == h:
+            kept[n] = old
+            unclaimed[h].remove(old)
+    # second pass: same content that moved
+    for n, h in enumerate(new_hashes, 1):
+        if n not in kept and unclaimed.get(h):
+            kept[n] = unclaimed[h].pop(0)
+
+    changed = {n for n in range(1, len(new_hashes) + 1) if n not in kept}
+    claimed = {p.page for p in kept.values()}
+    stale = [p.page for p in old_pages if p.page not in claimed]
+
+    stored, extracted, per_page, shared = 0, {}, {}, 0
+    try:
+        # delete before renumbering, so stale page numbers still refer to old pages
+        with timed('ingest_remap'):
+            store.delete_pages(user_id=doc.owner_id, document_id=doc.id, pages=stale)
+            store.remap_pages(
+                user_id=doc.owner_id,
+                document_id=doc.id,
+                page_map={p.page: n for n, p in kept.items()},
+                source=doc.file.path,
+            )
+        if changed:
+            stored, extracted, per_page, shared = index_new_pages(doc, store, {n: new_hashes[n - 1] for n in changed})
+    except Exception as e:
+        # the vectors are half updated and no longer match the stored pages: rebuild the document from scratch
+        print(f"[Ingest] incremental re-index of document {doc.id} failed ({e}); re-ingesting it in full")
+        try:
+            # the old pages stay until this succeeds, so their extractions can still be shared
+            return _reingest_all(doc, store, new_hashes)
+        except Exception:
+            # drop them, so a retry diffs against nothing and starts from scratch too
+            with transaction.atomic():
+                replace_pages(doc, [])
+            raise
+
+    blobs.share(Blob.PAGE, [p.image_hash for p in kept.values()])
+    rows = []
+    for n, h in enumerate(new_hashes, 1):
+        if n in kept:
+            # unchanged page: keep its Vision output along with its vectors
+            rows.append(DocumentPage(document=doc, page=n, content_hash=h, chunk_count=kept[n].chunk_count,
+                                     **kept[n].extraction_fields()))
+        else:
+            rows.append(DocumentPage(document=doc, page=n, content_hash=h, chunk_count=per_page.get(n, 0),
+                                     **extracted.get(n, {})))
+    with timed('ingest_db'), transaction.atomic():
+        replace_pages(doc, rows)
+
+    return {
+        'pages_total': len(new_hashes),
+        'pages_reused': len(kept),
+        'pages_reextracted': len(changed) - shared,
+        'pages_shared': shared,
+        'pages_removed': len(stale),
+        'chunks_indexed': stored,
+    }
@@ -0,0 +1,33 @@
+import json
+from django.core.management.base import BaseCommand
+from rag_app.benchmarks import backends, intent, layout, pipeline, quantization
+
+SUITES = {
+	'layout': layout,
+	'backends': backends,
+	'quantization': quantization,
+	'intent': intent,
+	'pipeline': pipeline,
+}
+
+
+class Command(BaseCommand):
+	help = 'Run an offline benchmark suite and print (or save) machine-readable results'
+
+	def add_arguments(self, parser):
+		subparsers = parser.add_subparsers(dest='suite', required=True)
+		for name, module in SUITES.items():
+			sub = subparsers.add_parser(name, help=(module.__doc__ or '').strip().splitlines()[0])
+			sub.add_argument('--output', default=None, help='Write results as JSON to this file')
+			module.add_arguments(sub)
+
+	def handle(self, *args, **options):
+		rows = SUITES[options['suite']].run(options)
+
+		for row in rows:
+			self.stdout.write('  '.join(f"{k}={v}" for k, v in row.items()))
+
+		if options.get('output'):
+			with open(options['output'], 'w') as fh:
+				json.dump({'suite': options['suite'], 'results': rows}, fh, indent=2)
+			self.stdout.write(self.style.SUCCESS(f"Wrote {len(rows)} results to {options['output']}"))
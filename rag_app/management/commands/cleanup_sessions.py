@@ -1,6 +1,10 @@
+import time
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Q
 from django.utils import timezone
-from rag_app.models import UserSession, CustomUser
+from rag_app.models import UserSession
 
 
 class Command(BaseCommand):
@@ -12,58 +16,93 @@ class Command(BaseCommand):
 			action='store_true',
 			help='Show what would be cleaned up without actually doing it',
 		)
+		parser.add_argument(
+			'--batch-size',
+			type=int,
+			default=settings.SESSION_CLEANUP_BATCH_SIZE,
+			help='Rows updated or deleted per statement, keeps locks short',
+		)
+		parser.add_argument(
+			'--purge',
+			action='store_true',
+			help='Also delete inactive sessions older than the retention period',
+		)
+		parser.add_argument(
+			'--retention-days',
+			type=int,
+			default=settings.SESSION_RETENTION_DAYS,
+			help='Inactive sessions older than this many days are deleted by --purge',
+		)
+		parser.add_argument(
+			'--daemon',
+			action='store_true',
+			help='Keep running and reap every --interval seconds (implies --purge)',
+		)
+		parser.add_argument(
+			'--interval',
+			type=int,
+			default=settings.SESSION_REAPER_INTERVAL,
+			help='Seconds between runs in --daemon mode',
+		)
 
 	def handle(self, *args, **options):
 		dry_run = options['dry_run']
-		
+
 		if dry_run:
 			self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
-		
-		# Get expired sessions
-		expired_sessions = UserSession.objects.filter(
-			expires_at__lt=timezone.now(),
-			is_active=True
-		)
-		
+			self.report(options)
+			return
+
+		if not options['daemon']:
+			self.reap(options, purge=options['purge'])
+			return
+
+		self.stdout.write(f"Session reaper running every {options['interval']}s (Ctrl+C to stop)")
+		try:
+			while True:
+				close_old_connections()
+				try:
+					self.reap(options, purge=True)
+				except Exception as e:
+					self.stderr.write(f"Session cleanup failed: {e}")
+				time.sleep(options['interval'])
+		except KeyboardInterrupt:
+			self.stdout.write('Session reaper stopped')
+
+	def cutoff(self, options):
+		return timezone.now() - timezone.timedelta(days=options['retention_days'])
+
+	def reap(self, options, purge):
+		users_updated, deactivated = UserSession.cleanup_expired_sessions(batch_size=options['batch_size'])
+		if users_updated:
+			self.stdout.write(f"Updated {users_updated} users with no active sessions")
+		if deactivated:
+			self.stdout.write(self.style.SUCCESS(f'Successfully cleaned up {deactivated} expired sessions'))
+		else:
+			self.stdout.write(self.style.SUCCESS('No expired sessions to clean up'))
+
+		if purge:
+			deleted = UserSession.purge_inactive_sessions(older_than=self.cutoff(options), batch_size=options['batch_size'])
+			self.stdout.write(f"Deleted {deleted} inactive sessions older than {options['retention_days']} days")
+
+	def report(self, options):
+		now = timezone.now()
+		expired_sessions = UserSession.objects.filter(expires_at__lt=now, is_active=True)
 		expired_count = expired_sessions.count()
 		self.stdout.write(f"Found {expired_count} expired sessions")
-		
-		if expired_count == 0:
-			self.stdout.write(self.style.SUCCESS('No expired sessions to clean up'))
-			return
-		
-		if not dry_run:
-			# Get users who will have no active sessions after cleanup
-			users_with_expired_sessions = expired_sessions.values_list('user_id', flat=True).distinct()
-			users_to_update = []
-			
-			for user_id in users_with_expired_sessions:
-				if not UserSession.objects.filter(
-					user_id=user_id, 
-					is_active=True, 
-					expires_at__gt=timezone.now()
-				).exists():
-					users_to_update.append(user_id)
-			
-			# Update users who have no active sessions
-			if users_to_update:
-				CustomUser.objects.filter(id__in=users_to_update).update(
-					is_active_session=False,
-					session_created_at=None,
-					session_expires_at=None
-				)
-				self.stdout.write(f"Updated {len(users_to_update)} users with no active sessions")
-			
-			# Deactivate expired sessions
-			expired_sessions.update(is_active=False)
-			
-			self.stdout.write(
-				self.style.SUCCESS(f'Successfully cleaned up {expired_count} expired sessions')
+		self.stdout.write(f"Would update {UserSession.users_losing_last_session(now).count()} users with no active sessions")
+
+		# Show what would be cleaned up
+		for session in expired_sessions.select_related('user')[:10]:  # Show first 10
+			self.stdout.write(f"Would deactivate: {session.user.email} - {session.created_at}")
+
+		if expired_count > 10:
+			self.stdout.write(f"... and {expired_count - 10} more sessions")
+
+		if options['purge'] or options['daemon']:
+			cutoff = self.cutoff(options)
+			stale = UserSession.objects.filter(
+				Q(expires_at__lt=cutoff) | Q(last_activity__lt=cutoff),
+				is_active=False,
 			)
-		else:
-			# Show what would be cleaned up
-			for session in expired_sessions[:10]:  # Show first 10
-				self.stdout.write(f"Would deactivate: {session.user.email} - {session.created_at}")
-			
-			if expired_count > 10:
-				self.stdout.write(f"... and {expired_count - 10} more sessions")
+			self.stdout.write(f"Would delete {stale.count()} inactive sessions older than {options['retention_days']} days")
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rag_app.blobs import collect_garbage
+
+
+class Command(BaseCommand):
+	help = 'Delete unreferenced PDFs, page images, staging renders and expired page previews from MEDIA_ROOT'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--dry-run', action='store_true', help='Show what would be deleted without deleting it')
+		parser.add_argument('--grace-hours', type=float, default=settings.MEDIA_GC_GRACE_HOURS, help='Leave files modified within this many hours alone')
+		parser.add_argument('--thumbnail-days', type=int, default=settings.THUMBNAIL_RETENTION_DAYS, help='Drop cached previews older than this many days (0 keeps them)')
+
+	def handle(self, *args, **options):
+		if options['dry_run']:
+			self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
+		stats = collect_garbage(
+			dry_run=options['dry_run'], grace_hours=options['grace_hours'], thumbnail_days=options['thumbnail_days'],
+		)
+		verb = 'Would remove' if options['dry_run'] else 'Removed'
+		self.stdout.write(
+			f"{verb} {stats.get('blobs', 0)} unreferenced blobs, {stats.get('orphan_blob_files', 0)} orphan blob files, "
+			f"{stats.get('stale_images', 0)} stale page images and {stats.get('thumbnails', 0)} previews "
+			f"({stats.get('bytes', 0) / 1e6:.1f} MB)"
+		)
+		if stats.get('refcounts_fixed'):
+			self.stdout.write(f"{'Would fix' if options['dry_run'] else 'Fixed'} {stats['refcounts_fixed']} blob reference counts")
+		self.stdout.write(self.style.SUCCESS('Media cleanup complete'))
@@ -0,0 +1,249 @@
+import json
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+from rag_app.ingest import chunk_pages, extract_missing, ingest_document
+from rag_app.models import Document, DocumentPage, EXTRACTION_FIELDS
+from rag_app.openai_helpers import embed_texts
+from rag_app.store import ChromaStore, UPSERT_BATCH, point_alias
+from rag_app.usage import usage_context
+
+# "<generation>_u12" / "<generation>_s003" -> "<generation>"
+LAYOUT_SUFFIX_RE = re.compile(r'_[us]\d+$')
+CATCH_UP_ROUNDS = 5
+IN_FLIGHT_WAIT = 5.0  # seconds between catch-up passes while only in-flight uploads are left
+CHECKPOINT_INTERVAL = 2.0  # seconds between checkpoint writes
+
+
+class Command(BaseCommand):
+	help = 'Rebuild the Chroma index from stored page text into a new collection, then point CHROMA_COLLECTION at it'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--embedding-model', default=None, help='Embedding model of the new collection (default: OPENAI_EMBEDDING_MODEL)')
+		parser.add_argument('--dimensions', type=int, default=None, help='Embedding dimensions (default: OPENAI_EMBEDDING_DIMENSIONS)')
+		parser.add_argument('--workers', type=int, default=settings.REINDEX_WORKERS, help='Documents embedded in parallel')
+		parser.add_argument('--batch-size', type=int, default=UPSERT_BATCH, help='Chunks per embeddings request')
+		parser.add_argument('--resume', action='store_true', help='Continue the rebuild recorded in the checkpoint file')
+		parser.add_argument('--extract-missing', action='store_true', help='Send pages without stored Vision output to Vision instead of skipping their documents')
+		parser.add_argument('--keep-old', action='store_true', help='Keep the previous collection after the swap')
+		parser.add_argument('--grace', type=float, default=30.0, help='Seconds to wait after the swap before dropping the previous collection')
+		parser.add_argument('--ingest-timeout', type=float, default=3600.0, help='Documents without pages younger than this many seconds are treated as still ingesting')
+		parser.add_argument('--gc', action='store_true', help='Only drop collections of this alias that are neither served nor being built')
+		parser.add_argument('--dry-run', action='store_true', help='Only report what would be rebuilt')
+
+	def handle(self, *args, **options):
+		live = self.live = ChromaStore()
+		self.checkpoint_path = live.path / f"reindex-{live.alias}.json"
+		state = self.read_checkpoint()
+
+		if options['gc']:
+			dropped = self.drop_generations(live, self.stale_generations(live, keep={live.base_name, state.get('generation')}))
+			self.stdout.write(self.style.SUCCESS(f"Dropped {dropped} stale collections"))
+			return
+
+		if options['dry_run']:
+			self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
+			pages = DocumentPage.objects.all()
+			self.stdout.write(
+				f"Would rebuild {live.alias!r} (serving {live.base_name!r}) from {Document.objects.count()} documents, "
+				f"{pages.count()} pages ({pages.filter(extracted_at=None).count()} without stored Vision output)"
+			)
+			return
+
+		if state and not options['resume']:
+			raise CommandError(
+				f"A rebuild into {state['generation']!r} was interrupted; pass --resume to continue it, "
+				f"or delete {self.checkpoint_path} and run --gc to discard it"
+			)
+		if not state:
+			if options['resume']:
+				raise CommandError('No interrupted rebuild to resume')
+			state = {
+				'generation': f"{live.alias}__g{timezone.now():%Y%m%d%H%M%S%f}",
+				'embedding_model': options['embedding_model'] or live.default_model,
+				'embedding_dimensions': live.default_dimensions if options['dimensions'] is None else options['dimensions'],
+				'started_at': timezone.now().isoformat(),
+				'done': {},  # document id -> {'user_id', 'stamp': latest page updated_at when indexed}
+			}
+			self.write_checkpoint(state)
+
+		target = ChromaStore(
+			collection=state['generation'], layout=live.layout, shards=live.shards, follow_alias=False,
+			embedding_model=state['embedding_model'], embedding_dimensions=state['embedding_dimensions'],
+		)
+		self.stdout.write(f"Building {state['generation']!r} with {state['embedding_model']} (serving {live.base_name!r})")
+
+		# the first pass indexes everything; later passes pick up uploads, re-uploads and deletes made meanwhile
+		skipped = 0
+		for round_no in range(CATCH_UP_ROUNDS):
+			indexed, skipped, pending = self.sync(state, target, options)
+			self.stdout.write(f"Pass {round_no + 1}: {indexed} documents indexed, {skipped} skipped, {pending} still ingesting")
+			if not indexed and not pending:
+				break
+			if not indexed:
+				time.sleep(IN_FLIGHT_WAIT)
+		if self.stale:
+			self.stdout.write(self.style.WARNING(
+				f"{len(self.stale)} documents older than --ingest-timeout have neither pages nor vectors (failed ingest) "
+				f"and were left out: {self.stale[:20]}. --extract-missing ingests them"
+			))
+		if pending:
+			# their ingest writes to whichever collection the alias names; the pass after the grace period picks up the rest
+			self.stdout.write(self.style.WARNING(f"{pending} uploads are still ingesting; switching anyway"))
+		if skipped:
+			raise CommandError(
+				f"{skipped} documents have pages without stored Vision output and were not indexed; "
+				f"the alias was not switched. Rerun with --resume --extract-missing"
+			)
+
+		previous = point_alias(
+			live.path, live.alias, state['generation'],
+			embedding_model=state['embedding_model'],
+			embedding_dimensions=state['embedding_dimensions'],
+			switched_at=timezone.now().isoformat(),
+		)
+		old = previous.get('collection', live.alias)
+		self.stdout.write(self.style.SUCCESS(f"{live.alias!r} now serves {state['generation']!r} (was {old!r})"))
+
+		drop_old = not options['keep_old'] and old != state['generation']
+		if drop_old or pending:
+			# let requests and ingests already running against the old collection finish
+			time.sleep(max(0.0, options['grace']))
+		if pending:
+			# uploads that finished ingesting into the old collection before the swap; later ones write to the new one
+			indexed, _, pending = self.sync(state, target, options)
+			self.stdout.write(f"Final pass: {indexed} documents indexed, {pending} still ingesting")
+		self.checkpoint_path.unlink(missing_ok=True)
+
+		if not drop_old:
+			return
+		dropped = self.drop_generations(live, {old})
+		self.stdout.write(f"Dropped {dropped} collections of {old!r}")
+
+	# --- building ----------------------------------------------------------------
+
+	def sync(self, state, target, options) -> tuple[int, int, int]:
+		"""
+		Index documents that are new or changed since they were last indexed; returns
+		(indexed, skipped, pending). Pending documents have no pages yet because their upload
+		is still being ingested; they are left for a later pass.
+		"""
+		done = state['done']
+		current = {}
+		for doc in Document.objects.annotate(stamp=Max('pages__updated_at')).order_by('id'):
+			current[str(doc.id)] = doc
+		for doc_id in [i for i in done if i not in current]:
+			target.delete_document(user_id=done[doc_id]['user_id'], document_id=int(doc_id))
+			del done[doc_id]
+
+		in_flight = timezone.now() - timezone.timedelta(seconds=options['ingest_timeout'])
+		indexed = skipped = pending = 0
+		self.stale = []
+		window = deque()
+		self._last_write = time.monotonic()
+		with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+			for key, doc in current.items():
+				stamp = doc.stamp.isoformat() if doc.stamp else None
+				if key in done and done[key]['stamp'] == stamp:
+					continue
+				pages = list(doc.pages.all())
+				if not pages and doc.created_at >= in_flight:
+					pending += 1
+					continue
+				chunks = None
+				if not pages:
+					# indexed before page text was stored: re-embed the chunks the served collection holds
+					chunks = self.live.document_chunks(user_id=doc.owner_id, document_id=doc.id) or None
+					if chunks is None and not options['extract_missing']:
+						# no pages and no vectors: its ingest failed, so it isn't searchable today either
+						self.stale.append(doc.id)
+						continue
+				if chunks is not None:
+					per_page = {}
+				elif not pages or any(p.extracted_at is None for p in pages):
+					if not options['extract_missing']:
+						skipped += 1
+						continue
+					if not pages:
+						# nothing stored for this document at all: ingest it straight into the new collection
+						target.delete_document(user_id=doc.owner_id, document_id=doc.id)
+						ingest_document(doc, target)
+						stamp = doc.pages.aggregate(stamp=Max('updated_at'))['stamp']
+						self.mark_done(state, doc, stamp.isoformat() if stamp else None)
+						indexed += 1
+						continue
+					extract_missing(doc, pages)
+				if chunks is None:
+					chunks, per_page = chunk_pages({p.page: p.extraction_fields() for p in pages}, source=doc.file.path)
+				future = pool.submit(self.embed, doc, chunks, state, options['batch_size'])
+				window.append((doc, stamp, pages, chunks, per_page, future))
+				if len(window) >= 2 * options['workers']:
+					self.store(state, target, *window.popleft())
+					indexed += 1
+			while window:
+				self.store(state, target, *window.popleft())
+				indexed += 1
+		self.write_checkpoint(state)
+		return indexed, skipped, pending
+
+	@staticmethod
+	def embed(doc, chunks, state, batch_size):
+		with usage_context(user_id=doc.owner_id, document_id=doc.id):
+			return embed_texts(
+				[c['text'] for c in chunks], batch_size=batch_size,
+				model=state['embedding_model'], dimensions=state['embedding_dimensions'],
+			)
+
+	def store(self, state, target, doc, stamp, pages, chunks, per_page, future):
+		vectors = future.result()
+		# a document cut off by an interrupted run may be half written
+		target.delete_document(user_id=doc.owner_id, document_id=doc.id)
+		target.upsert_chunks(user_id=doc.owner_id, document_id=doc.id, chunks=chunks, embeddings=vectors)
+		for p in pages:
+			p.chunk_count = per_page.get(p.page, 0)
+		DocumentPage.objects.bulk_update(pages, ['chunk_count', *EXTRACTION_FIELDS])
+		self.mark_done(state, doc, stamp)
+
+	def mark_done(self, state, doc, stamp):
+		state['done'][str(doc.id)] = {'user_id': doc.owner_id, 'stamp': stamp}
+		if time.monotonic() - self._last_write >= CHECKPOINT_INTERVAL:
+			self.write_checkpoint(state)
+
+	# --- checkpoint ----------------------------------------------------------------
+
+	def read_checkpoint(self) -> dict:
+		try:
+			with open(self.checkpoint_path) as f:
+				return json.load(f)
+		except FileNotFoundError:
+			return {}
+
+	def write_checkpoint(self, state):
+		tmp = self.checkpoint_path.with_suffix('.tmp')
+		tmp.write_text(json.dumps(state))
+		tmp.replace(self.checkpoint_path)
+		self._last_write = time.monotonic()
+
+	# --- garbage collection ----------------------------------------------------------
+
+	@staticmethod
+	def collection_names(store) -> list[str]:
+		return [c if isinstance(c, str) else c.name for c in store.client.list_collections()]
+
+	def stale_generations(self, store, keep: set) -> set:
+		generations = {LAYOUT_SUFFIX_RE.sub('', n) for n in self.collection_names(store)}
+		ours = {g for g in generations if g == store.alias or g.startswith(f"{store.alias}__g")}
+		return ours - keep
+
+	def drop_generations(self, store, generations: set) -> int:
+		dropped = 0
+		for name in self.collection_names(store):
+			if name in generations or LAYOUT_SUFFIX_RE.sub('', name) in generations:
+				store.client.delete_collection(name)
+				dropped += 1
+		return dropped
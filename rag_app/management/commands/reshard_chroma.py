@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+from rag_app.store import ChromaStore, LAYOUTS
+
+
+class Command(BaseCommand):
+	help = 'Copy existing vectors into a different Chroma collection layout (single, per_user, sharded)'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--to-layout', required=True, choices=LAYOUTS, help='Target layout')
+		parser.add_argument('--from-layout', choices=LAYOUTS, default=None, help='Source layout (default: CHROMA_LAYOUT)')
+		parser.add_argument('--shards', type=int, default=None, help='Shard count for the target sharded layout (default: CHROMA_SHARDS)')
+		parser.add_argument('--from-shards', type=int, default=None, help='Shard count of the source sharded layout (default: CHROMA_SHARDS)')
+		parser.add_argument('--to-collection', default=None, help='Base collection name for the target (default: CHROMA_COLLECTION)')
+		parser.add_argument('--batch-size', type=int, default=1000, help='Vectors read and written per batch')
+		parser.add_argument('--delete-source', action='store_true', help='Drop each source collection once it has been copied')
+		parser.add_argument('--dry-run', action='store_true', help='Only report what would be copied')
+
+	def handle(self, *args, **options):
+		dry_run = options['dry_run']
+		src = ChromaStore(layout=options['from_layout'], shards=options['from_shards'])
+		dst = ChromaStore(layout=options['to_layout'], shards=options['shards'], collection=options['to_collection'])
+
+		if src.base_name == dst.base_name and src.layout == dst.layout and (src.layout != 'sharded' or src.shards == dst.shards):
+			raise CommandError('Source and target layouts are identical; nothing to do')
+		if src.base_name == dst.base_name and src.layout == dst.layout == 'sharded':
+			# shard names would overlap, so reads and writes would hit the same collections
+			raise CommandError('Changing the shard count needs a different --to-collection')
+
+		if dry_run:
+			self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
+
+		sources = src.layout_collections()
+		if not sources:
+			self.stdout.write(self.style.SUCCESS(f'No collections found for layout {src.layout!r}'))
+			return
+
+		copied = 0
+		for coll in sources:
+			total = coll.count()
+			self.stdout.write(f"{coll.name}: {total} vectors")
+			if dry_run:
+				copied += total
+				continue
+
+			offset = 0
+			while offset < total:
+				batch = coll.get(
+					limit=options['batch_size'],
+					offset=offset,
+					include=['embeddings', 'documents', 'metadatas'],
+				)
+				ids = batch['ids']
+				if not len(ids):
+					break
+				# group the batch by target collection
+				groups = {}
+				for i, md in enumerate(batch['metadatas']):
+					name = dst.collection_name(int(md.get('user_id', 0)))
+					groups.setdefault(name, []).append(i)
+				for idxs in groups.values():
+					uid = int(batch['metadatas'][idxs[0]].get('user_id', 0))
+					dst.collection_for(uid).upsert(
+						ids=[ids[i] for i in idxs],
+						embeddings=[batch['embeddings'][i] for i in idxs],
+						documents=[batch['documents'][i] for i in idxs],
+						metadatas=[batch['metadatas'][i] for i in idxs],
+					)
+				offset += len(ids)
+				copied += len(ids)
+
+			if options['delete_source']:
+				src.client.delete_collection(coll.name)
+				self.stdout.write(f"Deleted source collection {coll.name}")
+
+		if dry_run:
+			self.stdout.write(f"Would copy {copied} vectors from {src.layout!r} to {dst.layout!r}")
+		else:
+			switch = f"CHROMA_LAYOUT={dst.layout}"
+			if dst.layout == 'sharded':
+				switch += f" CHROMA_SHARDS={dst.shards}"
+			if dst.base_name != src.base_name:
+				switch += f" CHROMA_COLLECTION={dst.base_name}"
+			self.stdout.write(self.style.SUCCESS(
+				f"Copied {copied} vectors from {src.layout!r} to {dst.layout!r}. "
+				f"Set {switch} to start serving from the new layout."
+			))
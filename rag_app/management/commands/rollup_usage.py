@@ -0,0 +1,44 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rag_app import usage
+
+
+class Command(BaseCommand):
+	help = 'Aggregate raw OpenAI usage rows into daily totals and optionally prune old rows'
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--days',
+			type=int,
+			default=2,
+			help='Recompute the daily totals of this many most recent days (including today)',
+		)
+		parser.add_argument(
+			'--prune',
+			action='store_true',
+			help='Delete raw usage rows older than the retention period after rolling up',
+		)
+		parser.add_argument(
+			'--retention-days',
+			type=int,
+			default=settings.USAGE_RETENTION_DAYS,
+			help='Raw rows older than this many days are deleted by --prune',
+		)
+
+	def handle(self, *args, **options):
+		# rows still buffered in this process would otherwise miss today's totals
+		usage.buffer.flush()
+
+		today = timezone.localdate()
+		since = today - timedelta(days=max(1, options['days']) - 1)
+		groups = usage.rollup(since=since, until=today)
+		self.stdout.write(self.style.SUCCESS(f'Rolled up {groups} daily usage rows for {since} .. {today}'))
+
+		if options['prune']:
+			if options['retention_days'] < options['days']:
+				self.stdout.write(self.style.WARNING('Retention is shorter than the rollup window; skipping prune'))
+				return
+			deleted = usage.prune(options['retention_days'])
+			self.stdout.write(self.style.SUCCESS(f'Pruned {deleted} raw usage rows older than {options["retention_days"]} days'))
@@ -0,0 +1,69 @@
+import time
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from rag_app.models import OutboundEmail
+from rag_app.outbox import deliver_pending
+
+
+class Command(BaseCommand):
+	help = 'Send queued emails in batches over a reused SMTP connection'
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--once',
+			action='store_true',
+			help='Drain the queue once and exit (for cron) instead of running as a worker',
+		)
+		parser.add_argument(
+			'--batch-size',
+			type=int,
+			default=settings.EMAIL_QUEUE_BATCH_SIZE,
+			help='Emails claimed and sent per batch',
+		)
+		parser.add_argument(
+			'--interval',
+			type=float,
+			default=settings.EMAIL_WORKER_INTERVAL,
+			help='Seconds to wait between polls when the queue is empty',
+		)
+
+	def handle(self, *args, **options):
+		if options['once']:
+			totals = deliver_pending(batch_size=options['batch_size'])
+			self.report(totals)
+			return
+
+		self.stdout.write(f"Email worker polling every {options['interval']}s (Ctrl+C to stop)")
+		connection = get_connection(fail_silently=False)
+		idle_since = None
+		try:
+			while True:
+				close_old_connections()
+				try:
+					totals = deliver_pending(batch_size=options['batch_size'], connection=connection)
+				except Exception as e:
+					self.stderr.write(f"Email delivery failed: {e}")
+					connection.close()
+					totals = {'sent': 0, 'failed': 0, 'batches': 0}
+
+				if totals['batches']:
+					self.report(totals)
+					idle_since = None
+				else:
+					# keep the SMTP session while mail keeps coming, drop it once idle
+					idle_since = idle_since or time.monotonic()
+					if time.monotonic() - idle_since > settings.EMAIL_CONNECTION_IDLE_TIMEOUT:
+						connection.close()
+					time.sleep(options['interval'])
+		except KeyboardInterrupt:
+			self.stdout.write('Email worker stopped')
+		finally:
+			connection.close()
+
+	def report(self, totals):
+		pending = OutboundEmail.objects.filter(status=OutboundEmail.STATUS_PENDING).count()
+		self.stdout.write(
+			f"Sent {totals['sent']}, failed {totals['failed']} in {totals['batches']} batches ({pending} pending)"
+		)
@@ -0,0 +1,262 @@
+"""
+Lightweight in-process instrumentation.
+
+- timed('stage') is a context manager / decorator that records the stage duration
+  into the rag_stage_seconds histogram and into the current request's trace.
+- openai_call(endpoint, model) does the same for OpenAI requests, counts tokens
+  from the response usage and hands the call to rag_app.usage for cost accounting.
+- MetricsMiddleware gives every request a trace id (X-Request-ID), records request
+  latency, and optionally adds a Server-Timing header built from the trace.
+- metrics_view serves everything in the Prometheus text format at /metrics.
+
+Metrics live in the memory of each worker process; scrape each worker or run a
+single one. With METRICS_ENABLED off every timer is a shared no-op object.
+"""
+import bisect
+import contextvars
+import functools
+import re
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.http import HttpResponse
+from . import usage as usage_accounting
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+def _labels(names, values) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ('le',)
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (le,))} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+STAGE_SECONDS = Histogram('rag_stage_seconds', 'Duration of pipeline stages', ['stage'])
+REQUEST_SECONDS = Histogram('rag_http_request_seconds', 'Duration of HTTP requests', ['route', 'method', 'status'])
+OPENAI_SECONDS = Histogram('rag_openai_request_seconds', 'Duration of OpenAI API calls', ['endpoint', 'model'])
+OPENAI_ERRORS = Counter('rag_openai_errors_total', 'OpenAI API calls that raised', ['endpoint', 'model'])
+OPENAI_TOKENS = Counter('rag_openai_tokens_total', 'Tokens reported by OpenAI responses', ['endpoint', 'model', 'kind'])
+LLM_ROUTES = Counter('rag_llm_routes_total', 'Model routing decisions for chat turns', ['tier', 'reason'])
+REGISTRY = [STAGE_SECONDS, REQUEST_SECONDS, OPENAI_SECONDS, OPENAI_ERRORS, OPENAI_TOKENS, LLM_ROUTES]
+
+def enabled() -> bool:
+    return settings.METRICS_ENABLED
+
+# --- per-request trace ----------------------------------------------------------
+
+class Trace:
+    __slots__ = ('id', 'spans')
+
+    def __init__(self, trace_id: str):
+        self.id = trace_id
+        self.spans = []  # (name, seconds), in completion order
+
+_trace: contextvars.ContextVar = contextvars.ContextVar('rag_trace', default=None)
+
+def current_trace_id() -> str | None:
+    trace = _trace.get()
+    return trace.id if trace else None
+
+def _record(name: str, seconds: float):
+    trace = _trace.get()
+    if trace is not None:
+        trace.spans.append((name, seconds))
+
+# --- timers ---------------------------------------------------------------------
+
+class _NoopTimer:
+    seconds = 0.0
+    usage = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _NoopTimer()
+
+class _StageTimer:
+    __slots__ = ('stage', 'seconds', '_t0')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self._t0
+        STAGE_SECONDS.observe(self.seconds, self.stage)
+        _record(self.stage, self.seconds)
+        return False
+
+class timed:
+    """Time a pipeline stage: `with timed('retrieve'):` or `@timed('render')`."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self._timer = _StageTimer(self.stage) if enabled() else _NOOP
+        return self._timer.__enter__()
+
+    def __exit__(self, *exc):
+        return self._timer.__exit__(*exc)
+
+    def __call__(self, func):
+        stage = self.stage
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            with _StageTimer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+class _OpenAICall:
+    __slots__ = ('endpoint', 'model', 'usage', 'seconds', '_t0')
+
+    def __init__(self, endpoint: str, model: str):
+        self.endpoint, self.model = endpoint, model or ''
+        self.usage = None
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._t0
+        if enabled():
+            OPENAI_SECONDS.observe(self.seconds, self.endpoint, self.model)
+            _record(f"openai_{self.endpoint}", self.seconds)
+            if exc_type is not None:
+                OPENAI_ERRORS.inc(1, self.endpoint, self.model)
+            elif self.usage is not None:
+                for kind in ('prompt_tokens', 'completion_tokens'):
+                    n = getattr(self.usage, kind, None)
+                    if n:
+                        OPENAI_TOKENS.inc(n, self.endpoint, self.model, kind.split('_')[0])
+                cached = usage_accounting.cached_tokens_of(self.usage)
+                if cached:
+                    OPENAI_TOKENS.inc(cached, self.endpoint, self.model, 'cached')
+        if usage_accounting.enabled():
+            usage_accounting.record(self.endpoint, self.model, self.seconds, self.usage,
+                                    success=exc_type is None, trace_id=current_trace_id())
+        return False
+
+def openai_call(endpoint: str, model: str):
+    """Time an OpenAI request; set `.usage = resp.usage` inside the block to count tokens."""
+    if enabled() or usage_accounting.enabled():
+        return _OpenAICall(endpoint, model)
+    return _NoopTimer()
+
+# --- HTTP -----------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(r'[^A-Za-z0-9_.-]')
+
+def server_timing(spans) -> str:
+    """Server-Timing header value; repeated stages (e.g. several OpenAI calls) are summed."""
+    totals = {}
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ', '.join(f"{_TOKEN_RE.sub('_', name)};dur={seconds * 1000.0:.1f}" for name, seconds in totals.items())
+
+class MetricsMiddleware:
+    """Trace id, request latency histogram and optional Server-Timing header."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not enabled():
+            return self.get_response(request)
+
+        incoming = request.headers.get('X-Request-ID', '')
+        trace = Trace(incoming[:64] if incoming else uuid.uuid4().hex)
+        token = _trace.set(trace)
+        request.trace_id = trace.id
+        t0 = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _trace.reset(token)
+        elapsed = time.perf_counter() - t0
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match else 'unmatched'
+        REQUEST_SECONDS.observe(elapsed, route, request.method, str(response.status_code))
+
+        response['X-Request-ID'] = trace.id
+        if settings.SERVER_TIMING_ENABLED:
+            spans = trace.spans + [('total', elapsed)]
+            response['Server-Timing'] = server_timing(spans)
+        return response
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; requires `Authorization: Bearer <METRICS_TOKEN>` when a token is set."""
+    if not enabled():
+        return HttpResponse('metrics disabled\n', status=404, content_type='text/plain')
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {settings.METRICS_TOKEN}":
+        return HttpResponse('unauthorized\n', status=401, content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0009_conversation_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page', models.IntegerField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('chunk_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='rag_app.document')),
+            ],
+            options={
+                'ordering': ('page',),
+                'unique_together': {('document', 'page')},
+            },
+        ),
+    ]
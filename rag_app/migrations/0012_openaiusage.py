@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:50
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0011_outboundemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenAIUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('page', models.IntegerField(blank=True, null=True)),
+                ('endpoint', models.CharField(max_length=16)),
+                ('model', models.CharField(max_length=64)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('completion_tokens', models.IntegerField(default=0)),
+                ('latency_ms', models.FloatField(default=0)),
+                ('cost_usd', models.DecimalField(decimal_places=8, default=0, max_digits=14)),
+                ('success', models.BooleanField(default=True)),
+                ('trace_id', models.CharField(blank=True, default='', max_length=64)),
+                ('conversation', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='rag_app.conversation')),
+                ('document', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='rag_app.document')),
+                ('user', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='rag_app_ope_created_f2c6cf_idx'), models.Index(fields=['user', 'created_at'], name='rag_app_ope_user_id_00911e_idx'), models.Index(fields=['document', 'created_at'], name='rag_app_ope_documen_9127c7_idx'), models.Index(fields=['conversation', 'created_at'], name='rag_app_ope_convers_107705_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='OpenAIUsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('endpoint', models.CharField(max_length=16)),
+                ('model', models.CharField(max_length=64)),
+                ('calls', models.IntegerField(default=0)),
+                ('errors', models.IntegerField(default=0)),
+                ('prompt_tokens', models.BigIntegerField(default=0)),
+                ('completion_tokens', models.BigIntegerField(default=0)),
+                ('latency_ms', models.FloatField(default=0)),
+                ('cost_usd', models.DecimalField(decimal_places=8, default=0, max_digits=14)),
+                ('document', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='rag_app.document')),
+                ('user', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='rag_app_ope_day_65eb37_idx'), models.Index(fields=['user', 'day'], name='rag_app_ope_user_id_25d087_idx')],
+            },
+        ),
+    ]
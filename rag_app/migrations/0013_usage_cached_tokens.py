@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0012_openaiusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openaiusage',
+            name='cached_tokens',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='openaiusagedaily',
+            name='cached_tokens',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
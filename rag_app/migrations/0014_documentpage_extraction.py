@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0013_usage_cached_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentpage',
+            name='description',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='documentpage',
+            name='extracted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentpage',
+            name='extracted_text',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='documentpage',
+            name='extraction_model',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='documentpage',
+            name='extraction_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentpage',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='documentpage',
+            name='image_path',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+    ]
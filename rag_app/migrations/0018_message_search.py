@@ -0,0 +1,54 @@
+# Full-text index over Message.content; see rag_app/search.py
+
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS rag_app_message_fts USING fts5("
+    "content, content='rag_app_message', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS rag_app_message_fts_ai AFTER INSERT ON rag_app_message BEGIN "
+    "INSERT INTO rag_app_message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS rag_app_message_fts_ad AFTER DELETE ON rag_app_message BEGIN "
+    "INSERT INTO rag_app_message_fts(rag_app_message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS rag_app_message_fts_au AFTER UPDATE OF content ON rag_app_message BEGIN "
+    "INSERT INTO rag_app_message_fts(rag_app_message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO rag_app_message_fts(rowid, content) VALUES (new.id, new.content); END",
+    # index the messages that already exist
+    "INSERT INTO rag_app_message_fts(rag_app_message_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS rag_app_message_fts_ai",
+    "DROP TRIGGER IF EXISTS rag_app_message_fts_ad",
+    "DROP TRIGGER IF EXISTS rag_app_message_fts_au",
+    "DROP TABLE IF EXISTS rag_app_message_fts",
+]
+# the expression must stay identical to the one search.py queries, or the planner won't use the index
+POSTGRES_FORWARD = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS rag_app_message_content_fts "
+    "ON rag_app_message USING GIN (to_tsvector('english', content))",
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX CONCURRENTLY IF EXISTS rag_app_message_content_fts",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('rag_app', '0017_message_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            _run({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+        ),
+    ]
@@ -1,6 +1,10 @@
 from django.db import models
+from django.db.models import Exists, OuterRef, Q
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.core.cache import cache
 from django.utils import timezone
+import hashlib
 import secrets
 
 class CustomUserManager(BaseUserManager):
@@ -106,11 +110,26 @@ class UserSession(models.Model):
 		self.expires_at = new_expires_at
 		self.last_activity = timezone.now()
 		self.save()
+		cache.delete(self.cache_key(self.session_token))
 
 	def deactivate(self):
 		"""Deactivate the session"""
 		self.is_active = False
-		self.save()
+		self.save(update_fields=['is_active'])
+		cache.delete(self.cache_key(self.session_token))
+
+	@staticmethod
+	def cache_key(session_token):
+		"""Cache key for a validated session (tokens are hashed to fit any cache backend's key rules)"""
+		return 'user-session:' + hashlib.sha256(session_token.encode()).hexdigest()
+
+	def touch(self):
+		"""Record activity, writing last_activity at most once per SESSION_ACTIVITY_INTERVAL"""
+		# cache.add only succeeds for the first caller in the interval, across processes on a shared cache
+		if cache.add(f'user-session-touch:{self.pk}', 1, timeout=settings.SESSION_ACTIVITY_INTERVAL):
+			now = timezone.now()
+			type(self).objects.filter(pk=self.pk).update(last_activity=now)
+			self.last_activity = now
 
 	@classmethod
 	def create_session(cls, user, session_token, refresh_token, ip_address=None, user_agent=None, expires_at=None):
@@ -119,7 +138,9 @@ class UserSession(models.Model):
 			expires_at = timezone.now() + timezone.timedelta(days=1)  # 24 hours default
 		
 		# Deactivate all existing sessions for this user
-		cls.objects.filter(user=user, is_active=True).update(is_active=False)
+		previous = cls.objects.filter(user=user, is_active=True)
+		cache.delete_many([cls.cache_key(t) for t in previous.values_list('session_token', flat=True)])
+		previous.update(is_active=False)
 		
 		# Create new session
 		session = cls.objects.create(
@@ -141,19 +162,27 @@ class UserSession(models.Model):
 
 	@classmethod
 	def get_valid_session(cls, session_token):
-		"""Get a valid session by token"""
-		try:
-			session = cls.objects.get(
-				session_token=session_token,
-				is_active=True,
-				expires_at__gt=timezone.now()
-			)
-			# Update last activity
-			session.last_activity = timezone.now()
-			session.save()
-			return session
-		except cls.DoesNotExist:
-			return None
+		"""Get a valid session by token, served from the cache for up to SESSION_CACHE_TTL seconds"""
+		key = cls.cache_key(session_token)
+		now = timezone.now()
+		session = cache.get(key)
+		if session is None or not session.is_active or session.expires_at <= now:
+			try:
+				session = cls.objects.get(
+					session_token=session_token,
+					is_active=True,
+					expires_at__gt=now
+				)
+			except cls.DoesNotExist:
+				cache.delete(key)
+				return None
+			# never cache past the session's own expiry
+			ttl = min(settings.SESSION_CACHE_TTL, int((session.expires_at - now).total_seconds()))
+			if ttl > 0:
+				cache.set(key, session, timeout=ttl)
+		# Update last activity
+		session.touch()
+		return session
 
 	@classmethod
 	def get_valid_refresh_session(cls, refresh_token):
@@ -169,35 +198,140 @@ class UserSession(models.Model):
 			return None
 
 	@classmethod
-	def cleanup_expired_sessions(cls):
-		"""Clean up expired sessions"""
-		expired_sessions = cls.objects.filter(
-			expires_at__lt=timezone.now(),
-			is_active=True
-		)
-		
-		# Update users who have no active sessions
-		users_with_expired_sessions = expired_sessions.values_list('user_id', flat=True).distinct()
-		for user_id in users_with_expired_sessions:
-			if not cls.objects.filter(user_id=user_id, is_active=True, expires_at__gt=timezone.now()).exists():
-				CustomUser.objects.filter(id=user_id).update(
-					is_active_session=False,
-					session_created_at=None,
-					session_expires_at=None
-				)
-		
+	def users_losing_last_session(cls, now=None):
+		"""Users with an expired active session and no other valid session, as one anti-join query"""
+		now = now or timezone.now()
+		still_valid = cls.objects.filter(user_id=OuterRef('pk'), is_active=True, expires_at__gt=now)
+		expired = cls.objects.filter(is_active=True, expires_at__lt=now)
+		return CustomUser.objects.filter(id__in=expired.values('user_id')).filter(~Exists(still_valid))
+
+	@classmethod
+	def cleanup_expired_sessions(cls, batch_size=None, now=None):
+		"""Clean up expired sessions in short batches; returns (users updated, sessions deactivated)"""
+		batch_size = batch_size or settings.SESSION_CLEANUP_BATCH_SIZE
+		now = now or timezone.now()
+
+		# Update users who have no active sessions (before deactivating, which changes the result)
+		users = cls.users_losing_last_session(now).order_by('id').values_list('id', flat=True)
+		users_updated, last_id = 0, 0
+		while True:
+			ids = list(users.filter(id__gt=last_id)[:batch_size])
+			if not ids:
+				break
+			users_updated += CustomUser.objects.filter(id__in=ids).update(
+				is_active_session=False,
+				session_created_at=None,
+				session_expires_at=None
+			)
+			last_id = ids[-1]
+
 		# Deactivate expired sessions
-		expired_sessions.update(is_active=False)
+		expired = cls.objects.filter(is_active=True, expires_at__lt=now).order_by('id').values_list('id', flat=True)
+		deactivated = 0
+		while True:
+			ids = list(expired[:batch_size])
+			if not ids:
+				break
+			deactivated += cls.objects.filter(id__in=ids).update(is_active=False)
+
+		return users_updated, deactivated
+
+	@classmethod
+	def purge_inactive_sessions(cls, older_than=None, batch_size=None):
+		"""Delete inactive sessions that expired or were last used before `older_than`; returns rows deleted"""
+		batch_size = batch_size or settings.SESSION_CLEANUP_BATCH_SIZE
+		if older_than is None:
+			older_than = timezone.now() - timezone.timedelta(days=settings.SESSION_RETENTION_DAYS)
+		stale = cls.objects.filter(
+			Q(expires_at__lt=older_than) | Q(last_activity__lt=older_than),
+			is_active=False,
+		).order_by('id').values_list('id', flat=True)
+		deleted = 0
+		while True:
+			ids = list(stale[:batch_size])
+			if not ids:
+				break
+			count, _ = cls.objects.filter(id__in=ids).delete()
+			deleted += count
+		return deleted
 
 class Document(models.Model):
     owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='documents')
     file = models.FileField(upload_to='docs/')
     original_name = models.CharField(max_length=255)
+    sha256 = models.CharField(max_length=64, blank=True, default='')  # of the file bytes; re-uploads of the same file are not re-ingested
+    size = models.BigIntegerField(null=True, blank=True)
+    page_count = models.IntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['owner', 'sha256'])]
+
     def __str__(self):
         return f"{self.original_name} (u{self.owner_id})"
 
+class Blob(models.Model):
+    """
+    A content-addressed file under MEDIA_ROOT/blobs, stored once however many documents use it.
+    ref_count is the number of Document (PDF) or DocumentPage (page image) rows referencing it.
+    """
+    PDF = 'pdf'
+    PAGE = 'page'
+    KIND_CHOICES = [
+        (PDF, 'PDF'),
+        (PAGE, 'Page image'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    sha256 = models.CharField(max_length=64)
+    name = models.CharField(max_length=255)  # storage name, relative to MEDIA_ROOT
+    size = models.BigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('kind', 'sha256')
+
+    def __str__(self):
+        return f"{self.kind} {self.sha256[:12]} x{self.ref_count}"
+
+class DocumentPage(models.Model):
+    """
+    One page of an ingested document: its content hash (to diff re-uploads) and the Vision
+    output. The stored text is the source of truth for chunking and embedding, so the
+    vector index can be rebuilt without calling Vision again.
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='pages')
+    page = models.IntegerField()
+    content_hash = models.CharField(max_length=64)
+    chunk_count = models.IntegerField(default=0)
+    extracted_text = models.TextField(blank=True, default='')
+    description = models.TextField(blank=True, default='')
+    image_hash = models.CharField(max_length=64, blank=True, default='')  # sha256 of the rendered page pixels
+    image_path = models.CharField(max_length=500, blank=True, default='')
+    extraction_model = models.CharField(max_length=100, blank=True, default='')
+    extraction_ms = models.FloatField(null=True, blank=True)
+    extracted_at = models.DateTimeField(null=True, blank=True)  # null: Vision failed, or indexed before its output was stored
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('document', 'page')
+        ordering = ('page',)
+
+    def __str__(self):
+        return f"doc{self.document_id} p{self.page}"
+
+    @property
+    def content(self) -> str:
+        """Text that gets chunked: the extracted text, or the description for pages without text."""
+        return self.extracted_text.strip() or self.description.strip()
+
+    def extraction_fields(self) -> dict:
+        return {f: getattr(self, f) for f in EXTRACTION_FIELDS}
+
+EXTRACTION_FIELDS = ('extracted_text', 'description', 'image_hash', 'image_path', 'extraction_model', 'extraction_ms', 'extracted_at')
+
 class Conversation(models.Model):
     owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='conversations')
     title = models.CharField(max_length=255, blank=True, default='')
@@ -214,6 +348,12 @@ class Message(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
+
 class MessageSource(models.Model):
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='sources')
     document = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True)
@@ -222,6 +362,62 @@ class MessageSource(models.Model):
     image_path = models.TextField(blank=True, default='')
     source = models.TextField(blank=True, default='')  # file path or name
 
+def _untracked_fk(model):
+    # usage rows outlive the objects they describe and are written in the background, so no DB constraint
+    return models.ForeignKey(model, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+')
+
+class OpenAIUsage(models.Model):
+    """One OpenAI API call, written in batches by rag_app.usage."""
+    created_at = models.DateTimeField(default=timezone.now)
+    user = _untracked_fk(CustomUser)
+    conversation = _untracked_fk(Conversation)
+    document = _untracked_fk(Document)
+    page = models.IntegerField(null=True, blank=True)
+    endpoint = models.CharField(max_length=16)  # chat | vision | embeddings
+    model = models.CharField(max_length=64)
+    prompt_tokens = models.IntegerField(default=0)
+    completion_tokens = models.IntegerField(default=0)
+    cached_tokens = models.IntegerField(default=0)  # part of prompt_tokens served from the provider's prompt cache
+    latency_ms = models.FloatField(default=0)
+    cost_usd = models.DecimalField(max_digits=14, decimal_places=8, default=0)
+    success = models.BooleanField(default=True)
+    trace_id = models.CharField(max_length=64, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['user', 'created_at']),
+            models.Index(fields=['document', 'created_at']),
+            models.Index(fields=['conversation', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.model} u{self.user_id} {self.prompt_tokens}+{self.completion_tokens}"
+
+class OpenAIUsageDaily(models.Model):
+    """Per day, user, document, endpoint and model totals of OpenAIUsage (see rollup_usage)."""
+    day = models.DateField()
+    user = _untracked_fk(CustomUser)
+    document = _untracked_fk(Document)
+    endpoint = models.CharField(max_length=16)
+    model = models.CharField(max_length=64)
+    calls = models.IntegerField(default=0)
+    errors = models.IntegerField(default=0)
+    prompt_tokens = models.BigIntegerField(default=0)
+    completion_tokens = models.BigIntegerField(default=0)
+    cached_tokens = models.BigIntegerField(default=0)
+    latency_ms = models.FloatField(default=0)  # total, divide by calls for the mean
+    cost_usd = models.DecimalField(max_digits=14, decimal_places=8, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['day']),
+            models.Index(fields=['user', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.day} u{self.user_id} {self.endpoint} {self.model}"
+
 class EmailVerificationToken(models.Model):
 	user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='email_verification_tokens')
 	token = models.CharField(max_length=255, unique=True)
@@ -249,3 +445,40 @@ class PasswordResetToken(models.Model):
 	def is_expired(self):
 		from django.utils import timezone
 		return timezone.now() > self.expires_at
+
+class OutboundEmail(models.Model):
+	"""Queued email, delivered in batches by the send_queued_email worker"""
+	STATUS_PENDING = 'pending'
+	STATUS_SENDING = 'sending'
+	STATUS_SENT = 'sent'
+	STATUS_FAILED = 'failed'
+	STATUS_CHOICES = [
+		(STATUS_PENDING, 'Pending'),
+		(STATUS_SENDING, 'Sending'),
+		(STATUS_SENT, 'Sent'),
+		(STATUS_FAILED, 'Failed'),
+	]
+
+	to_email = models.EmailField()
+	from_email = models.CharField(max_length=255, blank=True)
+	subject = models.CharField(max_length=255)
+	text_body = models.TextField(blank=True)
+	html_body = models.TextField(blank=True)
+	status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+	attempts = models.IntegerField(default=0)
+	last_error = models.TextField(blank=True)
+	claim = models.CharField(max_length=32, blank=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+	next_attempt_at = models.DateTimeField(default=timezone.now)
+	locked_at = models.DateTimeField(null=True, blank=True)
+	sent_at = models.DateTimeField(null=True, blank=True)
+
+	class Meta:
+		db_table = 'email_outbox'
+		indexes = [
+			models.Index(fields=['status', 'next_attempt_at']),
+			models.Index(fields=['claim']),
+		]
+
+	def __str__(self):
+		return f"{self.subject} -> {self.to_email} ({self.status})"
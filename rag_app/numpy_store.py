@@ -0,0 +1,313 @@
+from __future__ import annotations
+import json
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import List
+import numpy as np
+from django.conf import settings
+from .openai_helpers import embed_texts
+from .store import VectorStore
+
+# Rows scored per matmul block, bounds the float32 temporaries made from float16 storage
+SCORE_BLOCK = 65536
+
+# (user dir) -> (version, state); versions are immutable so a cached state never goes stale
+_states: dict[str, tuple[str, dict]] = {}
+_write_lock = threading.Lock()
+
+def _normalize(x) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+def _scores(vectors: np.ndarray, q: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+    """Cosine scores of (normalised) rows against q, computed block-wise in float32."""
+    n = vectors.shape[0] if rows is None else len(rows)
+    out = np.empty(n, dtype=np.float32)
+    for start in range(0, n, SCORE_BLOCK):
+        end = min(start + SCORE_BLOCK, n)
+        block = vectors[start:end] if rows is None else vectors[rows[start:end]]
+        out[start:end] = np.asarray(block, dtype=np.float32) @ q
+    return out
+
+def topk_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indexes of the k largest scores, best first (argpartition + sort of the k)."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind='stable')]
+
+def quantize_int8(vectors: np.ndarray):
+    """Symmetric per-dimension int8 codes; returns (codes, scale) with x ~= codes * scale."""
+    x = np.asarray(vectors, dtype=np.float32)
+    scale = np.maximum(np.abs(x).max(axis=0), 1e-12) / 127.0 if len(x) else np.ones(x.shape[1], dtype=np.float32)
+    codes = np.clip(np.rint(x / scale), -127, 127).astype(np.int8)
+    return codes, scale.astype(np.float32)
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    """One sign bit per dimension, packed 8 per byte."""
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+if hasattr(np, 'bitwise_count'):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    def _popcount(x):
+        return _POPCOUNT[x]
+
+def _code_scores(state: dict, q: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+    """Approximate scores from the quantized codes (higher is better)."""
+    codes = state['codes']
+    n = codes.shape[0] if rows is None else len(rows)
+    out = np.empty(n, dtype=np.float32)
+    if state['quantization'] == 'int8':
+        qs = q * state['scale']
+    else:
+        qbits = quantize_binary(q[None, :])[0]
+    for start in range(0, n, SCORE_BLOCK):
+        end = min(start + SCORE_BLOCK, n)
+        block = codes[start:end] if rows is None else codes[rows[start:end]]
+        if state['quantization'] == 'int8':
+            out[start:end] = block.astype(np.float32) @ qs
+        else:
+            # negative Hamming distance between sign bits
+            out[start:end] = -_popcount(block ^ qbits).sum(axis=1, dtype=np.int32)
+    return out
+
+def train_ivf(vectors: np.ndarray, nlist: int, iters: int = 10, sample: int = 50_000, seed: int = 0):
+    """Spherical k-means over (a sample of) the rows; returns (centroids, assignment per row)."""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    pick = rng.choice(n, min(sample, n), replace=False)
+    x = np.asarray(vectors[np.sort(pick)], dtype=np.float32)
+    centroids = x[rng.choice(len(x), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=nlist)
+        filled = counts > 0
+        centroids[filled] = _normalize(sums[filled])
+    assign = np.empty(n, dtype=np.int32)
+    for start in range(0, n, SCORE_BLOCK):
+        block = np.asarray(vectors[start:start + SCORE_BLOCK], dtype=np.float32)
+        assign[start:start + SCORE_BLOCK] = np.argmax(block @ centroids.T, axis=1)
+    return centroids, assign
+
+class NumpyStore(VectorStore):
+    """
+    In-process vector store: one memory-mapped matrix of normalised vectors per user,
+    searched with a vectorised dot product and argpartition top-k, optionally pruned
+    by an IVF (inverted file) index for larger tenants.
+
+    With quantization ('int8' or 'binary') only the compact codes are held in memory
+    for the first pass; the best `rescore_factor * top_k` candidates are then rescored
+    against the full-precision vectors, which stay memory-mapped on disk.
+
+    Each write produces a new immutable snapshot directory (vectors.npy, rows.json,
+    ivf.npz) and then atomically repoints CURRENT at it, so readers never observe a
+    half-written state. Writes are serialised within a process only.
+    """
+
+    def __init__(self, path: str | None = None, dtype: str | None = None, index: str | None = None,
+                 ivf_min_vectors: int | None = None, nprobe: int | None = None,
+                 quantization: str | None = None, rescore_factor: int | None = None):
+        self.path = Path(path or settings.NUMPY_STORE_DIR)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dtype = np.dtype(dtype or settings.NUMPY_STORE_DTYPE)
+        self.index = index or settings.NUMPY_STORE_INDEX
+        self.ivf_min_vectors = int(ivf_min_vectors or settings.NUMPY_STORE_IVF_MIN_VECTORS)
+        self.nprobe = int(nprobe or settings.NUMPY_STORE_IVF_NPROBE)
+        self.quantization = quantization or settings.NUMPY_STORE_QUANTIZATION
+        if self.quantization not in ('none', 'int8', 'binary'):
+            raise ValueError(f"Unknown NUMPY_STORE_QUANTIZATION {self.quantization!r}")
+        self.rescore_factor = max(1, int(rescore_factor or settings.NUMPY_STORE_RESCORE_FACTOR))
+
+    # --- snapshots ---------------------------------------------------------------
+
+    def _user_dir(self, user_id: int) -> Path:
+        return self.path / f"u{int(user_id)}"
+
+    def _load(self, user_id: int) -> dict | None:
+        udir = self._user_dir(user_id)
+        try:
+            version = (udir / 'CURRENT').read_text().strip()
+        except FileNotFoundError:
+            return None
+        cached = _states.get(str(udir))
+        if cached and cached[0] == version:
+            return cached[1]
+        vdir = udir / version
+        with open(vdir / 'rows.json') as fh:
+            rows = json.load(fh)
+        state = {
+            'rows': rows,
+            'vectors': np.load(vdir / 'vectors.npy', mmap_mode='r'),
+            'document_ids': np.array([r['document_id'] for r in rows], dtype=np.int64),
+        }
+        if (vdir / 'ivf.npz').exists():
+            ivf = np.load(vdir / 'ivf.npz')
+            state['centroids'] = ivf['centroids']
+            state['assign'] = ivf['assign']
+        if (vdir / 'codes.npz').exists():
+            # codes are the in-memory search structure, so they are read fully, not mapped
+            codes = np.load(vdir / 'codes.npz')
+            state['quantization'] = str(codes['kind'])
+            state['codes'] = codes['codes']
+            if 'scale' in codes:
+                state['scale'] = codes['scale']
+        _states[str(udir)] = (version, state)
+        return state
+
+    def _write(self, user_id: int, rows: list[dict], vectors: np.ndarray):
+        udir = self._user_dir(user_id)
+        version = uuid.uuid4().hex
+        vdir = udir / version
+        vdir.mkdir(parents=True)
+        np.save(vdir / 'vectors.npy', np.ascontiguousarray(vectors, dtype=self.dtype))
+        with open(vdir / 'rows.json', 'w') as fh:
+            json.dump(rows, fh)
+        if self.index == 'ivf' and len(rows) >= self.ivf_min_vectors:
+            nlist = max(1, int(np.sqrt(len(rows))))
+            centroids, assign = train_ivf(vectors, nlist)
+            np.savez(vdir / 'ivf.npz', centroids=centroids, assign=assign)
+        if self.quantization == 'int8':
+            codes, scale = quantize_int8(vectors)
+            np.savez(vdir / 'codes.npz', kind='int8', codes=codes, scale=scale)
+        elif self.quantization == 'binary':
+            np.savez(vdir / 'codes.npz', kind='binary', codes=quantize_binary(vectors))
+        tmp = udir / f"CURRENT.{version}.tmp"
+        tmp.write_text(version)
+        os.replace(tmp, udir / 'CURRENT')
+        # old snapshots stay readable through already-open memory maps until released
+        for child in udir.iterdir():
+            if child.is_dir() and child.name != version:
+                shutil.rmtree(child, ignore_errors=True)
+
+    def _rewrite(self, user_id: int, keep) -> int:
+        """Rewrite a user's snapshot keeping rows for which keep(row) is truthy (may mutate the row)."""
+        with _write_lock:
+            state = self._load(user_id)
+            if state is None:
+                return 0
+            rows, idx = [], []
+            for i, row in enumerate(state['rows']):
+                row = dict(row)
+                if keep(row):
+                    rows.append(row)
+                    idx.append(i)
+            if len(rows) == len(state['rows']) and rows == state['rows']:
+                return 0
+            self._write(user_id, rows, np.asarray(state['vectors'][idx], dtype=np.float32))
+            return len(state['rows']) - len(rows)
+
+    # --- VectorStore ---------------------------------------------------------------
+
+    def upsert_chunks(self, user_id: int, document_id: int, chunks: List[dict], embeddings: list | None = None) -> int:
+        if not chunks:
+            return 0
+        ids, docs, metas, kept = self.chunk_records(user_id, document_id, chunks)
+        if not ids:
+            return 0
+        if embeddings is None:
+            vectors = embed_texts(docs)
+        else:
+            vectors = [embeddings[i] for i in kept]
+        vectors = _normalize(vectors)
+        new_rows = [{'id': cid, 'text': doc, **md} for cid, doc, md in zip(ids, docs, metas)]
+
+        with _write_lock:
+            state = self._load(user_id)
+            if state is None or not state['rows']:
+                rows, matrix = new_rows, vectors
+            else:
+                if state['vectors'].shape[1] != vectors.shape[1]:
+                    raise ValueError(
+                        f"Embedding dimension {vectors.shape[1]} does not match the stored "
+                        f"{state['vectors'].shape[1]}; re-index this user's vectors first"
+                    )
+                rows = state['rows'] + new_rows
+                matrix = np.vstack([np.asarray(state['vectors'], dtype=np.float32), vectors])
+            self._write(user_id, rows, matrix)
+        return len(ids)
+
+    def query(self, user_id: int, text: str, top_k: int = 8, document_ids: list[int] | None = None) -> list[dict]:
+        return self.query_by_vector(user_id, embed_texts([text])[0], top_k=top_k, document_ids=document_ids)
+
+    def query_by_vector(self, user_id: int, vector, top_k: int = 8, document_ids: list[int] | None = None) -> list[dict]:
+        state = self._load(user_id)
+        if state is None or not state['rows']:
+            return []
+        q = _normalize(vector)
+        vectors = state['vectors']
+
+        candidates = None
+        if 'centroids' in state:
+            probe = topk_indices(state['centroids'] @ q, self.nprobe)
+            candidates = np.flatnonzero(np.isin(state['assign'], probe))
+        if document_ids:
+            allowed = np.isin(state['document_ids'], [int(d) for d in document_ids])
+            candidates = np.flatnonzero(allowed) if candidates is None else candidates[allowed[candidates]]
+
+        if 'codes' in state:
+            approx = _code_scores(state, q, candidates)
+            shortlist = topk_indices(approx, top_k * self.rescore_factor)
+            candidates = shortlist if candidates is None else candidates[shortlist]
+
+        scores = _scores(vectors, q, candidates)
+        order = topk_indices(scores, top_k)
+        picked = order if candidates is None else candidates[order]
+        out = []
+        for i, score in zip(picked, scores[order]):
+            row = dict(state['rows'][int(i)])
+            row.pop('id', None)
+            row['score'] = round(float(score), 4)
+            out.append(row)
+        return out
+
+    def document_chunks(self, user_id: int, document_id: int) -> list[dict]:
+        state = self._load(user_id)
+        if state is None:
+            return []
+        rows = [dict(state['rows'][int(i)]) for i in np.flatnonzero(state['document_ids'] == int(document_id))]
+        for row in rows:
+            row.pop('id', None)
+        return sorted(rows, key=lambda r: (int(r.get('page', 0)), int(r.get('chunk', 0))))
+
+    def page_vectors(self, user_id: int, document_id: int, pages: list[int]) -> tuple[list[dict], list]:
+        state = self._load(user_id)
+        if state is None or not pages:
+            return [], []
+        wanted = {int(p) for p in pages}
+        idx = [int(i) for i in np.flatnonzero(state['document_ids'] == int(document_id)) if state['rows'][int(i)]['page'] in wanted]
+        chunks = [dict(state['rows'][i]) for i in idx]
+        for row in chunks:
+            row.pop('id', None)
+        return chunks, list(np.asarray(state['vectors'][idx], dtype=np.float32))
+
+    def delete_document(self, user_id: int, document_id: int):
+        self._rewrite(user_id, lambda row: row['document_id'] != int(document_id))
+
+    def delete_pages(self, user_id: int, document_id: int, pages: list[int]):
+        if not pages:
+            return
+        doomed = {int(p) for p in pages}
+        self._rewrite(user_id, lambda row: not (row['document_id'] == int(document_id) and row['page'] in doomed))
+
+    def remap_pages(self, user_id: int, document_id: int, page_map: dict[int, int], source: str | None = None) -> int:
+        changed = 0
+        def keep(row):
+            nonlocal changed
+            if row['document_id'] == int(document_id) and row['page'] in page_map:
+                new_page = int(page_map[row['page']])
+                new_source = str(source) if source is not None else row['source']
+                if (new_page, new_source) != (row['page'], row['source']):
+                    row['page'], row['source'] = new_page, new_source
+                    changed += 1
+            return True
+        self._rewrite(user_id, keep)
+        return changed
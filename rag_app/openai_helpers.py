@@ -1,20 +1,218 @@
-import base64, io, json, os, sys
-from typing import List, Dict, Any, Optional
+import base64, io, json, os, sys, threading, time
+from typing import List, Dict, Any, Iterator, NamedTuple, Optional
 from openai import OpenAI
 from PIL import Image
 from django.conf import settings
+from . import prompts
+from .packing import pack_context
+from .metrics import openai_call
 
-_client_singleton: Optional[OpenAI] = None
+class ProviderHealth:
+    """
+    Recent behaviour of one provider. After LLM_FAILURE_THRESHOLD consecutive errors, or
+    when the moving average latency goes over LLM_SLOW_THRESHOLD_MS, the provider is
+    skipped for LLM_COOLDOWN_SECONDS; the next call after that probes it again.
+    """
+
+    ALPHA = 0.3  # weight of the newest sample in the latency average
+
+    def __init__(self):
+        self.latency_ms: Optional[float] = None
+        self.failures = 0
+        self.skip_until = 0.0
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.skip_until
+
+    def success(self, seconds: float):
+        ms = seconds * 1000.0
+        with self._lock:
+            self.failures = 0
+            # a probe after a cooldown starts a fresh average instead of inheriting the slow one
+            if self.latency_ms is None or self.skip_until:
+                self.latency_ms = ms
+            else:
+                self.latency_ms = self.ALPHA * ms + (1 - self.ALPHA) * self.latency_ms
+            slow = settings.LLM_SLOW_THRESHOLD_MS and self.latency_ms > settings.LLM_SLOW_THRESHOLD_MS
+            self.skip_until = time.monotonic() + settings.LLM_COOLDOWN_SECONDS if slow else 0.0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= settings.LLM_FAILURE_THRESHOLD:
+                self.skip_until = time.monotonic() + settings.LLM_COOLDOWN_SECONDS
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'available': self.available(),
+            'latency_ms': round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            'failures': self.failures,
+        }
+
+class Provider:
+    """
+    A chat/vision backend behind the OpenAI client. Gemini is reached through its
+    OpenAI-compatible endpoint, so every provider shares the same request shape.
+    """
+
+    def __init__(self, name: str, chat_model: str, vision_model: str, small_model: Optional[str] = None,
+                 api_key: Optional[str] = None, base_url: Optional[str] = None):
+        self.name = name
+        self.chat_model = chat_model
+        self.vision_model = vision_model
+        self.small_model = small_model or chat_model
+        self.api_key = api_key
+        self.base_url = base_url
+        self.health = ProviderHealth()
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                          timeout=settings.LLM_REQUEST_TIMEOUT, max_retries=settings.LLM_MAX_RETRIES)
+        return self._client
+
+    def configured(self) -> bool:
+        return self._client is not None or bool(self.api_key)
+
+    def model_for(self, endpoint: str = 'chat', tier: str = 'large') -> str:
+        """Model for a request: the vision model, or the small / full-size chat model picked by the router."""
+        if endpoint == 'vision':
+            return self.vision_model
+        return self.small_model if tier == 'small' else self.chat_model
+
+    def chat(self, messages: List[dict], endpoint: str = 'chat', model: Optional[str] = None, tier: str = 'large', **kwargs) -> str:
+        model = model or self.model_for(endpoint, tier)
+        with openai_call(endpoint, model) as call:
+            resp = self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+            call.usage = getattr(resp, 'usage', None)
+        return (resp.choices[0].message.content or '').strip()
+
+    def stream(self, messages: List[dict], model: Optional[str] = None, tier: str = 'large', **kwargs) -> Iterator[str]:
+        """Yield the answer as it is generated; usage is counted from the final chunk."""
+        model = model or self.model_for('chat', tier)
+        with openai_call('chat', model) as call:
+            chunks = self.client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                         stream_options={'include_usage': True}, **kwargs)
+            for chunk in chunks:
+                if getattr(chunk, 'usage', None) is not None:
+                    call.usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+_providers: Dict[str, Provider] = {}
+_providers_lock = threading.Lock()
+
+def _build_provider(name: str) -> Provider:
+    if name == 'gemini':
+        return Provider('gemini', settings.GEMINI_LLM_MODEL, settings.GEMINI_VISION_MODEL, settings.GEMINI_SMALL_LLM_MODEL,
+                        api_key=settings.GEMINI_API_KEY or None, base_url=settings.GEMINI_BASE_URL)
+    if name == 'openai':
+        return Provider('openai', os.getenv('OPENAI_LLM_MODEL', settings.OPENAI_LLM_MODEL),
+                        os.getenv('OPENAI_VISION_MODEL', settings.OPENAI_VISION_MODEL), settings.OPENAI_SMALL_LLM_MODEL,
+                        api_key=os.getenv('OPENAI_API_KEY') or None)
+    raise ValueError(f"Unknown LLM provider: {name}")
+
+def get_provider(name: str = 'openai') -> Provider:
+    provider = _providers.get(name)
+    if provider is None:
+        with _providers_lock:
+            provider = _providers.get(name) or _providers.setdefault(name, _build_provider(name))
+    return provider
 
 def get_client() -> OpenAI:
-    global _client_singleton
-    if _client_singleton is None:
-        _client_singleton = OpenAI()
-    return _client_singleton
+    """OpenAI client, used directly for embeddings (they are not provider-routed: the index is OpenAI vectors)."""
+    return get_provider('openai').client
 
-def vision_extract(image_path: str) -> Dict[str, str]:
+def provider_order(preferred: Optional[str] = None) -> List[Provider]:
+    """
+    Providers to try, in order: the preferred one, then the others in LLM_PROVIDERS.
+    Providers without credentials are left out, and ones that are cooling down go last.
+    """
+    preferred = preferred or settings.LLM_DEFAULT_PROVIDER
+    names = [preferred]
+    if settings.LLM_FALLBACK_ENABLED:
+        names += [n for n in settings.LLM_PROVIDERS if n != preferred]
+    providers = [get_provider(n) for n in names]
+    providers = [p for p in providers if p.configured()] or providers[:1]
+    return sorted(providers, key=lambda p: not p.health.available())  # stable: keeps preference order
+
+class Completion(NamedTuple):
+    text: str
+    provider: str
+    model: str
+    seconds: float
+
+def run_completion(messages: List[dict], provider: Optional[str] = None, endpoint: str = 'chat', **kwargs) -> Completion:
+    """Run a chat (or vision) completion on the preferred provider, failing over to the next one on errors."""
+    last_error = None
+    for p in provider_order(provider):
+        t0 = time.perf_counter()
+        try:
+            text = p.chat(messages, endpoint=endpoint, **kwargs)
+        except Exception as e:
+            p.health.failure()
+            last_error = e
+            print(f'[LLM] {p.name} {endpoint} failed: {e}', file=sys.stderr)
+            continue
+        seconds = time.perf_counter() - t0
+        p.health.success(seconds)
+        model = kwargs.get('model') or p.model_for(endpoint, kwargs.get('tier', 'large'))
+        return Completion(text, p.name, model, seconds)
+    raise last_error
+
+def complete(messages: List[dict], provider: Optional[str] = None, endpoint: str = 'chat', **kwargs) -> str:
+    """run_completion() returning just the text."""
+    return run_completion(messages, provider=provider, endpoint=endpoint, **kwargs).text
+
+def stream_complete(messages: List[dict], provider: Optional[str] = None, **kwargs) -> Iterator[str]:
+    """Streaming complete(); fails over only until the first token has been sent."""
+    last_error = None
+    for p in provider_order(provider):
+        t0 = time.perf_counter()
+        started = False
+        try:
+            for piece in p.stream(messages, **kwargs):
+                started = True
+                yield piece
+        except Exception as e:
+            p.health.failure()
+            if started:
+                raise
+            last_error = e
+            print(f'[LLM] {p.name} stream failed: {e}', file=sys.stderr)
+            continue
+        p.health.success(time.perf_counter() - t0)
+        return
+    raise last_error
+
+def embed_texts(texts: List[str], batch_size: int = 100, model: Optional[str] = None,
+                dimensions: Optional[int] = None) -> List[List[float]]:
+    """Embed texts with `model` (default OPENAI_EMBEDDING_MODEL), batching requests."""
     client = get_client()
+    model = model or os.getenv('OPENAI_EMBEDDING_MODEL', settings.OPENAI_EMBEDDING_MODEL)
+    dimensions = settings.OPENAI_EMBEDDING_DIMENSIONS if dimensions is None else dimensions
+    kwargs = {}
+    if dimensions:
+        kwargs['dimensions'] = dimensions
+    out: List[List[float]] = []
+    for start in range(0, len(texts), batch_size):
+        with openai_call('embeddings', model) as call:
+            resp = client.embeddings.create(model=model, input=texts[start:start + batch_size], **kwargs)
+            call.usage = getattr(resp, 'usage', None)
+        out.extend(d.embedding for d in sorted(resp.data, key=lambda d: d.index))
+    return out
 
+def vision_extract(image_path: str, provider: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Page image -> {'extracted_text', 'description', 'model', 'seconds'}. Never raises: on
+    failure text and description are empty and model is ''.
+    """
     # Load and resize
     try:
         img = Image.open(image_path).convert('RGB')
@@ -28,7 +226,7 @@ def vision_extract(image_path: str) -> Dict[str, str]:
         b64 = base64.b64encode(buf.getvalue()).decode('utf-8')
     except Exception as e:
         print(f'[Vision] Failed to open {image_path}: {e}', file=sys.stderr)
-        return {'extracted_text': '', 'description': ''}
+        return {'extracted_text': '', 'description': '', 'model': '', 'seconds': 0.0}
 
     prompt = (
         "Return STRICT JSON with keys exactly 'extracted_text' and 'description'. "
@@ -38,18 +236,18 @@ def vision_extract(image_path: str) -> Dict[str, str]:
     )
 
     try:
-        resp = client.chat.completions.create(
-            model=os.getenv('OPENAI_VISION_MODEL', settings.OPENAI_VISION_MODEL),
-            messages=[
+        result = run_completion(
+            [
                 {'role':'system','content':'You convert document page images to text + a short description.'},
                 {'role':'user','content':[
                     {'type':'text','text': prompt},
                     {'type':'image_url','image_url': {'url': f'data:image/png;base64,{b64}'}},
                 ]},
             ],
-            
+            provider=provider or settings.LLM_VISION_PROVIDER,
+            endpoint='vision',
         )
-        content = (resp.choices[0].message.content or '').strip().strip('`')
+        content = result.text.strip('`')
         if content.lower().startswith('json'):
             content = content[4:].lstrip(': \n')
         try:
@@ -59,71 +257,50 @@ def vision_extract(image_path: str) -> Dict[str, str]:
         return {
             'extracted_text': (data.get('extracted_text') or '').strip(),
             'description': (data.get('description') or '').strip(),
+            'model': result.model,
+            'seconds': result.seconds,
         }
     except Exception as e:
-        print(f'[Vision] OpenAI call failed for {image_path}: {e}', file=sys.stderr)
-        return {'extracted_text': '', 'description': ''}
+        print(f'[Vision] call failed for {image_path}: {e}', file=sys.stderr)
+        return {'extracted_text': '', 'description': '', 'model': '', 'seconds': 0.0}
 
-def synthesize_answer(question: str, hits: List[dict], conversation_history: List[dict] = None) -> str:
-    client = get_client()
-    
-    # Build conversation context from history
-    conversation_messages = []
-    if conversation_history:
-        # Add conversation history (limit to last 10 messages to avoid token limits)
-        for msg in conversation_history[-10:]:
-            conversation_messages.append({
-                'role': msg['role'],
-                'content': msg['content']
-            })
-    
-    # Check if this is a generic conversation (no hits provided)
-    if not hits:
-        # For generic conversations, use a more conversational system prompt
-        system_content = (
-            "You are a helpful AI assistant. Respond naturally to greetings, gratitude, and casual conversation. "
-            "Be warm, friendly, and acknowledge the user appropriately. Keep responses concise but engaging. "
-            "Maintain context from the conversation history and refer to previous messages when relevant. "
-            "If the user asks follow-up questions or refers to previous topics, use the conversation history to provide contextual responses."
-        )
-        
-        system_message = {
-            'role': 'system',
-            'content': system_content
-        }
-        
-        messages = [system_message] + conversation_messages + [{'role': 'user', 'content': question}]
-    else:
-        # For document-related queries, use RAG context
-        ctx = []
-        for i, h in enumerate(hits, 1):
-            body = h.get('text') or ''
-            meta = f"page={h.get('page','?')} source={h.get('source','')}"
-            ctx.append(f"[{i}] {meta}\n{body}")
-        context = "\n\n".join(ctx) if ctx else "(no context)"
-        
-        system_content = (
-            "Answer the user using the provided context and conversation history. If unsure, say you do not know. "
-            "If the user just greet so greet them as well and say that i am a chatbot and i am here to help them. "
-            "and if user showing his gratitude so you need to be very humble to them you should act as a proper assistant who will think and help them as a human. "
-            "If the user ask very generic questions so you should sounds like that you acknowledge them and say that you are here to help them and you will think and help them as a human and understand the context of the chat properly and answer according to it. "
-            "For Greetings and simple conversation and gratitude you shouldnt have to return me the sources from the chromadb context. "
-            "Maintain conversation context and refer to previous messages when relevant. "
-            "If the user asks follow-up questions about previously discussed topics, use both the conversation history and the provided context to give comprehensive answers."
-        )
-        
-        system_message = {
-            'role': 'system',
-            'content': system_content
-        }
-        
-        # Combine conversation history with current question and context
-        current_question = f"Question:\n{question}\n\nContext:\n{context}\n\nAnswer succinctly."
-        
-        messages = [system_message] + conversation_messages + [{'role': 'user', 'content': current_question}]
-    
-    resp = client.chat.completions.create(
-        model=os.getenv('OPENAI_LLM_MODEL', settings.OPENAI_LLM_MODEL),
-        messages=messages,
-    )
-    return resp.choices[0].message.content.strip()
+def build_answer_messages(question: str, hits: List[dict], conversation_history: List[dict] = None,
+                          pinned: Optional[str] = None) -> List[dict]:
+    """
+    Chat messages for an answer, ordered for prompt caching (see rag_app/prompts.py). Hits are
+    merged, de-duplicated and trimmed to CONTEXT_TOKEN_BUDGET first (rag_app/packing.py).
+    """
+    if hits and settings.CONTEXT_PACKING_ENABLED:
+        hits = pack_context(question, hits)
+    return prompts.assemble(question, hits, conversation_history, pinned=pinned)
+
+def synthesize_answer(question: str, hits: List[dict], conversation_history: List[dict] = None, provider: Optional[str] = None,
+                      tier: str = 'large') -> str:
+    """
+    Answer with the given provider ('openai' / 'gemini', usually the user's preferred_llm), with failover.
+    tier 'small' uses the provider's small model (see routing.choose_route).
+    """
+    return complete(build_answer_messages(question, hits, conversation_history), provider=provider, tier=tier)
+
+def stream_answer(question: str, hits: List[dict], conversation_history: List[dict] = None, provider: Optional[str] = None,
+                  tier: str = 'large') -> Iterator[str]:
+    """synthesize_answer() as a stream of text pieces."""
+    return stream_complete(build_answer_messages(question, hits, conversation_history), provider=provider, tier=tier)
+
+def rewrite_query(question: str, conversation_history: List[dict], provider: Optional[str] = None) -> str:
+    """
+    Turn a follow-up ("and what about the second one?") into a standalone search query
+    using the small model. Falls back to the original question on any error.
+    """
+    turns = '\n'.join(f"{m['role']}: {m['content'][:500]}" for m in conversation_history[-4:])
+    messages = [
+        {'role': 'system', 'content': 'Rewrite the last user question as one standalone search query for a document index. '
+                                      'Resolve pronouns and references from the conversation. Return only the query.'},
+        {'role': 'user', 'content': f"Conversation:\n{turns}\n\nQuestion: {question}"},
+    ]
+    try:
+        rewritten = complete(messages, provider=provider, endpoint='rewrite', tier='small').strip().strip('"')
+    except Exception as e:
+        print(f'[LLM] query rewrite failed: {e}', file=sys.stderr)
+        return question
+    return rewritten or question
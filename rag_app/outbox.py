@@ -0,0 +1,164 @@
+"""
+Email outbox: requests enqueue an OutboundEmail row and return immediately; the
+send_queued_email worker claims due rows in batches and sends them over one SMTP
+connection that stays open between batches. Failed sends are retried with
+exponential backoff up to EMAIL_MAX_ATTEMPTS.
+"""
+import smtplib
+import uuid
+from itertools import islice
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import F, Q
+from django.utils import timezone
+from .email_render import render_many
+from .models import OutboundEmail
+
+def enqueue_email(to_email: str, subject: str, text_body: str, html_body: str = '', from_email: str | None = None) -> OutboundEmail:
+    """Queue an email for the worker; no network I/O happens here."""
+    return OutboundEmail.objects.create(
+        to_email=to_email,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        subject=subject,
+        text_body=text_body,
+        html_body=html_body,
+    )
+
+def enqueue_many(kind: str, recipients, from_email: str | None = None, batch_size: int = 500) -> int:
+    """
+    Render and queue one email per (to_email, context) pair, e.g. for a re-verification
+    campaign. Templates are compiled once and rows are inserted with bulk_create.
+    """
+    recipients = iter(recipients)
+    from_email = from_email or settings.DEFAULT_FROM_EMAIL
+    queued = 0
+    while True:
+        chunk = list(islice(recipients, batch_size))
+        if not chunk:
+            return queued
+        rendered = render_many(kind, (ctx for _, ctx in chunk))
+        OutboundEmail.objects.bulk_create([
+            OutboundEmail(
+                to_email=to_email,
+                from_email=from_email,
+                subject=email.subject,
+                text_body=email.text_body,
+                html_body=email.html_body,
+            )
+            for (to_email, _), email in zip(chunk, rendered)
+        ])
+        queued += len(chunk)
+
+def retry_delay(attempts: int) -> timedelta:
+    """Backoff after the n-th failed attempt: base * 2^(n-1), capped."""
+    seconds = settings.EMAIL_RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(seconds, settings.EMAIL_RETRY_MAX_DELAY))
+
+def claim_batch(batch_size: int | None = None) -> list[OutboundEmail]:
+    """
+    Atomically claim up to batch_size due emails. The conditional UPDATE makes the
+    claim safe with several workers; rows stuck in 'sending' (worker died) are
+    reclaimed after EMAIL_CLAIM_TIMEOUT seconds.
+    """
+    batch_size = batch_size or settings.EMAIL_QUEUE_BATCH_SIZE
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.EMAIL_CLAIM_TIMEOUT)
+    claimable = (
+        Q(status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=now)
+        | Q(status=OutboundEmail.STATUS_SENDING, locked_at__lt=stale)
+    )
+    ids = list(OutboundEmail.objects.filter(claimable).order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    OutboundEmail.objects.filter(claimable, id__in=ids).update(
+        status=OutboundEmail.STATUS_SENDING, claim=token, locked_at=now
+    )
+    return list(OutboundEmail.objects.filter(claim=token, status=OutboundEmail.STATUS_SENDING).order_by('id'))
+
+def to_message(email: OutboundEmail, connection) -> EmailMultiAlternatives:
+    msg = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.text_body,
+        from_email=email.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=[email.to_email],
+        connection=connection,
+    )
+    if email.html_body:
+        msg.attach_alternative(email.html_body, 'text/html')
+    return msg
+
+def mark_failed(email: OutboundEmail, error: Exception):
+    email.attempts += 1
+    email.last_error = f"{type(error).__name__}: {error}"[:2000]
+    email.locked_at = None
+    if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+        email.status = OutboundEmail.STATUS_FAILED
+    else:
+        email.status = OutboundEmail.STATUS_PENDING
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'locked_at', 'status', 'next_attempt_at'])
+
+def send_batch(emails: list[OutboundEmail], connection) -> tuple[int, int]:
+    """Send claimed emails over an already-open connection. Returns (sent, failed)."""
+    sent_ids, failed = [], 0
+    for email in emails:
+        try:
+            to_message(email, connection).send()
+            sent_ids.append(email.id)
+        except smtplib.SMTPServerDisconnected:
+            # the server dropped an idle connection: reconnect once and retry this message
+            connection.close()
+            try:
+                connection.open()
+                to_message(email, connection).send()
+                sent_ids.append(email.id)
+            except Exception as e:
+                mark_failed(email, e)
+                failed += 1
+        except Exception as e:
+            mark_failed(email, e)
+            failed += 1
+    if sent_ids:
+        OutboundEmail.objects.filter(id__in=sent_ids).update(
+            status=OutboundEmail.STATUS_SENT,
+            sent_at=timezone.now(),
+            attempts=F('attempts') + 1,
+            last_error='',
+            locked_at=None,
+        )
+    return len(sent_ids), failed
+
+def release(emails: list[OutboundEmail], error: Exception):
+    """Put claimed emails back after a connection-level failure (counts as an attempt)."""
+    for email in emails:
+        mark_failed(email, error)
+
+def deliver_pending(batch_size: int | None = None, connection=None, max_batches: int | None = None) -> dict:
+    """
+    Drain the outbox: claim and send batches until nothing is due. A caller-supplied
+    connection is left open so a long-running worker can reuse it across calls.
+    """
+    own = connection is None
+    connection = connection or get_connection(fail_silently=False)
+    totals = {'sent': 0, 'failed': 0, 'batches': 0}
+    try:
+        while max_batches is None or totals['batches'] < max_batches:
+            emails = claim_batch(batch_size)
+            if not emails:
+                break
+            try:
+                connection.open()
+            except Exception as e:
+                release(emails, e)
+                totals['failed'] += len(emails)
+                break
+            sent, failed = send_batch(emails, connection)
+            totals['sent'] += sent
+            totals['failed'] += failed
+            totals['batches'] += 1
+    finally:
+        if own:
+            connection.close()
+    return totals
@@ -0,0 +1,128 @@
+"""
+Context packing: shrink retrieved hits before they go into the answer prompt.
+
+1. Adjacent chunks of the same page are merged, dropping the overlap that
+   split_for_embedding repeats at every chunk boundary.
+2. Near-duplicates (repeated boilerplate, identical pages of different uploads) are
+   removed with a 64-bit SimHash over word trigrams; the better ranked copy is kept.
+3. If the result is still over CONTEXT_TOKEN_BUDGET, each hit is cut down to the
+   sentences that share the most words with the question, best ranked hits first.
+"""
+import hashlib
+import re
+import numpy as np
+from django.conf import settings
+from .metrics import timed
+from .prompts import approx_tokens
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'did', 'do', 'does', 'for', 'from', 'has', 'have', 'how',
+    'i', 'in', 'is', 'it', 'its', 'me', 'my', 'of', 'on', 'or', 'our', 'say', 'says', 'tell', 'that', 'the', 'their',
+    'there', 'this', 'to', 'was', 'we', 'what', 'when', 'where', 'which', 'who', 'why', 'with', 'you', 'your',
+}
+MAX_OVERLAP = 1000  # longest chunk-boundary overlap looked for when merging
+
+# --- merging ----------------------------------------------------------------------
+
+def _join(a: str, b: str) -> str:
+    """a + b without the text b repeats from the end of a."""
+    limit = min(len(a), len(b), MAX_OVERLAP)
+    for n in range(limit, 0, -1):
+        if a.endswith(b[:n]):
+            return a + b[n:]
+    return a + '\n' + b
+
+def merge_adjacent(hits: list[dict]) -> list[dict]:
+    """Merge hits of the same document page with consecutive chunk numbers; keeps rank order of the first piece."""
+    groups, order = {}, []
+    for rank, h in enumerate(hits):
+        key = (h.get('document_id'), h.get('page'))
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append((int(h.get('chunk', 0)), rank, h))
+
+    merged = []
+    for key in order:
+        run = None
+        for chunk, rank, h in sorted(groups[key], key=lambda x: x[0]):
+            if run is not None and chunk == run['last'] + 1:
+                run['hit']['text'] = _join(run['hit']['text'], h.get('text') or '')
+                run['hit']['score'] = max(run['hit'].get('score') or 0.0, h.get('score') or 0.0)
+                run['rank'] = min(run['rank'], rank)
+                run['last'] = chunk
+                continue
+            if run is not None:
+                merged.append((run['rank'], run['hit']))
+            run = {'hit': dict(h, text=h.get('text') or ''), 'rank': rank, 'last': chunk}
+        merged.append((run['rank'], run['hit']))
+    return [h for _, h in sorted(merged, key=lambda x: x[0])]
+
+# --- near-duplicate removal ----------------------------------------------------------
+
+def simhash(text: str) -> int:
+    """64-bit SimHash of the word trigrams of a text."""
+    words = WORD_RE.findall(text.lower())
+    shingles = [' '.join(words[i:i + 3]) for i in range(max(1, len(words) - 2))]
+    digests = b''.join(hashlib.blake2b(s.encode(), digest_size=8).digest() for s in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(shingles), 64)
+    weights = bits.sum(axis=0, dtype=np.int64) * 2 - len(shingles)  # +1 per set bit, -1 per clear bit
+    return int(''.join('1' if w > 0 else '0' for w in weights), 2)
+
+def dedupe(hits: list[dict], max_distance: int | None = None) -> list[dict]:
+    """Drop hits whose SimHash is within max_distance bits of a better ranked hit."""
+    max_distance = settings.CONTEXT_SIMHASH_DISTANCE if max_distance is None else max_distance
+    kept, signatures = [], []
+    for h in hits:
+        sig = simhash(h.get('text') or '')
+        if any(bin(sig ^ other).count('1') <= max_distance for other in signatures):
+            continue
+        kept.append(h)
+        signatures.append(sig)
+    return kept
+
+# --- sentence trimming -------------------------------------------------------------
+
+def query_terms(question: str) -> set[str]:
+    return {w for w in WORD_RE.findall(question.lower()) if w not in STOPWORDS and len(w) > 1}
+
+def trim_to_query(text: str, terms: set[str], max_tokens: int) -> str:
+    """The sentences of text sharing most words with the query, in their original order, within max_tokens."""
+    sentences = [s.strip() for s in SENTENCE_RE.split(text) if s.strip()]
+    scored = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(terms & set(WORD_RE.findall(sentences[i].lower()))), i),
+    )
+    picked, used = [], 0
+    for i in scored:
+        cost = approx_tokens(sentences[i]) + 1
+        if used + cost > max_tokens:
+            continue
+        picked.append(i)
+        used += cost
+    return ' … '.join(sentences[i] for i in sorted(picked))
+
+@timed('pack')
+def pack_context(question: str, hits: list[dict], budget: int | None = None) -> list[dict]:
+    """Merged, de-duplicated and (if needed) trimmed copies of hits, best first, within `budget` tokens."""
+    if not hits:
+        return []
+    budget = settings.CONTEXT_TOKEN_BUDGET if budget is None else budget
+    packed = dedupe(merge_adjacent(hits))
+    if budget <= 0 or sum(approx_tokens(h['text']) for h in packed) <= budget:
+        return packed
+
+    terms = query_terms(question)
+    out, remaining = [], budget
+    for i, h in enumerate(packed):
+        share = remaining // (len(packed) - i)  # unused budget of earlier hits carries over
+        if share < settings.CONTEXT_MIN_HIT_TOKENS:
+            break
+        text = h['text'] if approx_tokens(h['text']) <= share else trim_to_query(h['text'], terms, share)
+        if not text:
+            continue
+        out.append(dict(h, text=text))
+        remaining -= approx_tokens(text)
+    return out
@@ -0,0 +1,78 @@
+"""
+Prompt assembly laid out for provider-side prefix caching.
+
+OpenAI and Gemini reuse the work done for a prompt prefix they have seen recently
+(OpenAI from 1024 tokens on, in 128-token steps), so everything that stays the same
+from one turn to the next goes first and everything that changes goes last:
+
+1. one fixed system prompt, shared by chit-chat and document turns;
+2. pinned document context: the full text of the conversation's document(s), in
+   page order, when it fits in PROMPT_PINNED_CONTEXT_TOKENS;
+3. the conversation history, which only grows (get_conversation_context moves its
+   window in steps of PROMPT_HISTORY_STEP messages);
+4. the final user turn: this turn's retrieved passages, then the question.
+"""
+from django.conf import settings
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant that answers questions about the user's documents. "
+    "Answer from the provided document context and the conversation history; if they do not contain the answer, say you do not know. "
+    "Respond warmly and naturally to greetings, thanks and casual conversation, and do not cite sources for those. "
+    "Maintain conversation context and refer to previous messages when relevant: for follow-up questions about earlier topics, "
+    "use both the conversation history and the provided context. Keep answers concise."
+)
+
+def approx_tokens(text: str) -> int:
+    return len(text) // 4
+
+def format_passages(hits: list[dict]) -> str:
+    parts = []
+    for i, h in enumerate(hits, 1):
+        meta = f"page={h.get('page','?')} source={h.get('source','')}"
+        parts.append(f"[{i}] {meta}\n{h.get('text') or ''}")
+    return "\n\n".join(parts)
+
+def pinned_context(documents: list[tuple[str, list[dict]]]) -> str:
+    """Stable context block for (document name, chunks) pairs, chunks already in page order."""
+    blocks = []
+    for name, chunks in documents:
+        pages = []
+        for ch in chunks:
+            text = (ch.get('text') or '').strip()
+            if text:
+                pages.append(f"[page {ch.get('page', '?')}] {text}")
+        blocks.append(f"Document: {name}\n\n" + "\n\n".join(pages))
+    return "Pinned documents for this conversation:\n\n" + "\n\n---\n\n".join(blocks)
+
+def pinned_document_context(store, user_id: int, documents) -> str | None:
+    """
+    The pinned block for Document objects, or None when they are too large to send every turn
+    (retrieved passages are used instead).
+    """
+    budget = settings.PROMPT_PINNED_CONTEXT_TOKENS
+    if budget <= 0:
+        return None
+    loaded, used = [], 0
+    for doc in sorted(documents, key=lambda d: d.id):
+        chunks = store.document_chunks(user_id, doc.id)
+        used += sum(approx_tokens(ch.get('text') or '') for ch in chunks)
+        if used > budget:
+            return None
+        loaded.append((doc.original_name, chunks))
+    return pinned_context(loaded) if loaded else None
+
+def assemble(question: str, hits: list[dict] | None = None, history: list[dict] | None = None,
+             pinned: str | None = None) -> list[dict]:
+    """Chat messages in cache-friendly order: system, pinned context, history, then passages + question."""
+    messages = [{'role': 'system', 'content': SYSTEM_PROMPT}]
+    if pinned:
+        messages.append({'role': 'system', 'content': pinned})
+    messages += [{'role': m['role'], 'content': m['content']} for m in history or ()]
+    if hits:
+        content = f"Context:\n{format_passages(hits)}\n\nQuestion:\n{question}\n\nAnswer succinctly."
+    elif pinned:
+        content = f"Question:\n{question}\n\nAnswer succinctly from the pinned documents."
+    else:
+        content = question
+    messages.append({'role': 'user', 'content': content})
+    return messages
@@ -0,0 +1,272 @@
+"""
+Decide whether a chat message is chit-chat (answer without retrieval) or a document
+question (run RAG retrieval).
+
+Patterns are compiled once into a single word-boundary regex, so "hi" no longer
+matches inside "this" and "ok" no longer matches inside "book". A message is only
+treated as chit-chat when the chit-chat phrases make up the message; anything left
+over that looks like a question or a request routes to retrieval. Low-confidence
+rule decisions can optionally be handed to a small naive Bayes model trained on the
+labeled set in data/intent_labels.jsonl (INTENT_CLASSIFIER='nb').
+
+choose_route() then picks how a turn is answered: a canned reply (pure greetings,
+thanks, farewells), the provider's small model (other chit-chat, low-context or
+short confident lookups) or the full-size model (retrieval-heavy questions).
+"""
+import json
+import logging
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from django.conf import settings
+from .metrics import LLM_ROUTES, enabled as metrics_enabled
+
+logger = logging.getLogger(__name__)
+
+LABELS_PATH = Path(__file__).resolve().parent / 'data' / 'intent_labels.jsonl'
+
+GREETINGS = [
+    'hello', 'hi', 'hey', 'hiya', 'howdy', 'good morning', 'good afternoon', 'good evening',
+    'how are you', 'how do you do', 'nice to meet you', 'pleasure to meet you',
+    'greetings', 'good day',
+]
+GRATITUDE = [
+    'thank you', 'thanks', 'thank you so much', 'thanks a lot', 'thx', 'ty', 'appreciate it',
+    'i appreciate it', 'grateful', 'bless you', "you're the best", 'awesome', 'great job',
+    'excellent', 'fantastic', 'wonderful', 'amazing', 'perfect', 'cool', 'nice', 'great', 'cheers',
+]
+FAREWELLS = [
+    'goodbye', 'bye', 'bye bye', 'see you', 'see you later', 'take care', 'have a good day',
+    'good night', 'goodbye for now', 'talk to you later', 'farewell',
+    'until next time', 'see you soon', 'cya',
+]
+CASUAL = [
+    "how's it going", "what's up", 'sup', 'how are things', 'everything ok',
+    'are you ok', 'are you there', 'can you hear me', 'are you working',
+    'how are you doing', "what's new", "how's everything", "how's life",
+]
+ACKNOWLEDGMENTS = [
+    'ok', 'okay', 'alright', 'sure', 'yes', 'yeah', 'yep', 'no', 'nope', 'maybe', 'fine',
+    'got it', 'understood', 'i see', 'i understand', 'noted', 'roger', 'makes sense',
+]
+ASSISTANT_DIRECTED = [
+    'who are you', 'what are you', 'what can you do', 'what do you do', 'are you a bot',
+    'are you human', 'are you real', "what's your name", 'what is your name',
+    'tell me about yourself',
+]
+
+# Words that may surround a chit-chat phrase without turning it into a question
+FILLER = {
+    'so', 'much', 'very', 'a', 'lot', 'there', 'again', 'for', 'the', 'help', 'and', 'too',
+    'all', 'it', 'that', 'this', 'is', 'was', 'really', 'oh', 'well', 'then', 'now', 'bot',
+    'assistant', 'friend', 'buddy', 'mate', 'everyone', 'guys', 'me', 'i', 'am', 'you', 'your',
+    'have', 'day', 'just', 'wanted', 'to', 'say', 'once', 'more', 'of', 'be', 'an', 'my',
+    "that's", "it's", 'today', 'tonight',
+}
+QUESTION_WORDS = {
+    'what', 'which', 'who', 'whom', 'whose', 'when', 'where', 'why', 'how',
+    'is', 'are', 'does', 'do', 'did', 'can', 'could', 'should', 'would', 'will',
+}
+REQUEST_VERBS = {
+    'explain', 'summarize', 'summarise', 'describe', 'list', 'define', 'compare', 'find',
+    'show', 'give', 'tell', 'extract', 'calculate', 'translate', 'outline', 'quote',
+}
+ASSISTANT_PRONOUNS = {'you', 'your', 'yourself'}
+
+def _compile(patterns: list[str]) -> re.Pattern:
+    # longest first so "thank you so much" wins over "thank you"
+    alts = sorted(set(patterns), key=len, reverse=True)
+    body = '|'.join(re.escape(p).replace(r'\ ', r'\s+') for p in alts)
+    return re.compile(rf"(?<!\w)(?:{body})(?!\w)")
+
+CHITCHAT_RE = _compile(GREETINGS + GRATITUDE + FAREWELLS + CASUAL + ACKNOWLEDGMENTS + ASSISTANT_DIRECTED)
+CATEGORY_RES = {
+    'greeting': _compile(GREETINGS),
+    'gratitude': _compile(GRATITUDE),
+    'farewell': _compile(FAREWELLS),
+    'casual': _compile(CASUAL),
+    'acknowledgment': _compile(ACKNOWLEDGMENTS),
+    'assistant': _compile(ASSISTANT_DIRECTED),
+}
+WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+@dataclass(frozen=True)
+class Intent:
+    label: str  # 'chitchat' or 'document'
+    confidence: float
+    reason: str
+
+    @property
+    def is_chitchat(self) -> bool:
+        return self.label == 'chitchat'
+
+def _normalize(text: str) -> str:
+    return (text or '').lower().replace('’', "'").strip()
+
+def rule_intent(text: str) -> Intent:
+    """Classify with the compiled patterns and a few structural signals."""
+    norm = _normalize(text)
+    words = WORD_RE.findall(norm)
+    if not words:
+        return Intent('chitchat', 1.0, 'empty')
+
+    matched = CHITCHAT_RE.search(norm) is not None
+    residue = WORD_RE.findall(CHITCHAT_RE.sub(' ', norm)) if matched else words
+    rest = [w for w in residue if w not in FILLER]
+    # over the whole message: a matched phrase ("what do you do") may hold the question word
+    asks = '?' in norm or bool(set(words) & (QUESTION_WORDS | REQUEST_VERBS))
+    content = [w for w in words if w not in FILLER | QUESTION_WORDS | REQUEST_VERBS | ASSISTANT_PRONOUNS]
+
+    if matched and not rest:
+        return Intent('chitchat', 0.95, 'only chit-chat phrases')
+    if matched and asks:
+        return Intent('document', 0.85, 'chit-chat followed by a question')
+    if matched:
+        # e.g. "ok the pricing table", "fine print of the lease": chit-chat words around content words
+        return Intent('document', 0.8, 'content words beside chit-chat')
+
+    if (set(words) & ASSISTANT_PRONOUNS and len(words) <= 5 and not set(words) & REQUEST_VERBS
+            and not any(w.isdigit() for w in words) and not (asks and content)):
+        return Intent('chitchat', 0.6, 'short remark to the assistant')
+    if asks:
+        return Intent('document', 0.95, 'question or request')
+    return Intent('document', 0.8, 'keyword query')
+
+class NaiveBayesIntent:
+    """Multinomial naive Bayes over word unigrams and bigrams, with Laplace smoothing."""
+
+    def __init__(self, examples: list[dict]):
+        self.counts = {'chitchat': Counter(), 'document': Counter()}
+        docs = Counter()
+        for ex in examples:
+            docs[ex['label']] += 1
+            self.counts[ex['label']].update(self.features(ex['text']))
+        total = sum(docs.values()) or 1
+        self.priors = {label: math.log((docs[label] + 1) / (total + 2)) for label in self.counts}
+        self.vocab = set(self.counts['chitchat']) | set(self.counts['document'])
+        self.totals = {label: sum(c.values()) for label, c in self.counts.items()}
+
+    @staticmethod
+    def features(text: str) -> list[str]:
+        words = WORD_RE.findall(_normalize(text))
+        feats = list(words)
+        feats += [f"{a}_{b}" for a, b in zip(words, words[1:])]
+        if '?' in (text or ''):
+            feats.append('<q>')
+        return feats
+
+    def prob_chitchat(self, text: str) -> float:
+        v = len(self.vocab) or 1
+        scores = {}
+        for label, counts in self.counts.items():
+            s = self.priors[label]
+            for f in self.features(text):
+                s += math.log((counts[f] + 1) / (self.totals[label] + v))
+            scores[label] = s
+        top = max(scores.values())
+        exp = {label: math.exp(s - top) for label, s in scores.items()}
+        return exp['chitchat'] / sum(exp.values())
+
+def load_labeled_examples(path: Path | None = None) -> list[dict]:
+    with open(path or LABELS_PATH, encoding='utf-8') as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+@lru_cache(maxsize=1)
+def _default_model() -> NaiveBayesIntent:
+    return NaiveBayesIntent(load_labeled_examples())
+
+def classify_intent(text: str, mode: str | None = None, model: NaiveBayesIntent | None = None) -> Intent:
+    """
+    Route a message. mode 'rules' uses the patterns only; 'nb' lets the naive Bayes
+    model decide whenever the rules are below INTENT_RULE_CONFIDENCE.
+    """
+    intent = rule_intent(text)
+    mode = mode or settings.INTENT_CLASSIFIER
+    if mode == 'nb' and intent.confidence < settings.INTENT_RULE_CONFIDENCE:
+        p = (model or _default_model()).prob_chitchat(text)
+        label = 'chitchat' if p >= 0.5 else 'document'
+        return Intent(label, round(max(p, 1 - p), 3), 'classifier')
+    return intent
+
+# --- model choice -----------------------------------------------------------------
+
+CANNED_REPLIES = {
+    'greeting': "Hello{name}! I'm your document assistant. Ask me anything about the files you've uploaded.",
+    'gratitude': "You're welcome{name}! Let me know if there's anything else you'd like to know about your documents.",
+    'farewell': "Goodbye{name}! Come back any time you have questions about your documents.",
+    'casual': "I'm doing well, thanks for asking{name}! What would you like to know about your documents?",
+    'acknowledgment': "Great. Feel free to ask a follow-up question whenever you're ready.",
+    'assistant': "I'm a chatbot that answers questions using the documents you've uploaded. "
+                 "Ask me to find, summarize or explain anything in them.",
+}
+FOLLOW_UP_WORDS = {'it', 'its', 'that', 'this', 'those', 'these', 'they', 'them', 'their', 'he', 'she', 'one', 'ones',
+                   'former', 'latter', 'above', 'previous', 'same', 'else', 'also', 'more'}
+
+@dataclass(frozen=True)
+class Route:
+    tier: str  # 'canned', 'small' or 'large'
+    reason: str
+    reply: str | None = None  # the answer itself for canned routes
+    prompt_tokens: int = 0
+    top_score: float | None = None
+
+def chitchat_category(text: str) -> str | None:
+    """The single chit-chat category a message belongs to, or None when it mixes several."""
+    norm = _normalize(text)
+    found = {name for name, regex in CATEGORY_RES.items() if regex.search(norm)}
+    if len(found) == 2 and 'greeting' in found and 'casual' in found:
+        return 'casual'  # "hi, how are you"
+    return found.pop() if len(found) == 1 else None
+
+def estimate_tokens(messages: list[dict]) -> int:
+    """Rough prompt size (4 characters per token); good enough to compare against routing thresholds."""
+    return sum(len(m['content']) if isinstance(m.get('content'), str) else 0 for m in messages) // 4 + 4 * len(messages)
+
+def needs_rewrite(text: str, history: list[dict]) -> bool:
+    """A short follow-up leaning on earlier turns ("what about the second one?") that retrieval would miss."""
+    if not history:
+        return False
+    words = WORD_RE.findall(_normalize(text))
+    return len(words) <= 12 and bool(set(words) & FOLLOW_UP_WORDS)
+
+def choose_route(text: str, intent: Intent | None = None, hits: list[dict] | None = None,
+                 messages: list[dict] | None = None, name: str = '') -> Route:
+    """
+    Pick canned / small / large for one turn. `intent` comes from classify_intent() (None for
+    plain document questions), `hits` from retrieval and `messages` is the prompt that would be sent.
+    """
+    if not settings.LLM_ROUTING_ENABLED:
+        return _log(Route('large', 'routing disabled'))
+
+    tokens = estimate_tokens(messages) if messages else 0
+    if intent is not None and intent.is_chitchat:
+        category = chitchat_category(text)
+        if settings.LLM_CANNED_REPLIES and intent.reason == 'only chit-chat phrases' and category:
+            reply = CANNED_REPLIES[category].format(name=f", {name}" if name else '')
+            return _log(Route('canned', f"canned {category}", reply=reply))
+        return _log(Route('small', 'chit-chat', prompt_tokens=tokens))
+
+    top = max((h['score'] for h in hits or () if h.get('score') is not None), default=None)
+    if not hits or (top is not None and top < settings.LLM_ROUTE_MIN_SCORE):
+        return _log(Route('small', 'low retrieval context', prompt_tokens=tokens, top_score=top))
+    if tokens >= settings.LLM_ROUTE_LARGE_PROMPT_TOKENS:
+        return _log(Route('large', 'large prompt', prompt_tokens=tokens, top_score=top))
+    short = len(WORD_RE.findall(_normalize(text))) <= settings.LLM_ROUTE_SHORT_QUESTION_WORDS
+    if short and top is not None and top >= settings.LLM_ROUTE_CONFIDENT_SCORE:
+        return _log(Route('small', 'short confident lookup', prompt_tokens=tokens, top_score=top))
+    return _log(Route('large', 'retrieval question', prompt_tokens=tokens, top_score=top))
+
+def _log(route: Route) -> Route:
+    if metrics_enabled():
+        LLM_ROUTES.inc(1, route.tier, route.reason)
+    if settings.LLM_ROUTING_LOG:
+        # the decision only: user text stays out of the logs
+        logger.info(
+            'route tier=%s reason=%r tokens=%s score=%s',
+            route.tier, route.reason, route.prompt_tokens,
+            f"{route.top_score:.3f}" if route.top_score is not None else '-',
+        )
+    return route
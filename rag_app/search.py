@@ -0,0 +1,138 @@
+"""
+Full-text search over a user's conversation history.
+
+On SQLite the messages are indexed by an FTS5 table (rag_app_message_fts) that triggers
+keep in step with rag_app_message; on PostgreSQL by a GIN index on
+to_tsvector('english', content). Both come from migration 0018 and are maintained by the
+database on every insert, update and delete. Other backends fall back to a substring scan.
+
+Snippets are HTML-escaped with the matched words wrapped in <mark>.
+"""
+import html
+import re
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from .models import Message
+
+FTS_TABLE = 'rag_app_message_fts'
+PG_CONFIG = 'english'  # must match the index expression in migration 0018
+SNIPPET_WORDS = 24
+# placeholders for the highlight tags, swapped for <mark> after the snippet is escaped
+START, STOP = '\x02', '\x03'
+WORD_RE = re.compile(r'\w+')
+MAX_INT = 2 ** 63 - 1
+
+def backend() -> str:
+    return connection.vendor if connection.vendor in ('sqlite', 'postgresql') else 'scan'
+
+def fts5_query(text: str) -> str:
+    """User input as an FTS5 query: every word quoted (so nothing is read as an operator), the last one as a prefix."""
+    words = WORD_RE.findall(text)
+    if not words:
+        return ''
+    return ' '.join([f'"{w}"' for w in words[:-1]] + [f'"{words[-1]}"*'])
+
+def highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(START, '<mark>').replace(STOP, '</mark>')
+
+def _scan_snippet(content: str, text: str) -> str:
+    words = WORD_RE.findall(text)
+    pos = content.lower().find(words[0].lower()) if words else -1
+    if pos < 0:
+        return content[:200]
+    start = max(0, pos - 80)
+    end = pos + len(words[0])
+    piece = content[start:pos] + START + content[pos:end] + STOP + content[end:end + 120]
+    return ('…' if start else '') + piece + ('…' if end + 120 < len(content) else '')
+
+def _ranked_ids(user_id: int, text: str, filters: list, params: list, offset: int, limit: int) -> list[tuple]:
+    """(message id, raw snippet, score) for one page of matches, best first."""
+    extra = ''.join(f" AND {f}" for f in filters)
+    if backend() == 'sqlite':
+        query = fts5_query(text)
+        if not query:
+            return []
+        sql = (
+            f"SELECT m.id, snippet({FTS_TABLE}, 0, %s, %s, '…', %s), -bm25({FTS_TABLE}) "
+            f"FROM {FTS_TABLE} JOIN rag_app_message m ON m.id = {FTS_TABLE}.rowid "
+            f"JOIN rag_app_conversation c ON c.id = m.conversation_id "
+            f"WHERE {FTS_TABLE} MATCH %s AND c.owner_id = %s{extra} "
+            f"ORDER BY bm25({FTS_TABLE}) LIMIT %s OFFSET %s"
+        )
+        args = [START, STOP, SNIPPET_WORDS, query, user_id, *params, limit, offset]
+    else:
+        # rank and limit first, so ts_headline only runs over the returned page
+        options = f"StartSel={START}, StopSel={STOP}, MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}, MaxFragments=2"
+        sql = (
+            f"SELECT hits.id, ts_headline('{PG_CONFIG}', m.content, hits.q, %s), hits.score FROM ("
+            f"SELECT m.id, q, ts_rank(to_tsvector('{PG_CONFIG}', m.content), q) AS score "
+            f"FROM rag_app_message m JOIN rag_app_conversation c ON c.id = m.conversation_id, "
+            f"websearch_to_tsquery('{PG_CONFIG}', %s) q "
+            f"WHERE to_tsvector('{PG_CONFIG}', m.content) @@ q AND c.owner_id = %s{extra} "
+            f"ORDER BY score DESC, m.id DESC LIMIT %s OFFSET %s"
+            f") hits JOIN rag_app_message m ON m.id = hits.id ORDER BY hits.score DESC, hits.id DESC"
+        )
+        args = [options, text, user_id, *params, limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, args)
+        return cursor.fetchall()
+
+def search_messages(user_id: int, text: str, conversation_id: int | None = None, role: str | None = None,
+                    offset: int = 0, limit: int = 20) -> tuple[list[dict], bool]:
+    """
+    Messages in user_id's conversations that match `text`, best match first.
+    Returns one page of hits and whether more follow.
+    """
+    if backend() == 'scan':
+        qs = Message.objects.filter(conversation__owner_id=user_id, content__icontains=text).order_by('-created_at')
+        if conversation_id is not None:
+            qs = qs.filter(conversation_id=conversation_id)
+        if role:
+            qs = qs.filter(role=role)
+        rows = [(m.id, _scan_snippet(m.content, text), None) for m in qs[offset:offset + limit + 1]]
+    else:
+        filters, params = [], []
+        if conversation_id is not None:
+            filters.append('m.conversation_id = %s')
+            params.append(conversation_id)
+        if role:
+            filters.append('m.role = %s')
+            params.append(role)
+        # one extra row tells whether there is a next page without counting every match
+        rows = _ranked_ids(user_id, text, filters, params, offset, limit + 1)
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    messages = Message.objects.select_related('conversation').only(
+        'id', 'role', 'created_at', 'conversation__id', 'conversation__title'
+    ).in_bulk([r[0] for r in rows])
+    hits = []
+    for message_id, snippet, score in rows:
+        m = messages.get(message_id)
+        if m is None:
+            continue  # deleted since the index was read
+        hits.append({
+            'message_id': m.id,
+            'conversation_id': m.conversation_id,
+            'conversation_title': m.conversation.title,
+            'role': m.role,
+            'created_at': m.created_at,
+            'snippet': highlight(snippet or ''),
+            'score': round(score, 4) if score is not None else None,
+        })
+    return hits, more
+
+def message_filter(text: str) -> Q | None:
+    """Q matching messages whose content matches `text` through the full-text index, or None without one."""
+    if backend() == 'sqlite':
+        query = fts5_query(text)
+        if not query:
+            return Q(pk__in=[])
+        return Q(pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [query]))
+    if backend() == 'postgresql':
+        return Q(pk__in=RawSQL(
+            f"SELECT id FROM rag_app_message WHERE to_tsvector('{PG_CONFIG}', content) @@ websearch_to_tsquery('{PG_CONFIG}', %s)",
+            [text],
+        ))
+    return None
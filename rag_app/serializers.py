@@ -1,6 +1,8 @@
+from django.urls import reverse
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from .models import CustomUser, Document, Conversation, Message, MessageSource
+from .thumbnails import version_param
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     username_field = 'email'
@@ -63,7 +65,7 @@ class RegisterSerializer(serializers.ModelSerializer):
 class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
-        fields = ('id', 'original_name', 'file', 'created_at')
+        fields = ('id', 'original_name', 'file', 'sha256', 'size', 'page_count', 'created_at')
 
 class ConversationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -71,9 +73,19 @@ class ConversationSerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'created_at', 'updated_at')
 
 class MessageSourceSerializer(serializers.ModelSerializer):
+    image_url = serializers.SerializerMethodField()
+
     class Meta:
         model = MessageSource
-        fields = ('page', 'snippet', 'image_path', 'source', 'document')
+        fields = ('page', 'snippet', 'image_path', 'image_url', 'source', 'document')
+
+    def get_image_url(self, obj):
+        """Page preview endpoint (thumbnail sizes via ?width=), versioned by the image hash so it can be cached."""
+        if not obj.document_id or not obj.page:
+            return None
+        url = reverse('doc-page-image', kwargs={'pk': obj.document_id, 'page': obj.page})
+        version = version_param(obj.image_path)
+        return f"{url}?v={version}" if version else url
 
 class MessageSerializer(serializers.ModelSerializer):
     sources = MessageSourceSerializer(many=True, read_only=True)
@@ -1,40 +1,75 @@
 from __future__ import annotations
+import json
 import os
+import uuid
+import zlib
+from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import List, Dict, Any
 import chromadb
 from chromadb.config import Settings
 from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction as ChromaOpenAIEmbeddingFunction
 from django.conf import settings
+from .openai_helpers import embed_texts
 
-class ChromaStore:
-    def __init__(self, path: str | None = None, collection: str | None = None):
-        self.path = Path(path or settings.CHROMA_DIR)
-        self.path.mkdir(parents=True, exist_ok=True)
-        self.client = chromadb.PersistentClient(path=str(self.path), settings=Settings(allow_reset=True))
-        self.ef = ChromaOpenAIEmbeddingFunction(
-            api_key=os.getenv('OPENAI_API_KEY'),
-            model_name=os.getenv('OPENAI_EMBEDDING_MODEL', settings.OPENAI_EMBEDDING_MODEL),
-        )
-        self.coll = self.client.get_or_create_collection(
-            name=(collection or settings.CHROMA_COLLECTION),
-            embedding_function=self.ef,
-        )
+# Chunks are written in batches so a single embeddings request stays well under the API's token limit
+UPSERT_BATCH = 100
 
-    def upsert_chunks(self, user_id: int, document_id: int, chunks: List[dict]):
-        if not chunks:
-            return 0
-        existing = self.coll.get()
-        base = len(existing.get('ids', [])) if isinstance(existing, dict) else 0
-        ids, docs, metas = [], [], []
-        count = 0
+class VectorStore(ABC):
+    """Interface every vector backend implements. All operations are scoped to one user."""
+
+    @abstractmethod
+    def upsert_chunks(self, user_id: int, document_id: int, chunks: List[dict], embeddings: list | None = None) -> int:
+        """Index chunks ({text, page, source, image_path, chunk}); embeds them unless `embeddings` is given."""
+
+    @abstractmethod
+    def query(self, user_id: int, text: str, top_k: int = 8, document_ids: list[int] | None = None) -> list[dict]:
+        """Top-k hits for a query text, best first, each a dict of {'text', 'score', **metadata} (score: cosine similarity)."""
+
+    @abstractmethod
+    def query_by_vector(self, user_id: int, vector, top_k: int = 8, document_ids: list[int] | None = None) -> list[dict]:
+        """Same as query() for an already computed query embedding."""
+
+    def query_many(self, user_id: int, texts: list[str], top_k: int = 8, document_ids: list[int] | None = None) -> list[list[dict]]:
+        """Hits for several query texts at once, embedding them in a single request."""
+        if not texts:
+            return []
+        return [
+            self.query_by_vector(user_id, vec, top_k=top_k, document_ids=document_ids)
+            for vec in embed_texts(list(texts))
+        ]
+
+    @abstractmethod
+    def document_chunks(self, user_id: int, document_id: int) -> list[dict]:
+        """Every chunk of one document ({'text', **metadata}) in page / chunk order."""
+
+    @abstractmethod
+    def page_vectors(self, user_id: int, document_id: int, pages: list[int]) -> tuple[list[dict], list]:
+        """Chunks ({'text', **metadata}) of some pages of a document together with their stored embeddings."""
+
+    @abstractmethod
+    def delete_document(self, user_id: int, document_id: int):
+        ...
+
+    @abstractmethod
+    def delete_pages(self, user_id: int, document_id: int, pages: list[int]):
+        ...
+
+    @abstractmethod
+    def remap_pages(self, user_id: int, document_id: int, page_map: dict[int, int], source: str | None = None) -> int:
+        ...
+
+    @staticmethod
+    def chunk_records(user_id: int, document_id: int, chunks: List[dict]):
+        """Turn chunks into (ids, documents, metadatas, kept chunk indexes), skipping empty text."""
+        ids, docs, metas, kept = [], [], [], []
         for i, ch in enumerate(chunks):
             content = (ch.get('text') or '').strip()
             if not content:
                 continue
-            ids.append(str(base + len(ids)))
+            ids.append(uuid.uuid4().hex)
             docs.append(content)
-            md = {
+            metas.append({
                 'user_id': int(user_id),
                 'document_id': int(document_id),
                 'page': int(ch.get('page', 0)),
@@ -42,28 +77,175 @@ class ChromaStore:
                 'image_path': str(ch.get('image_path','')),
                 'content_type': 'page_image',
                 'chunk': int(ch.get('chunk', i))
-            }
-            metas.append(md)
-            count += 1
+            })
+            kept.append(i)
+        return ids, docs, metas, kept
+
+def get_vector_store(backend: str | None = None) -> VectorStore:
+    """Vector store selected by VECTOR_BACKEND ('chroma' or 'numpy')."""
+    backend = backend or settings.VECTOR_BACKEND
+    if backend == 'chroma':
+        return ChromaStore()
+    if backend == 'numpy':
+        from .numpy_store import NumpyStore
+        return NumpyStore()
+    raise ValueError(f"Unknown VECTOR_BACKEND {backend!r}, expected 'chroma' or 'numpy'")
+
+# Collection aliases live in a small JSON file next to the Chroma data:
+#   {alias: {"collection": <generation>, "embedding_model": ..., "embedding_dimensions": ..., "switched_at": ...}}
+# A store opened on CHROMA_COLLECTION follows the alias, re-checking the file (one stat) on every
+# operation, so `manage.py reindex_chroma` can swap in a rebuilt collection under running workers.
+ALIAS_FILE = 'aliases.json'
+
+def read_aliases(path) -> dict:
+    try:
+        with open(Path(path) / ALIAS_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def point_alias(path, alias: str, collection: str, **info) -> dict:
+    """Atomically point `alias` at `collection`; returns the previous entry ({} if there was none)."""
+    aliases = read_aliases(path)
+    previous = aliases.get(alias, {})
+    aliases[alias] = {'collection': collection, **info}
+    tmp = Path(path) / f".{ALIAS_FILE}.{os.getpid()}"
+    tmp.write_text(json.dumps(aliases, indent=2))
+    os.replace(tmp, Path(path) / ALIAS_FILE)
+    return previous
+
+# How user data is spread over Chroma collections:
+#   single   - one shared collection, queries filtered on user_id
+#   per_user - one collection per user ("<base>_u<user_id>")
+#   sharded  - CHROMA_SHARDS collections, user_id hashed to one ("<base>_s<NNN>")
+LAYOUTS = ('single', 'per_user', 'sharded')
+
+class ChromaStore(VectorStore):
+    def __init__(self, path: str | None = None, collection: str | None = None,
+                 layout: str | None = None, shards: int | None = None, follow_alias: bool = True,
+                 embedding_model: str | None = None, embedding_dimensions: int | None = None):
+        self.path = Path(path or settings.CHROMA_DIR)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.client = chromadb.PersistentClient(path=str(self.path), settings=Settings(allow_reset=True))
+        self.alias = collection or settings.CHROMA_COLLECTION
+        self.follow_alias = follow_alias
+        self.default_model = embedding_model or os.getenv('OPENAI_EMBEDDING_MODEL', settings.OPENAI_EMBEDDING_MODEL)
+        self.default_dimensions = settings.OPENAI_EMBEDDING_DIMENSIONS if embedding_dimensions is None else embedding_dimensions
+        self.layout = layout or settings.CHROMA_LAYOUT
+        if self.layout not in LAYOUTS:
+            raise ValueError(f"Unknown CHROMA_LAYOUT {self.layout!r}, expected one of {LAYOUTS}")
+        self.shards = int(shards or settings.CHROMA_SHARDS)
+        self._alias_stamp = None
+        self._use({})
+        if follow_alias:
+            self.resolve_alias()
+
+    def _use(self, entry: dict):
+        """Serve from the collection (and with the embedding model) of an alias entry."""
+        self.base_name = entry.get('collection') or self.alias
+        self.embedding_model = entry.get('embedding_model') or self.default_model
+        self.embedding_dimensions = entry.get('embedding_dimensions', self.default_dimensions)
+        self._ef = None
+        self._collections = {}
+
+    @property
+    def ef(self):
+        """
+        Embedding function recorded on the collections. Vectors are always passed in (see
+        _embed), so it is only built when a collection is opened, and can be replaced first.
+        """
+        if self._ef is None:
+            ef_kwargs = {}
+            if self.embedding_dimensions:
+                ef_kwargs['dimensions'] = self.embedding_dimensions
+            self._ef = ChromaOpenAIEmbeddingFunction(
+                api_key=os.getenv('OPENAI_API_KEY'),
+                model_name=self.embedding_model,
+                **ef_kwargs,
+            )
+        return self._ef
+
+    @ef.setter
+    def ef(self, value):
+        self._ef = value
+
+    def resolve_alias(self):
+        """Re-read the alias file if it changed since the last call."""
+        if not self.follow_alias:
+            return
+        try:
+            stamp = (self.path / ALIAS_FILE).stat().st_mtime_ns
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self._alias_stamp:
+            return
+        self._alias_stamp = stamp
+        entry = read_aliases(self.path).get(self.alias, {}) if stamp else {}
+        if entry.get('collection', self.alias) != self.base_name or entry.get('embedding_model', self.default_model) != self.embedding_model:
+            self._use(entry)
+
+    def _embed(self, texts: list[str]) -> list:
+        self.resolve_alias()
+        return embed_texts(texts, model=self.embedding_model, dimensions=self.embedding_dimensions)
+
+    # --- routing -------------------------------------------------------------
+
+    def collection_name(self, user_id: int) -> str:
+        """Name of the collection holding this user's vectors under the current layout."""
+        if self.layout == 'per_user':
+            return f"{self.base_name}_u{int(user_id)}"
+        if self.layout == 'sharded':
+            shard = zlib.crc32(str(int(user_id)).encode()) % self.shards
+            return f"{self.base_name}_s{shard:03d}"
+        return self.base_name
+
+    def collection_for(self, user_id: int):
+        self.resolve_alias()
+        name = self.collection_name(user_id)
+        coll = self._collections.get(name)
+        if coll is None:
+            coll = self.client.get_or_create_collection(name=name, embedding_function=self.ef)
+            self._collections[name] = coll
+        return coll
+
+    def layout_collections(self) -> list:
+        """All existing collections that belong to this store's layout."""
+        self.resolve_alias()
+        names = [c if isinstance(c, str) else c.name for c in self.client.list_collections()]
+        if self.layout == 'single':
+            wanted = [n for n in names if n == self.base_name]
+        else:
+            prefix = f"{self.base_name}_u" if self.layout == 'per_user' else f"{self.base_name}_s"
+            wanted = [n for n in names if n.startswith(prefix) and n[len(prefix):].isdigit()]
+        return [self.client.get_collection(name=n, embedding_function=self.ef) for n in sorted(wanted)]
+
+    def _scope(self, user_id: int, *clauses: dict) -> dict | None:
+        """Build a where filter for one user's data; per-user collections need no user_id clause."""
+        parts = list(clauses)
+        if self.layout != 'per_user':
+            parts.insert(0, {'user_id': int(user_id)})
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return parts[0]
+        return {'$and': parts}
+
+    # --- reads / writes --------------------------------------------------------
+
+    def upsert_chunks(self, user_id: int, document_id: int, chunks: List[dict], embeddings: list | None = None):
+        if not chunks:
+            return 0
+        ids, docs, metas, kept = self.chunk_records(user_id, document_id, chunks)
         if not ids:
             return 0
-        self.coll.upsert(ids=ids, documents=docs, metadatas=metas)
-        return count
-
-    # def query(self, user_id: int, text: str, top_k: int = 8) -> List[dict]:
-    #     res = self.coll.query(
-    #         query_texts=[text],
-    #         n_results=top_k,
-    #         where={'user_id': int(user_id)},
-    #         include=['documents','metadatas'],
-    #     )
-    #     if not res or not res.get('documents'):
-    #         return []
-    #     out = []
-    #     for doc, md in zip(res['documents'][0], res['metadatas'][0]):
-    #         out.append({'text': doc, **md})
-    #     return out
-    
+        coll = self.collection_for(user_id)
+        # embed through openai_helpers (not the collection's EF) so calls are metered like every other OpenAI request
+        vectors = self._embed(docs) if embeddings is None else [embeddings[i] for i in kept]
+        for start in range(0, len(ids), UPSERT_BATCH):
+            end = start + UPSERT_BATCH
+            coll.upsert(ids=ids[start:end], documents=docs[start:end], metadatas=metas[start:end], embeddings=vectors[start:end])
+        return len(ids)
+
     def query(
     self,
     user_id: int,
@@ -71,22 +253,85 @@ class ChromaStore:
     top_k: int = 8,
     document_ids: list[int] | None = None,  # new
     ) -> list[dict]:
-        where = {'user_id': int(user_id)}
+        return self._query(user_id, top_k, document_ids, query_embeddings=self._embed([text]))[0]
+
+    def query_by_vector(self, user_id: int, vector, top_k: int = 8, document_ids: list[int] | None = None) -> list[dict]:
+        return self._query(user_id, top_k, document_ids, query_embeddings=[vector])[0]
+
+    def query_many(self, user_id: int, texts: list[str], top_k: int = 8, document_ids: list[int] | None = None) -> list[list[dict]]:
+        # one embeddings request and one Chroma query for all texts
+        if not texts:
+            return []
+        return self._query(user_id, top_k, document_ids, query_embeddings=self._embed(list(texts)))
+
+    def _query(self, user_id: int, top_k: int, document_ids: list[int] | None, **query) -> list[list[dict]]:
+        clauses = []
         if document_ids:
             # restrict to one or more of the user's own docs
-            where['document_id'] = {'$in': [int(d) for d in document_ids]}
+            clauses.append({'document_id': {'$in': [int(d) for d in document_ids]}})
 
-        res = self.coll.query(
-            query_texts=[text],
+        res = self.collection_for(user_id).query(
             n_results=top_k,
-            where=where,
-            include=['documents','metadatas'],
+            where=self._scope(user_id, *clauses),
+            include=['documents','metadatas','distances'],
+            **query,
         )
-        out = []
+        n_queries = len(query['query_embeddings'])
+        out = [[] for _ in range(n_queries)]
         if res and res.get('documents'):
-            for doc, md in zip(res['documents'][0], res['metadatas'][0]):
-                out.append({'text': doc, **md})
+            for i, (docs, metas, dists) in enumerate(zip(res['documents'], res['metadatas'], res['distances'])):
+                for doc, md, dist in zip(docs, metas, dists):
+                    # collections use the default squared L2 space; for unit-length OpenAI embeddings cos = 1 - d/2
+                    out[i].append({'text': doc, 'score': round(1.0 - float(dist) / 2.0, 4), **md})
         return out
 
+    def document_chunks(self, user_id: int, document_id: int) -> list[dict]:
+        res = self.collection_for(user_id).get(
+            where=self._scope(user_id, {'document_id': int(document_id)}), include=['documents','metadatas'],
+        )
+        rows = [{'text': doc, **md} for doc, md in zip(res.get('documents') or [], res.get('metadatas') or [])]
+        return sorted(rows, key=lambda r: (int(r.get('page', 0)), int(r.get('chunk', 0))))
+
+    def page_vectors(self, user_id: int, document_id: int, pages: list[int]) -> tuple[list[dict], list]:
+        if not pages:
+            return [], []
+        res = self.collection_for(user_id).get(
+            where=self._scope(user_id, {'document_id': int(document_id)}, {'page': {'$in': [int(p) for p in pages]}}),
+            include=['documents', 'metadatas', 'embeddings'],
+        )
+        chunks = [{'text': doc, **md} for doc, md in zip(res.get('documents') or [], res.get('metadatas') or [])]
+        embeddings = res.get('embeddings')
+        return chunks, [] if embeddings is None else list(embeddings)
+
     def delete_document(self, user_id: int, document_id: int):
-        self.coll.delete(where={'$and': [{'user_id': int(user_id)}, {'document_id': int(document_id)}]})
+        self.collection_for(user_id).delete(where=self._scope(user_id, {'document_id': int(document_id)}))
+
+    def delete_pages(self, user_id: int, document_id: int, pages: list[int]):
+        """Drop the vectors of the given page numbers of one document."""
+        if not pages:
+            return
+        self.collection_for(user_id).delete(where=self._scope(
+            user_id,
+            {'document_id': int(document_id)},
+            {'page': {'$in': [int(p) for p in pages]}},
+        ))
+
+    def remap_pages(self, user_id: int, document_id: int, page_map: dict[int, int], source: str | None = None) -> int:
+        """Renumber pages (old -> new) of a document in place, without re-embedding."""
+        coll = self.collection_for(user_id)
+        res = coll.get(where=self._scope(user_id, {'document_id': int(document_id)}), include=['metadatas'])
+        ids, metas = [], []
+        for cid, md in zip(res.get('ids') or [], res.get('metadatas') or []):
+            old_page = int(md.get('page', 0))
+            if old_page not in page_map:
+                continue
+            new_md = dict(md)
+            new_md['page'] = int(page_map[old_page])
+            if source is not None:
+                new_md['source'] = str(source)
+            if new_md != md:
+                ids.append(cid)
+                metas.append(new_md)
+        if ids:
+            coll.update(ids=ids, metadatas=metas)
+        return len(ids)
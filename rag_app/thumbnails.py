@@ -0,0 +1,150 @@
+"""
+Page image previews for the chat UI.
+
+A variant (a width from THUMBNAIL_WIDTHS or the full size, as WebP, PNG or JPEG) is made
+on first request from the stored page image, or rendered from the PDF for pages indexed
+before images were kept, and cached at THUMBNAIL_DIR/<aa>/<key>-<width>.<type>. The key is
+the page's image hash, so a variant never changes: it is shared by every document with the
+same page and served with a strong ETag. The page URL itself is not content-addressed (a
+re-upload changes the image behind it), so responses are `no-cache` and revalidated with
+the ETag, unless the URL carries the image hash (?v=<hash>, as image_url does): those are
+cached for THUMBNAIL_MAX_AGE as immutable.
+
+file_response() hands the file to FileResponse (wsgi.file_wrapper / sendfile where the
+server has it) or, with MEDIA_SENDFILE_HEADER set, to the front-end web server, and
+answers conditional and single-range requests.
+"""
+import os
+import re
+import threading
+from pathlib import Path
+import fitz  # PyMuPDF
+from PIL import Image
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from .metrics import timed
+
+TYPES = {
+    'webp': ('WEBP', 'image/webp'),
+    'png': ('PNG', 'image/png'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def variant_key(page) -> str:
+    return page.image_hash or page.content_hash
+
+def variant_path(key: str, width: int, kind: str) -> Path:
+    return Path(settings.THUMBNAIL_DIR) / key[:2] / f"{key}-{width or 'full'}.{kind}"
+
+def etag_for(key: str, width: int, kind: str) -> str:
+    return f'"{key}-{width or "full"}.{kind}"'
+
+def drop_variants(key: str) -> int:
+    """Delete every cached variant of one page image; returns files removed."""
+    removed = 0
+    for path in (Path(settings.THUMBNAIL_DIR) / key[:2]).glob(f"{key}-*"):
+        path.unlink(missing_ok=True)
+        removed += 1
+    return removed
+
+def _source_image(page) -> Image.Image:
+    if page.image_path and os.path.exists(page.image_path):
+        return Image.open(page.image_path).convert('RGB')
+    # no stored render: draw the page from the PDF at the ingest resolution
+    with fitz.open(page.document.file.path) as pdf:
+        pix = pdf[page.page - 1].get_pixmap(dpi=200, alpha=False)
+        return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+def get_variant(page, width: int, kind: str) -> Path:
+    """Path of the cached variant of a DocumentPage's image, generating it if needed."""
+    if not width and kind == 'png' and page.image_path and os.path.exists(page.image_path):
+        return Path(page.image_path)  # the stored render is the full-size PNG
+    key = variant_key(page)
+    path = variant_path(key, width, kind)
+    if path.exists():
+        return path
+    with timed('thumbnail'):
+        img = _source_image(page)
+        if width and img.width > width:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+        img.save(tmp, format=TYPES[kind][0], quality=settings.THUMBNAIL_QUALITY)
+        os.replace(tmp, path)
+    return path
+
+class _RangeFile:
+    """Read-only view of `length` bytes of an open file from its current position."""
+
+    def __init__(self, f, length: int):
+        self.f, self.remaining = f, length
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+def _byte_range(header: str, size: int):
+    """(start, end) inclusive for a single `bytes=` range, None to ignore the header, or 'unsatisfiable'."""
+    m = RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if not m.group(1):
+        # suffix range: the last N bytes
+        length = int(m.group(2))
+        if length == 0:
+            return 'unsatisfiable'
+        return max(0, size - length), size - 1
+    start = int(m.group(1))
+    end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    if start >= size or end < start:
+        return 'unsatisfiable'
+    return start, end
+
+def version_param(image_path: str) -> str:
+    """The ?v= cache key for a stored page image path (its content hash), or '' for renders outside blob storage."""
+    stem = Path(image_path or '').stem
+    return stem if re.fullmatch(r'[0-9a-f]{64}', stem) else ''
+
+def file_response(request, path: Path, content_type: str, etag: str, immutable: bool = False) -> HttpResponse:
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f"private, max-age={settings.THUMBNAIL_MAX_AGE}, immutable" if immutable else 'private, no-cache',
+        'Accept-Ranges': 'bytes',
+    }
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (if_none_match.strip() == '*' or etag in parse_etags(if_none_match)):
+        return HttpResponseNotModified(headers=headers)
+
+    if settings.MEDIA_SENDFILE_HEADER:
+        # the web server streams the file (and handles ranges) itself
+        if settings.MEDIA_SENDFILE_HEADER.lower() == 'x-accel-redirect':
+            target = settings.MEDIA_SENDFILE_PREFIX + path.relative_to(settings.MEDIA_ROOT).as_posix()
+        else:
+            target = str(path)
+        return HttpResponse(content_type=content_type, headers={**headers, settings.MEDIA_SENDFILE_HEADER: target})
+
+    size = path.stat().st_size
+    header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    byte_range = _byte_range(header, size) if header and (not if_range or if_range == etag) else None
+    if byte_range == 'unsatisfiable':
+        return HttpResponse(status=416, headers={**headers, 'Content-Range': f"bytes */{size}"})
+    if byte_range is None:
+        return FileResponse(open(path, 'rb'), content_type=content_type, headers=headers)
+
+    start, end = byte_range
+    f = open(path, 'rb')
+    f.seek(start)
+    response = FileResponse(_RangeFile(f, end - start + 1), status=206, content_type=content_type, headers=headers)
+    response['Content-Range'] = f"bytes {start}-{end}/{size}"
+    response['Content-Length'] = str(end - start + 1)
+    return response
@@ -0,0 +1,95 @@
+"""
+Streaming PDF uploads.
+
+PDFUploadParser replaces DRF's multipart parser on the document endpoints. It refuses
+bodies whose Content-Length is over UPLOAD_MAX_BYTES before reading anything, and
+streams the file part to a temporary file chunk by chunk through HashingUploadHandler,
+which hashes it on the way, checks the PDF signature of the first chunk and aborts as
+soon as the byte limit is passed. Saving the document then moves the temporary file
+into MEDIA_ROOT instead of copying it.
+"""
+import hashlib
+import fitz  # PyMuPDF
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.parsers import MultiPartParser
+
+MULTIPART_OVERHEAD = 64 * 1024  # boundaries and form fields around the file part
+PDF_SIGNATURE = b'%PDF-'
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Uploaded file is too large.'
+    default_code = 'upload_too_large'
+
+class UnsupportedUpload(APIException):
+    status_code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    default_detail = 'Only PDF files can be uploaded.'
+    default_code = 'unsupported_upload'
+
+def _too_large() -> UploadTooLarge:
+    return UploadTooLarge(f"Uploaded file is larger than {settings.UPLOAD_MAX_BYTES} bytes.")
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """Writes the upload to a temporary file, computing its SHA-256 and size as the chunks arrive."""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        if self.content_length and self.content_length > settings.UPLOAD_MAX_BYTES:
+            raise _too_large()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0 and PDF_SIGNATURE not in raw_data[:1024]:
+            raise UnsupportedUpload()
+        self.size += len(raw_data)
+        if self.size > settings.UPLOAD_MAX_BYTES:
+            raise _too_large()
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        f = super().file_complete(file_size)
+        f.sha256 = self.sha256.hexdigest()
+        return f
+
+class PDFUploadParser(MultiPartParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if length > settings.UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD:
+            raise _too_large()
+        request.upload_handlers = [HashingUploadHandler(request._request)]
+        return super().parse(stream, media_type, parser_context)
+
+def upload_hash(f) -> str:
+    """SHA-256 of an uploaded file: taken from the streaming handler, or computed when another handler stored it."""
+    digest = getattr(f, 'sha256', None)
+    if digest:
+        return digest
+    h = hashlib.sha256()
+    for chunk in f.chunks():
+        h.update(chunk)
+    f.seek(0)
+    return h.hexdigest()
+
+def check_page_count(f) -> int:
+    """Page count of an uploaded PDF, raising if it cannot be opened or has more than UPLOAD_MAX_PAGES pages."""
+    try:
+        if hasattr(f, 'temporary_file_path'):
+            pdf = fitz.open(f.temporary_file_path())
+        else:
+            pdf = fitz.open(stream=f.read(), filetype='pdf')
+            f.seek(0)
+    except Exception:
+        raise ValidationError({'detail': 'The uploaded file is not a readable PDF.'})
+    with pdf:
+        pages = pdf.page_count
+    if pages == 0:
+        raise ValidationError({'detail': 'The uploaded PDF has no pages.'})
+    if settings.UPLOAD_MAX_PAGES and pages > settings.UPLOAD_MAX_PAGES:
+        raise ValidationError({'detail': f'The uploaded PDF has {pages} pages; the limit is {settings.UPLOAD_MAX_PAGES}.'})
+    return pages
@@ -3,8 +3,9 @@ from .views import (
     RegisterView, SendVerificationEmailView, VerifyEmailView,
     PasswordResetRequestView, PasswordResetConfirmView, ChangePasswordView,
     UserProfileView, ProfilePictureView, UpdateLLMModelView,
-    DocumentListCreateView, DocumentDetailView, DocumentFolderIngestView,
-    ConversationListCreateView, ConversationDetailView, MessageCreateView,
+    DocumentListCreateView, DocumentDetailView, DocumentFolderIngestView, DocumentPageImageView,
+    ConversationListCreateView, ConversationDetailView, MessageCreateView, MessageSearchView,
+    BatchRetrievalView, UsageSummaryView,
 )
 from rest_framework.permissions import AllowAny
 from rest_framework.decorators import api_view, permission_classes
@@ -23,9 +24,13 @@ urlpatterns = [
     path('docs/', DocumentListCreateView.as_view(), name='docs'),
     path('docs/folder', DocumentFolderIngestView.as_view(), name='doc-folder-ingest'),
     path('docs/<int:pk>/', DocumentDetailView.as_view(), name='doc-detail'),
+    path('docs/<int:pk>/pages/<int:page>/image/', DocumentPageImageView.as_view(), name='doc-page-image'),
     path('conversations/', ConversationListCreateView.as_view(), name='conversations'),
     path('conversations/<int:convo_id>/', ConversationDetailView.as_view(), name='conversation-detail'),
     path('conversations/<int:convo_id>/messages/', MessageCreateView.as_view(), name='message-create'),
+    path('messages/search/', MessageSearchView.as_view(), name='message-search'),
+    path('retrieve/batch/', BatchRetrievalView.as_view(), name='retrieve-batch'),
+    path('usage/', UsageSummaryView.as_view(), name='usage-summary'),
 ]
 
 @api_view(['GET'])
@@ -0,0 +1,244 @@
+"""
+OpenAI usage and cost accounting.
+
+Every OpenAI call made through openai_helpers is recorded as an OpenAIUsage row
+(tokens, latency, model, cost) attributed to whatever user / conversation /
+document / page is set with usage_context() around it. Rows are not inserted on
+the hot path: they go to an in-process buffer that is written with one
+bulk_create when it reaches USAGE_BUFFER_SIZE rows, every USAGE_FLUSH_INTERVAL
+seconds from a background thread, and at exit. rollup() folds raw rows into
+OpenAIUsageDaily totals.
+"""
+import atexit
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, CharField, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import OpenAIUsage, OpenAIUsageDaily
+
+ATTRIBUTION_FIELDS = ('user_id', 'conversation_id', 'document_id', 'page')
+COST_PRECISION = Decimal('0.00000001')  # matches OpenAIUsage.cost_usd decimal_places
+
+_context: contextvars.ContextVar = contextvars.ContextVar('rag_usage_context', default={})
+
+@contextmanager
+def usage_context(**ids):
+    """Attribute OpenAI calls made inside the block, e.g. usage_context(user_id=1, document_id=5)."""
+    token = _context.set({**_context.get(), **{k: v for k, v in ids.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+def attribute_usage(**url_kwargs):
+    """
+    Decorator for APIView handlers: attribute usage to request.user plus ids taken from
+    URL kwargs, e.g. @attribute_usage(conversation='convo_id', document='doc_id').
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            ids = {f"{field}_id": kwargs.get(kwarg) for field, kwarg in url_kwargs.items()}
+            with usage_context(user_id=getattr(request.user, 'id', None), **ids):
+                return method(self, request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def _price(model: str):
+    prices = settings.OPENAI_PRICES
+    if model in prices:
+        return prices[model]
+    # dated snapshots ("gpt-4o-2024-08-06") fall back to the longest matching family name
+    family = max((name for name in prices if model.startswith(name)), key=len, default=None)
+    return prices.get(family)
+
+def cached_tokens_of(usage) -> int:
+    """Prompt tokens served from the provider's prompt cache (usage.prompt_tokens_details.cached_tokens)."""
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return int(getattr(details, 'cached_tokens', 0) or 0)
+
+def cost_of(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> Decimal:
+    """
+    USD cost from OPENAI_PRICES (per million input / output [/ cached input] tokens); 0 for unknown
+    models. cached_tokens are part of prompt_tokens and billed at the cached rate when one is listed.
+    """
+    price = _price(model or '')
+    if not price:
+        return Decimal(0)
+    per_input, per_output = price[0], price[1]
+    per_cached = price[2] if len(price) > 2 else per_input
+    fresh = prompt_tokens - cached_tokens
+    return (
+        Decimal(str(per_input)) * fresh + Decimal(str(per_cached)) * cached_tokens + Decimal(str(per_output)) * completion_tokens
+    ) / Decimal(1_000_000)
+
+class UsageBuffer:
+    """Thread-safe buffer of unsaved OpenAIUsage rows, flushed in batches."""
+
+    def __init__(self, size: int, interval: float):
+        self.size = size
+        self.interval = interval
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def add(self, row: OpenAIUsage):
+        with self._lock:
+            self._rows.append(row)
+            batch = self._take() if len(self._rows) >= self.size else None
+            if self._flusher is None and self.interval > 0:
+                self._flusher = threading.Thread(target=self._run, name='usage-flusher', daemon=True)
+                self._flusher.start()
+        if batch:
+            self._write(batch)
+
+    def flush(self) -> int:
+        with self._lock:
+            batch = self._take()
+        return self._write(batch)
+
+    def pending(self) -> int:
+        return len(self._rows)
+
+    def _take(self) -> list:
+        rows, self._rows = self._rows, []
+        return rows
+
+    def _write(self, rows: list) -> int:
+        if not rows:
+            return 0
+        try:
+            OpenAIUsage.objects.bulk_create(rows, batch_size=500)
+            return len(rows)
+        except Exception as e:
+            # accounting must never break a request; the rows are dropped
+            print(f"[usage] failed to write {len(rows)} usage rows: {e}")
+            return 0
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if self._rows:
+                self.flush()
+                close_old_connections()
+
+buffer = UsageBuffer(size=settings.USAGE_BUFFER_SIZE, interval=settings.USAGE_FLUSH_INTERVAL)
+atexit.register(buffer.flush)
+
+def enabled() -> bool:
+    return settings.USAGE_TRACKING_ENABLED
+
+def record(endpoint: str, model: str, seconds: float, usage=None, success: bool = True, trace_id: str | None = None):
+    """Queue one usage row for the current attribution context."""
+    prompt = int(getattr(usage, 'prompt_tokens', 0) or 0)
+    completion = int(getattr(usage, 'completion_tokens', 0) or 0)
+    cached = min(cached_tokens_of(usage), prompt)
+    row = OpenAIUsage(
+        endpoint=endpoint,
+        model=model or '',
+        prompt_tokens=prompt,
+        completion_tokens=completion,
+        cached_tokens=cached,
+        latency_ms=round(seconds * 1000.0, 3),
+        cost_usd=cost_of(model, prompt, completion, cached),
+        success=success,
+        trace_id=trace_id or '',
+        **{k: v for k, v in _context.get().items() if k in ATTRIBUTION_FIELDS},
+    )
+    buffer.add(row)
+
+def rollup(since=None, until=None) -> int:
+    """
+    Recompute OpenAIUsageDaily for the days in [since, until] (dates, default: yesterday
+    and today) from the raw rows. Idempotent: the days are replaced, not incremented.
+    """
+    today = timezone.localdate()
+    since = since or today - timedelta(days=1)
+    until = until or today
+    raw = (
+        OpenAIUsage.objects
+        .filter(created_at__date__gte=since, created_at__date__lte=until)
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'user_id', 'document_id', 'endpoint', 'model')
+        .annotate(
+            calls=Count('id'),
+            errors=Count('id', filter=Q(success=False)),
+            prompt=Sum('prompt_tokens'),
+            completion=Sum('completion_tokens'),
+            cached=Sum('cached_tokens'),
+            latency=Sum('latency_ms'),
+            cost=Sum('cost_usd'),
+        )
+        .order_by()
+    )
+    rows = [
+        OpenAIUsageDaily(
+            day=r['day'], user_id=r['user_id'], document_id=r['document_id'], endpoint=r['endpoint'], model=r['model'],
+            calls=r['calls'], errors=r['errors'], prompt_tokens=r['prompt'] or 0, completion_tokens=r['completion'] or 0,
+            cached_tokens=r['cached'] or 0, latency_ms=r['latency'] or 0, cost_usd=r['cost'] or 0,
+        )
+        for r in raw
+    ]
+    with transaction.atomic():
+        OpenAIUsageDaily.objects.filter(day__gte=since, day__lte=until).delete()
+        OpenAIUsageDaily.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+def prune(older_than_days: int | None = None) -> int:
+    """Delete raw usage rows older than the retention (after they have been rolled up)."""
+    days = settings.USAGE_RETENTION_DAYS if older_than_days is None else older_than_days
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = OpenAIUsage.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+SUMMARY_GROUPS = {
+    'day': TruncDate('created_at'),
+    # calls that got any prompt-cache hit vs. none: compare their latency and cost
+    'cache': Case(When(cached_tokens__gt=0, then=Value('hit')), default=Value('miss'), output_field=CharField()),
+    'model': 'model',
+    'endpoint': 'endpoint',
+    'document': 'document_id',
+    'conversation': 'conversation_id',
+    'user': 'user_id',
+}
+
+def summarize(queryset, group_by: str, limit: int = 50) -> list[dict]:
+    """Token, latency and cost totals of `queryset` grouped by one dimension, most expensive first."""
+    key = SUMMARY_GROUPS[group_by]
+    qs = queryset.annotate(group=F(key) if isinstance(key, str) else key)
+    rows = (
+        qs.values('group')
+        .annotate(
+            calls=Count('id'),
+            errors=Count('id', filter=Q(success=False)),
+            prompt=Sum('prompt_tokens'),
+            completion=Sum('completion_tokens'),
+            cached=Sum('cached_tokens'),
+            latency=Sum('latency_ms'),
+            cost=Sum('cost_usd'),
+        )
+        .order_by('-cost', '-prompt')[:limit]
+    )
+    out = []
+    for r in rows:
+        calls = r['calls'] or 1
+        out.append({
+            group_by: r['group'],
+            'calls': r['calls'],
+            'errors': r['errors'],
+            'prompt_tokens': r['prompt'] or 0,
+            'completion_tokens': r['completion'] or 0,
+            'cached_tokens': r['cached'] or 0,
+            'cache_hit_ratio': round((r['cached'] or 0) / r['prompt'], 3) if r['prompt'] else 0.0,
+            'mean_latency_ms': round((r['latency'] or 0) / calls, 1),
+            'cost_usd': str(Decimal(r['cost'] or 0).quantize(COST_PRECISION)),
+        })
+    return out
@@ -1,87 +1,38 @@
+import contextvars
 import os
+from datetime import timedelta
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework_simplejwt.views import TokenObtainPairView
-from .models import CustomUser, Document, Conversation, Message, MessageSource
+from .models import Blob, CustomUser, Document, DocumentPage, Conversation, Message, MessageSource, OpenAIUsage
 from .serializers import (
     RegisterSerializer, CustomTokenObtainPairSerializer, DocumentSerializer, ConversationSerializer, MessageSerializer,
     PasswordResetRequestSerializer, PasswordResetConfirmSerializer, ChangePasswordSerializer,
     UserProfileSerializer, UserProfileUpdateSerializer, ProfilePictureSerializer
 )
-from .extract import extract_pdf_pages_as_images
-from .openai_helpers import vision_extract, synthesize_answer
-from .textutils import split_for_embedding
-from .store import ChromaStore
+from .openai_helpers import build_answer_messages, complete, rewrite_query, synthesize_answer
+from . import blobs, search, thumbnails
+from .ingest import ingest_document, reingest_document
+from .uploads import PDFUploadParser, check_page_count, upload_hash
+from .store import get_vector_store
+from .routing import choose_route, classify_intent, needs_rewrite
+from .prompts import pinned_document_context
+from .metrics import timed
+from .usage import COST_PRECISION, SUMMARY_GROUPS, attribute_usage, summarize, usage_context
 from .email_service import (
     create_verification_token, send_verification_email, verify_email_token,
     create_password_reset_token, send_password_reset_email, verify_password_reset_token, use_password_reset_token
 )
 
-def is_generic_conversation_query(text: str) -> bool:
-    """
-    Detect if a query is generic/conversational and doesn't need RAG retrieval.
-    """
-    # Convert to lowercase for easier matching
-    text_lower = text.lower().strip()
-    
-    # Common greeting patterns
-    greetings = [
-        'hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening',
-        'how are you', 'how do you do', 'nice to meet you', 'pleasure to meet you',
-        'greetings', 'good day', 'good evening', 'good afternoon'
-    ]
-    
-    # Common gratitude patterns
-    gratitude = [
-        'thank you', 'thanks', 'thank you so much', 'thanks a lot', 'appreciate it',
-        'grateful', 'bless you', 'you\'re the best', 'awesome', 'great job',
-        'excellent', 'fantastic', 'wonderful', 'amazing', 'perfect'
-    ]
-    
-    # Common farewell patterns
-    farewells = [
-        'goodbye', 'bye', 'see you', 'see you later', 'take care', 'have a good day',
-        'good night', 'goodbye for now', 'talk to you later', 'farewell',
-        'until next time', 'see you soon', 'take care'
-    ]
-    
-    # Common casual conversation patterns
-    casual = [
-        'how\'s it going', 'what\'s up', 'sup', 'how are things', 'everything ok',
-        'are you ok', 'are you there', 'can you hear me', 'are you working',
-        'how are you doing', 'what\'s new', 'how\'s everything', 'how\'s life'
-    ]
-    
-    # Common acknowledgment patterns
-    acknowledgments = [
-        'ok', 'okay', 'alright', 'sure', 'yes', 'yeah', 'yep', 'got it',
-        'understood', 'i see', 'i understand', 'noted', 'roger'
-    ]
-    
-    # Check if the text matches any of these patterns
-    for pattern in greetings + gratitude + farewells + casual + acknowledgments:
-        if pattern in text_lower:
-            return True
-    
-    # Check for very short queries (likely conversational)
-    if len(text_lower.split()) <= 3:
-        return True
-    
-    # Check for questions that don't seem document-related
-    if any(word in text_lower for word in ['you', 'your', 'yourself']) and len(text_lower.split()) <= 5:
-        return True
-    
-    # Check for single words that are likely conversational
-    single_words = ['ok', 'okay', 'yes', 'no', 'maybe', 'sure', 'alright', 'fine']
-    if text_lower in single_words:
-        return True
-    
-    return False
-
 def get_conversation_context(conversation, max_messages: int = 10, include_current_user_message: bool = False) -> List[dict]:
     """
     Get conversation history for context, limiting to recent messages to avoid token limits.
@@ -105,8 +56,12 @@ def get_conversation_context(conversation, max_messages: int = 10, include_curre
     # First, get the total count to calculate the offset
     total_count = previous_messages.count()
     if total_count > max_messages:
-        # Get messages from the end (total_count - max_messages) to the end
+        # Get messages from the end (total_count - max_messages) to the end, moving the start in steps of
+        # PROMPT_HISTORY_STEP so the prompt's history prefix stays identical (and cacheable) for several turns
         offset = total_count - max_messages
+        step = settings.PROMPT_HISTORY_STEP
+        if step > 1:
+            offset = -(-offset // step) * step
         recent_messages = previous_messages[offset:]
     else:
         # If we have fewer messages than max_messages, get all of them
@@ -202,56 +157,144 @@ class VerifyEmailView(APIView):
         except CustomUser.DoesNotExist:
             return Response({'detail': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
 
+def save_message_sources(message, hits: list[dict], user, default=None) -> None:
+    """Store retrieval hits as the message's sources, linked through their document_id metadata."""
+    ids = set()
+    for h in hits:
+        try:
+            ids.add(int(h.get('document_id')))
+        except (TypeError, ValueError):
+            pass
+    docs = Document.objects.filter(owner=user, id__in=ids).in_bulk()
+    rows = []
+    for h in hits:
+        try:
+            doc = docs.get(int(h.get('document_id'))) or default
+        except (TypeError, ValueError):
+            doc = default
+        rows.append(MessageSource(
+            message=message,
+            document=doc,
+            page=h.get('page', 0),
+            snippet=(h.get('text') or '')[:500],
+            image_path=h.get('image_path', ''),
+            # chunk sources are stored file paths (blob hashes); show the name it was uploaded under
+            source=doc.original_name if doc else os.path.basename(str(h.get('source', ''))),
+        ))
+    MessageSource.objects.bulk_create(rows)
+
 class DocumentListCreateView(APIView):
-    parser_classes = (MultiPartParser, FormParser)
+    parser_classes = (PDFUploadParser, FormParser)
 
     def get(self, request):
         docs = Document.objects.filter(owner=request.user).order_by('-created_at')
         return Response(DocumentSerializer(docs, many=True).data)
 
+    @attribute_usage()
     def post(self, request):
         if 'file' not in request.data:
             return Response({'detail':'No file uploaded'}, status=400)
         f = request.data['file']
+        sha256 = upload_hash(f)
+        existing = Document.objects.filter(owner=request.user, sha256=sha256).order_by('id').first()
+        if existing:
+            # same bytes as a document the user already has: nothing to store or ingest
+            return Response({'document': DocumentSerializer(existing).data, 'chunks_indexed': 0, 'duplicate': True})
+        page_count = check_page_count(f)
+        # identical files of different users share one stored copy
+        blob = blobs.acquire(Blob.PDF, sha256, content=f)
         doc = Document.objects.create(
             owner=request.user,
-            file=f,
+            file=blob.name,
             original_name=getattr(f, 'name', 'uploaded.pdf'),
+            size=f.size,
+            page_count=page_count,
         )
-        # Ingest: render pages -> vision -> chunk -> chroma
-        store = ChromaStore()
-        abs_path = doc.file.path
-        records = extract_pdf_pages_as_images(abs_path, out_dir=settings.MEDIA_ROOT, dpi=200, max_pages=None)
-        chunks = []
-        for rec in records:
-            info = vision_extract(rec['image_path'])
-            print(info)
-            text = (info.get('extracted_text') or '').strip()
-            desc = (info.get('description') or '').strip()
-            content = text if text else desc
-            for idx, chunk in enumerate(split_for_embedding(content)):
-                chunks.append({
-                    'text': chunk,
-                    'page': rec['page'],
-                    'source': rec['source'],
-                    'image_path': rec['image_path'],
-                    'chunk': idx,
-                })
-        stored = store.upsert_chunks(user_id=request.user.id, document_id=doc.id, chunks=chunks)
+        # Ingest: render pages -> vision -> chunk -> vector store
+        with usage_context(document_id=doc.id):
+            stored = ingest_document(doc, get_vector_store())
+        # only an indexed document counts as a duplicate of later uploads; a failed ingest can be retried
+        doc.sha256 = sha256
+        doc.save(update_fields=['sha256'])
         return Response({'document': DocumentSerializer(doc).data, 'chunks_indexed': stored}, status=201)
 
 class DocumentDetailView(APIView):
+    parser_classes = (PDFUploadParser, FormParser)
+
+    @attribute_usage(document='pk')
+    def put(self, request, pk):
+        """Replace a document's file, re-indexing only the pages that changed"""
+        try:
+            doc = Document.objects.get(pk=pk, owner=request.user)
+        except Document.DoesNotExist:
+            return Response(status=404)
+        if 'file' not in request.data:
+            return Response({'detail':'No file uploaded'}, status=400)
+        f = request.data['file']
+        sha256 = upload_hash(f)
+        if sha256 == doc.sha256:
+            return Response({'document': DocumentSerializer(doc).data, 'pages_total': doc.page_count, 'unchanged': True})
+        page_count = check_page_count(f)
+        blob = blobs.acquire(Blob.PDF, sha256, content=f)
+        blobs.release_file(doc)
+        doc.file = blob.name
+        doc.original_name = getattr(f, 'name', doc.original_name)
+        # cleared until the new file is indexed, so a failed re-ingest isn't taken as unchanged on retry
+        doc.sha256, doc.size, doc.page_count = '', f.size, page_count
+        doc.save()
+        summary = reingest_document(doc, get_vector_store())
+        doc.sha256 = sha256
+        doc.save(update_fields=['sha256'])
+        return Response({'document': DocumentSerializer(doc).data, **summary})
+
     def delete(self, request, pk):
         try:
             doc = Document.objects.get(pk=pk, owner=request.user)
         except Document.DoesNotExist:
             return Response(status=404)
-        # delete from chroma
-        ChromaStore().delete_document(user_id=request.user.id, document_id=doc.id)
-        doc.file.delete(save=False)
+        # delete from the vector store
+        get_vector_store().delete_document(user_id=request.user.id, document_id=doc.id)
+        blobs.release_document(doc)
         doc.delete()
         return Response(status=204)
 
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """Image responses bypass renderers, so an `Accept: image/*` header must not lead to a 406."""
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+class DocumentPageImageView(APIView):
+    """
+    Preview of one page: GET /api/docs/{id}/pages/{page}/image/?width=320&type=webp
+    (width: one of THUMBNAIL_WIDTHS or 'full'; type: webp, png or jpeg; v: the image hash, see thumbnails).
+    """
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, pk, page):
+        try:
+            p = DocumentPage.objects.select_related('document').get(document_id=pk, document__owner=request.user, page=page)
+        except DocumentPage.DoesNotExist:
+            return Response(status=404)
+        width = request.query_params.get('width', str(settings.THUMBNAIL_DEFAULT_WIDTH))
+        if width == 'full':
+            width = 0
+        elif not width.isdigit() or int(width) not in settings.THUMBNAIL_WIDTHS:
+            return Response({'detail': f"width must be 'full' or one of {list(settings.THUMBNAIL_WIDTHS)}"}, status=400)
+        kind = request.query_params.get('type', 'webp')
+        if kind not in thumbnails.TYPES:
+            return Response({'detail': f"type must be one of {list(thumbnails.TYPES)}"}, status=400)
+        width = int(width)
+        path = thumbnails.get_variant(p, width, kind)
+        key = thumbnails.variant_key(p)
+        etag = thumbnails.etag_for(key, width, kind)
+        # only a URL naming this exact image may be cached without revalidation
+        immutable = request.query_params.get('v') == key
+        return thumbnails.file_response(request, path, thumbnails.TYPES[kind][1], etag, immutable=immutable)
+
 class ConversationListCreateView(APIView):
     def get(self, request):
         convos = Conversation.objects.filter(owner=request.user).order_by('-updated_at')
@@ -266,6 +309,7 @@ class ConversationListCreateView(APIView):
 
 
 class MessageCreateView(APIView):
+    @attribute_usage(conversation='convo_id')
     def post(self, request, convo_id):
         try:
             convo = Conversation.objects.get(pk=convo_id, owner=request.user)
@@ -284,10 +328,10 @@ class MessageCreateView(APIView):
                 doc_ids = [int(single)]
 
         # (optional) safety: ensure provided doc_ids belong to this user
+        pinned_docs = []
         if doc_ids:
-            owned = set(
-                Document.objects.filter(owner=request.user, id__in=doc_ids).values_list('id', flat=True)
-            )
+            pinned_docs = list(Document.objects.filter(owner=request.user, id__in=doc_ids))
+            owned = {d.id for d in pinned_docs}
             doc_ids = [int(d) for d in doc_ids if int(d) in owned]
             if not doc_ids:
                 return Response({'detail': 'No matching documents owned by user.'}, status=400)        
@@ -305,65 +349,72 @@ class MessageCreateView(APIView):
         else:
             max_context = 12  # Full context for short conversations
             
-        conversation_history = get_conversation_context(convo, max_messages=max_context, include_current_user_message=False)
+        with timed('context'):
+            conversation_history = get_conversation_context(convo, max_messages=max_context, include_current_user_message=False)
         
         # Check if this is a generic conversation query
-        is_generic = is_generic_conversation_query(user_text)
+        with timed('route'):
+            intent = classify_intent(user_text)
+            is_generic = intent.is_chitchat
+        provider = request.user.preferred_llm
         
         if is_generic:
-            # For generic queries, skip RAG retrieval and use conversational response
-            answer = synthesize_answer(user_text, [], conversation_history)
-            m_assist = Message.objects.create(conversation=convo, role='assistant', content=answer)
-            
-            # Update conversation's updated_at field to reflect the new message
-            from django.utils import timezone
-            convo.updated_at = timezone.now()
-            convo.save()
+            # For generic queries, skip RAG retrieval; pure greetings/thanks get a canned reply, the rest the small model
+            with timed('synthesize'):
+                messages = build_answer_messages(user_text, [], conversation_history)
+                route = choose_route(user_text, intent, messages=messages, name=request.user.first_name)
+                answer = route.reply or complete(messages, provider=provider, tier=route.tier)
+            with timed('db_write'):
+                m_assist = Message.objects.create(conversation=convo, role='assistant', content=answer)
+                
+                # Update conversation's updated_at field to reflect the new message
+                from django.utils import timezone
+                convo.updated_at = timezone.now()
+                convo.save()
             
             return Response({
                 'assistant': MessageSerializer(m_assist).data,
                 'retrieved': [],
                 'is_generic_conversation': True,
+                'route': route.tier,
             }, status=201)
         else:
             # For document-related queries, use RAG retrieval
-            store = ChromaStore()
-            hits = store.query(user_id=request.user.id, text=user_text, top_k=int(request.data.get('top_k',8)), document_ids=doc_ids)
-
-            # synthesize answer with conversation history
-            answer = synthesize_answer(user_text, hits, conversation_history)
-            m_assist = Message.objects.create(conversation=convo, role='assistant', content=answer)
-
-            # Update conversation's updated_at field to reflect the new message
-            from django.utils import timezone
-            convo.updated_at = timezone.now()
-            convo.save()
-
-            # track sources (first few)
-            for h in hits[:5]:
-                # Best-effort mapping to Document by filename
-                doc = None
-                try:
-                    src_name = os.path.basename(str(h.get('source','')))
-                    doc = Document.objects.filter(owner=request.user, original_name__icontains=src_name).first()
-                except Exception:
-                    doc = None
-                MessageSource.objects.create(
-                    message=m_assist,
-                    document=doc,
-                    page=h.get('page',0),
-                    snippet=(h.get('text') or '')[:500],
-                    image_path=h.get('image_path',''),
-                    source=h.get('source',''),
-                )
+            search_text = user_text
+            if settings.LLM_QUERY_REWRITE and needs_rewrite(user_text, conversation_history):
+                with timed('rewrite'):
+                    search_text = rewrite_query(user_text, conversation_history, provider=provider)
+            with timed('retrieve'):
+                store = get_vector_store()
+                hits = store.query(user_id=request.user.id, text=search_text, top_k=int(request.data.get('top_k',8)), document_ids=doc_ids)
+                # small pinned documents are sent whole, ahead of the history, as a prefix that stays cached across turns
+                pinned = pinned_document_context(store, request.user.id, pinned_docs) if pinned_docs else None
+
+            # synthesize answer with conversation history, on the small or full-size model
+            with timed('synthesize'):
+                messages = build_answer_messages(user_text, [] if pinned else hits, conversation_history, pinned=pinned)
+                route = choose_route(user_text, hits=hits, messages=messages)
+                answer = complete(messages, provider=provider, tier=route.tier)
+            with timed('db_write'):
+                m_assist = Message.objects.create(conversation=convo, role='assistant', content=answer)
+
+                # Update conversation's updated_at field to reflect the new message
+                from django.utils import timezone
+                convo.updated_at = timezone.now()
+                convo.save()
+
+                # track sources (first few)
+                save_message_sources(m_assist, hits[:5], request.user)
 
             return Response({
                 'assistant': MessageSerializer(m_assist).data,
                 'retrieved': hits,
                 'is_generic_conversation': False,
+                'route': route.tier,
             }, status=201)
 
 class DocumentQuestionView(APIView):
+    @attribute_usage(conversation='convo_id', document='doc_id')
     def post(self, request, convo_id, doc_id):
         """
         Ask a specific question about a document within a conversation.
@@ -397,71 +448,136 @@ class DocumentQuestionView(APIView):
         else:
             max_context = 12  # Full context for short conversations
             
-        conversation_history = get_conversation_context(convo, max_messages=max_context, include_current_user_message=False)
+        with timed('context'):
+            conversation_history = get_conversation_context(convo, max_messages=max_context, include_current_user_message=False)
 
         # Check if this is a generic conversation query
-        is_generic = is_generic_conversation_query(user_text)
+        with timed('route'):
+            intent = classify_intent(user_text)
+            is_generic = intent.is_chitchat
+        provider = request.user.preferred_llm
         
         if is_generic:
-            # For generic queries, skip RAG retrieval and use conversational response
-            answer = synthesize_answer(user_text, [], conversation_history)
-            m_assist = Message.objects.create(conversation=convo, role='assistant', content=answer)
-            
-            # Update conversation's updated_at field to reflect the new message
-            from django.utils import timezone
-            convo.updated_at = timezone.now()
-            convo.save()
+            # For generic queries, skip RAG retrieval; pure greetings/thanks get a canned reply, the rest the small model
+            with timed('synthesize'):
+                messages = build_answer_messages(user_text, [], conversation_history)
+                route = choose_route(user_text, intent, messages=messages, name=request.user.first_name)
+                answer = route.reply or complete(messages, provider=provider, tier=route.tier)
+            with timed('db_write'):
+                m_assist = Message.objects.create(conversation=convo, role='assistant', content=answer)
+                
+                # Update conversation's updated_at field to reflect the new message
+                from django.utils import timezone
+                convo.updated_at = timezone.now()
+                convo.save()
             
             return Response({
                 'assistant': MessageSerializer(m_assist).data,
                 'retrieved': [],
                 'is_generic_conversation': True,
+                'route': route.tier,
                 'document_id': doc_id,
             }, status=201)
         else:
             # For document-related queries, use RAG retrieval on the specific document
-            store = ChromaStore()
-            hits = store.query(
-                user_id=request.user.id, 
-                text=user_text, 
-                top_k=int(request.data.get('top_k', 8)), 
-                document_ids=[doc_id]
-            )
-
-            # synthesize answer with conversation history
-            answer = synthesize_answer(user_text, hits, conversation_history)
-            m_assist = Message.objects.create(conversation=convo, role='assistant', content=answer)
-
-            # Update conversation's updated_at field to reflect the new message
-            from django.utils import timezone
-            convo.updated_at = timezone.now()
-            convo.save()
-
-            # track sources (first few)
-            for h in hits[:5]:
-                # Best-effort mapping to Document by filename
-                doc_source = None
-                try:
-                    src_name = os.path.basename(str(h.get('source','')))
-                    doc_source = Document.objects.filter(owner=request.user, original_name__icontains=src_name).first()
-                except Exception:
-                    doc_source = None
-                MessageSource.objects.create(
-                    message=m_assist,
-                    document=doc_source or doc,  # Use the specific document if mapping fails
-                    page=h.get('page',0),
-                    snippet=(h.get('text') or '')[:500],
-                    image_path=h.get('image_path',''),
-                    source=h.get('source',''),
+            search_text = user_text
+            if settings.LLM_QUERY_REWRITE and needs_rewrite(user_text, conversation_history):
+                with timed('rewrite'):
+                    search_text = rewrite_query(user_text, conversation_history, provider=provider)
+            with timed('retrieve'):
+                store = get_vector_store()
+                hits = store.query(
+                    user_id=request.user.id, 
+                    text=search_text, 
+                    top_k=int(request.data.get('top_k', 8)), 
+                    document_ids=[doc_id]
                 )
+                # a small document is sent whole, ahead of the history, as a prefix that stays cached across turns
+                pinned = pinned_document_context(store, request.user.id, [doc])
+
+            # synthesize answer with conversation history, on the small or full-size model
+            with timed('synthesize'):
+                messages = build_answer_messages(user_text, [] if pinned else hits, conversation_history, pinned=pinned)
+                route = choose_route(user_text, hits=hits, messages=messages)
+                answer = complete(messages, provider=provider, tier=route.tier)
+            with timed('db_write'):
+                m_assist = Message.objects.create(conversation=convo, role='assistant', content=answer)
+
+                # Update conversation's updated_at field to reflect the new message
+                from django.utils import timezone
+                convo.updated_at = timezone.now()
+                convo.save()
+
+                # track sources (first few)
+                save_message_sources(m_assist, hits[:5], request.user, default=doc)
 
             return Response({
                 'assistant': MessageSerializer(m_assist).data,
                 'retrieved': hits,
                 'is_generic_conversation': False,
+                'route': route.tier,
                 'document_id': doc_id,
             }, status=201)
 
+class BatchRetrievalView(APIView):
+    @attribute_usage()
+    def post(self, request):
+        """
+        Retrieve ranked hits for many questions in one call: all queries are embedded
+        in a single request and searched with a single vector-store query. With
+        `synthesize: true` an answer is generated per query, at most
+        BATCH_SYNTHESIS_CONCURRENCY at a time. Nothing is stored in any conversation.
+        """
+        queries = request.data.get('queries')
+        if not isinstance(queries, list) or not queries:
+            return Response({'detail': 'queries must be a non-empty list'}, status=400)
+        queries = [str(q).strip() for q in queries]
+        if not all(queries):
+            return Response({'detail': 'queries must not contain empty strings'}, status=400)
+        if len(queries) > settings.BATCH_RETRIEVAL_MAX_QUERIES:
+            return Response({'detail': f'At most {settings.BATCH_RETRIEVAL_MAX_QUERIES} queries per request'}, status=400)
+
+        doc_ids = request.data.get('document_ids', None)
+        if doc_ids is not None and not isinstance(doc_ids, list):
+            return Response({'detail': 'document_ids must be a list of integers'}, status=400)
+        try:
+            doc_ids = [int(d) for d in doc_ids] if doc_ids else None
+            top_k = max(1, min(int(request.data.get('top_k', 8)), 100))
+        except (TypeError, ValueError):
+            return Response({'detail': 'document_ids and top_k must be integers'}, status=400)
+        # the database takes 64-bit integers for ids
+        if doc_ids and not all(0 < d <= search.MAX_INT for d in doc_ids):
+            return Response({'detail': 'document_ids are out of range'}, status=400)
+        if doc_ids:
+            owned = set(
+                Document.objects.filter(owner=request.user, id__in=doc_ids).values_list('id', flat=True)
+            )
+            doc_ids = [d for d in doc_ids if d in owned]
+            if not doc_ids:
+                return Response({'detail': 'No matching documents owned by user.'}, status=400)
+
+        with timed('retrieve'):
+            all_hits = get_vector_store().query_many(user_id=request.user.id, texts=queries, top_k=top_k, document_ids=doc_ids)
+
+        answers = None
+        if request.data.get('synthesize'):
+            workers = max(1, min(settings.BATCH_SYNTHESIS_CONCURRENCY, len(queries)))
+            # run each answer in a copy of this request's context, so usage and trace attribution carry over
+            ctx = contextvars.copy_context()
+            provider = request.user.preferred_llm
+            tiers = [choose_route(q, hits=h, messages=build_answer_messages(q, h)).tier for q, h in zip(queries, all_hits)]
+            with timed('synthesize'), ThreadPoolExecutor(max_workers=workers) as pool:
+                answers = list(pool.map(lambda qht: ctx.copy().run(synthesize_answer, qht[0], qht[1], [], provider, qht[2]),
+                                        zip(queries, all_hits, tiers)))
+
+        results = []
+        for i, (query, hits) in enumerate(zip(queries, all_hits)):
+            item = {'query': query, 'hits': hits}
+            if answers is not None:
+                item['answer'] = answers[i]
+            results.append(item)
+        return Response({'results': results})
+
 class ConversationDetailView(APIView):
     def get(self, request, convo_id):
         try:
@@ -494,6 +610,42 @@ class ConversationDetailView(APIView):
         convo.save()
         return Response(ConversationSerializer(convo).data)
 
+class MessageSearchView(APIView):
+    """
+    Full-text search over the caller's messages: GET /api/messages/search/?q=...&page=1&page_size=20
+    (optional conversation=<id>, role=user|assistant). Hits are ranked, with highlighted snippets.
+    """
+    def get(self, request):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'detail': 'q is required'}, status=400)
+        try:
+            page = max(1, int(request.query_params.get('page', 1)))
+            page_size = max(1, min(int(request.query_params.get('page_size', 20)), 100))
+            conversation = request.query_params.get('conversation')
+            conversation = int(conversation) if conversation else None
+        except ValueError:
+            return Response({'detail': 'page, page_size and conversation must be integers'}, status=400)
+        # the database takes 64-bit integers for ids and OFFSET
+        if (page - 1) * page_size > search.MAX_INT or (conversation is not None and not 0 < conversation <= search.MAX_INT):
+            return Response({'detail': 'page or conversation is out of range'}, status=400)
+        role = request.query_params.get('role') or None
+        if role and role not in dict(Message.ROLE_CHOICES):
+            return Response({'detail': f"role must be one of {[r for r, _ in Message.ROLE_CHOICES]}"}, status=400)
+
+        with timed('message_search'):
+            hits, more = search.search_messages(
+                request.user.id, text, conversation_id=conversation, role=role,
+                offset=(page - 1) * page_size, limit=page_size,
+            )
+        return Response({
+            'query': text,
+            'page': page,
+            'page_size': page_size,
+            'next_page': page + 1 if more else None,
+            'results': hits,
+        })
+
 class PasswordResetRequestView(APIView):
     permission_classes = [permissions.AllowAny]
     
@@ -692,6 +844,7 @@ class DocumentFolderIngestView(APIView):
     """
     permission_classes = [permissions.IsAuthenticated]
     
+    @attribute_usage()
     def post(self, request):
         folder_path = request.data.get('folder_path')
         if not folder_path:
@@ -700,7 +853,7 @@ class DocumentFolderIngestView(APIView):
         if not os.path.isdir(folder_path):
             return Response({'detail': 'Invalid folder path'}, status=400)
         
-        store = ChromaStore()
+        store = get_vector_store()
         count = 0
         
         try:
@@ -714,24 +867,38 @@ class DocumentFolderIngestView(APIView):
                             file=f,
                             original_name=filename,
                         )
-                        records = extract_pdf_pages_as_images(doc.file.path, out_dir=settings.MEDIA_ROOT, dpi=200, max_pages=None)
-                        chunks = []
-                        for rec in records:
-                            info = vision_extract(rec['image_path'])
-                            text = (info.get('extracted_text') or '').strip()
-                            desc = (info.get('description') or '').strip()
-                            content = text if text else desc
-                            for idx, chunk in enumerate(split_for_embedding(content)):
-                                chunks.append({
-                                    'text': chunk,
-                                    'page': rec['page'],
-                                    'source': rec['source'],
-                                    'image_path': rec['image_path'],
-                                    'chunk': idx,
-                                })
-                        stored = store.upsert_chunks(user_id=request.user.id, document_id=doc.id, chunks=chunks)
-                        count += stored
+                        with usage_context(document_id=doc.id):
+                            count += ingest_document(doc, store)
         except Exception as e:
             return Response({'detail': f'Error during ingestion: {str(e)}'}, status=500)
         
-        return Response({'detail': f'Ingested {count} chunks from {len(os.listdir(folder_path))} files.'}, status=201)
\ No newline at end of file
+        return Response({'detail': f'Ingested {count} chunks from {len(os.listdir(folder_path))} files.'}, status=201)
+
+class UsageSummaryView(APIView):
+    """
+    OpenAI token usage and cost, grouped by day, model, endpoint, document, conversation or user.
+    Staff can pass scope=all to see every user's usage; otherwise only the caller's own calls are counted.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        group_by = request.query_params.get('group_by', 'day')
+        if group_by not in SUMMARY_GROUPS:
+            return Response({'detail': f'group_by must be one of: {", ".join(SUMMARY_GROUPS)}'}, status=400)
+        try:
+            # raw rows older than the retention period are pruned, so longer ranges would under-report
+            days = max(1, min(int(request.query_params.get('days', 30)), settings.USAGE_RETENTION_DAYS))
+        except ValueError:
+            return Response({'detail': 'days must be an integer'}, status=400)
+
+        everyone = request.query_params.get('scope') == 'all'
+        if (everyone or group_by == 'user') and not request.user.is_staff:
+            return Response({'detail': 'Only staff can view usage across users'}, status=403)
+
+        qs = OpenAIUsage.objects.filter(created_at__gte=timezone.now() - timedelta(days=days))
+        if not everyone:
+            qs = qs.filter(user_id=request.user.id)
+        rows = summarize(qs, group_by)
+        # over every row, not just the groups summarize() returns
+        total = Decimal(qs.aggregate(total=Sum('cost_usd'))['total'] or 0).quantize(COST_PRECISION)
+        return Response({'group_by': group_by, 'days': days, 'total_cost_usd': str(total), 'results': rows})